@@ -21,47 +21,43 @@ def init_score(dag):
     """
     Initializing scores of nodes in DAG
     """
-    for node in dag:
-        node['score'] = 0
+    dag.score = [0] * len(dag)
 
 
 def init_edge_weights(dag):
     """
     Assigning weights to edges in DAG
-    Returns a dict with keys as (start_node_index, end_node_index) and 
-                                values as edge-weights b/w these indexes
-    """
-    edge_weights = {}
-    for node in dag:
-        for prev_node in node['incoming']:
-            edge_weights[str(prev_node), str(node['index'])] = \
-                len(dag[prev_node]['sequences'].intersection(node['sequences']))
+    Returns an array with the edge-weight of each edge, in the same order as
+    dag.incoming (i.e. edge_weights[e] is the weight of dag.incoming[e] -> node)
 
-    return edge_weights
+    The weight of an edge is the no. of sequences shared by its two nodes, i.e.
+    the popcount of the AND of their sequence bitsets
+    """
+    return dag.get_edge_weights()
 
 
 # ========================================= SCORING FUNCTION 1 ===============================================
 
-def best_predecessor_node(dag, node, incoming_nodes, edge_weights):
+def best_predecessor_edge(dag, index, edge_weights):
     """
-    returns index of the best predecessor node
+    sets the back-pointer of a node to its best predecessor node
+    returns the incoming edge to it (None if the node has no incoming edges)
     """
-    max_weight = 0
-    for neighbor in incoming_nodes:
-        if edge_weights[str(neighbor), str(node['index'])] > max_weight:
-            max_weight = edge_weights[str(neighbor), str(node['index'])]
-            node['previous'] = neighbor
+    max_weight, best_edge = 0, None
+    for e in range(dag.incoming_start[index], dag.incoming_start[index+1]):
+        neighbor = dag.incoming[e]
+        if edge_weights[e] > max_weight or best_edge is None:
+            max_weight, best_edge = edge_weights[e], e
 
         # when edge weights are same, takes predecessor scores into consideration (can try other alternatives)
-        elif edge_weights[str(neighbor), str(node['index'])] == max_weight:
-            if (dag[node['previous']]['score'] + edge_weights[str(node['previous']), str(node['index'])]) < \
-                    (dag[neighbor]['score'] + edge_weights[str(neighbor), str(node['index'])]):
-                node['previous'] = neighbor
+        elif edge_weights[e] == max_weight:
+            if (dag.score[dag.incoming[best_edge]] + edge_weights[best_edge]) < \
+                    (dag.score[neighbor] + edge_weights[e]):
+                best_edge = e
 
-    if len(incoming_nodes) == 0:
-        node['previous'] = None
+    dag.previous[index] = dag.incoming[best_edge] if best_edge is not None else None
 
-    return node['previous']
+    return best_edge
 
 
 def score_assignment(dag):
@@ -74,16 +70,13 @@ def score_assignment(dag):
     edge_weights = init_edge_weights(dag)
 
     # assigning start node's score
-    dag[0]['score'] = 0
+    dag.score[0] = 0
 
     # computing scores of other nodes
-    for node in dag[1:]:
-        index = node['index']
-        if len(node['incoming']) > 0:
-            best_prev_node = best_predecessor_node(dag, node, node['incoming'], edge_weights)
-            node['score'] = dag[best_prev_node]['score'] + edge_weights[str(best_prev_node), str(node['index'])]
-        elif len(node['incoming']) == 0:
-            node['previous'] = None
+    for index in range(1, len(dag)):
+        best_edge = best_predecessor_edge(dag, index, edge_weights)
+        if best_edge is not None:
+            dag.score[index] = dag.score[dag.incoming[best_edge]] + edge_weights[best_edge]
 
 # ========================================= SCORING FUNCTION 2 ================================================
 
@@ -91,12 +84,9 @@ def set_out_edges(dag):
     """
     this method computes and sets the #outgoing edges for each node in POA graph
     """
-    for node in dag:
-        node['outgoing'] = 0
-
-    for node in dag:
-        for prev_node in node['incoming']:
-            dag[prev_node]['outgoing'] += 1
+    dag.outgoing = [0] * len(dag)
+    for prev_node in dag.incoming:
+        dag.outgoing[prev_node] += 1
 
 
 def pb_like_score_assignment(dag):
@@ -108,29 +98,80 @@ def pb_like_score_assignment(dag):
     edge_weights = init_edge_weights(dag)
     set_out_edges(dag)
 
-    for node in dag:
-        node['score'] = 2*len(node['sequences']) - node['outgoing']
-        best_predecessor_node(dag, node, node['incoming'], edge_weights) # computes back-pointer
+    for index in range(len(dag)):
+        dag.score[index] = 2*dag.num_sequences(index) - dag.outgoing[index]
+        best_predecessor_edge(dag, index, edge_weights) # computes back-pointer
+
+
+# ========================================= FUSED SCORING ======================================================
+
+def fused_score_assignment(dag, pb_like=False):
+    """
+    Same scores and back-pointers as score_assignment (or as
+    pb_like_score_assignment if pb_like), in a single sweep over the nodes in
+    topological order: the edge weights, the best predecessor and the score of
+    each node are all worked out when it is visited
+    """
+    seqs, incoming, incoming_start = dag.sequences, dag.incoming, dag.incoming_start
+    edge_weights = dag.edge_weights
+
+    if pb_like:
+        set_out_edges(dag)
+        score = [2*popcount(bits) - outgoing for bits, outgoing in zip(seqs, dag.outgoing)]
+    else:
+        score = [0] * len(dag)
+    previous = [None] * len(dag)
+
+    for index in range(len(dag)):
+        max_weight, best_node = 0, None
+        for e in range(incoming_start[index], incoming_start[index+1]):
+            neighbor = incoming[e]
+            if edge_weights is not None:
+                weight = edge_weights[e]
+            else:
+                weight = popcount(seqs[neighbor] & seqs[index])
+            if weight > max_weight or best_node is None:
+                max_weight, best_node = weight, neighbor
+            # when edge weights are same, the predecessor with the higher score wins
+            elif weight == max_weight and score[best_node] < score[neighbor]:
+                best_node = neighbor
+        previous[index] = best_node
+        if not pb_like and index > 0 and best_node is not None:
+            score[index] = score[best_node] + max_weight
+
+    dag.score, dag.previous = score, previous
 
 
 # ========================================= INVOKING SCORING FUNCTIONS =========================================
 
 def scoring_function(dag, scoring_func):
+    """
+    Assigns the scores and back-pointers of scoring_func to the nodes of dag
+
+    This runs the fused single sweep, in the poa library if it is available and
+    in python otherwise (score_assignment and pb_like_score_assignment are the
+    multi-pass reference versions)
+    """
     if scoring_func == "edge_weight_based_score":
-        score_assignment(dag)
+        pb_like = False
     elif scoring_func == "pb_like_score":
-        pb_like_score_assignment(dag)
+        pb_like = True
+    else:
+        return
+    if not score_dag_with_library(dag, pb_like):
+        fused_score_assignment(dag, pb_like)
 
 
 # ================================ MULTIPLE TRAVERALS TO OBTAIN CONSENSUS  ====================================
+# Each of these returns the index of the node to start the traversal from
 
 def get_max_score_node(dag):
     """
     returns the node with maximum score
     """
-    max_node = dag[0]
-    for node in dag[1:]:
-        max_node = node if node['score'] >= max_node['score'] else max_node
+    max_node = 0
+    for index in range(1, len(dag)):
+        max_node = index if dag.score[index] >= dag.score[max_node] else max_node
 
     return max_node
 
@@ -139,9 +180,9 @@ def max_in_edges_node(dag):
     """
     returns the last node with maximum incoming edges in the topologically sorted POA graph
     """
-    best_node = dag[0]
-    for node in dag[1:]:
-        best_node = node if len(node['incoming']) >= len(best_node['incoming']) else best_node
+    best_node = 0
+    for index in range(1, len(dag)):
+        best_node = index if dag.num_incoming(index) >= dag.num_incoming(best_node) else best_node
 
     return best_node
 
@@ -150,27 +191,31 @@ def max_seq_node(dag):
     """
     returns the last node containing maximum reads in the topologically sorted POA graph
     """
-    best_node = dag[0]
-    for node in dag[1:]:
-        best_node = node if len(node['sequences']) >= len(best_node['sequences']) else best_node
+    best_node, best_count = 0, dag.num_sequences(0)
+    for index in range(1, len(dag)):
+        count = dag.num_sequences(index)
+        if count >= best_count:
+            best_node, best_count = index, count
 
     return best_node
 
 
-def random_node(dag):
+def _near_max_score_nodes(dag):
     """
-    returns any node having score in range [max_score - threshold, max_score]
+    returns the nodes having score in range [max_score - threshold, max_score]
     """
-    node_list = []
-    max_node = get_max_score_node(dag)
-    lower_range, upper_range = max_node['score'] - 0.01*max_node['score'], max_node['score']
+    max_score = dag.score[get_max_score_node(dag)]
+    lower_range, upper_range = max_score - 0.01*max_score, max_score
 
-    # finds a subset of potential end nodes
-    for node in dag:
-        if node['score'] >= lower_range and node['score'] <= upper_range:
-            node_list.append(node)
+    return [index for index in range(len(dag))
+            if dag.score[index] >= lower_range and dag.score[index] <= upper_range]
 
-    return random.choice(node_list)
+
+def random_node(dag):
+    """
+    returns any node having score in range [max_score - threshold, max_score]
+    """
+    return random.choice(_near_max_score_nodes(dag))
 
 
 def optimal_random_node(dag):
@@ -178,20 +223,14 @@ def optimal_random_node(dag):
     extracts a subset of nodes having score in range [max_score - threshold, max_score]
     from the extracted subset, returns the last node containing maximum reads
     """
-    node_list = [] # subset of nodes
-    max_node = get_max_score_node(dag)
-    lower_range, upper_range = max_node['score'] - 0.01*max_node['score'], max_node['score']
-
-    # finds a subset of potential end nodes
-    for node in dag:
-        if node['score'] >= lower_range and node['score'] <= upper_range:
-            node_list.append(node)
+    node_list = _near_max_score_nodes(dag) # subset of nodes
 
     # from the filtered subset, selects an optimal node containing max reads
-    opt_node = node_list[0]
-    for node in node_list[1:]:
-        if len(node['sequences']) >= len(opt_node['sequences']):
-            opt_node = node
+    opt_node, opt_count = node_list[0], dag.num_sequences(node_list[0])
+    for index in node_list[1:]:
+        count = dag.num_sequences(index)
+        if count >= opt_count:
+            opt_node, opt_count = index, count
 
     return opt_node
 
@@ -202,8 +241,6 @@ def do_consensus(dag, traversal_algo):
     """
     returns consensus sequence using back-pointers from a selected node
     """
-    cons_seq = ""
-
     # node selection alternatives for POA traversal
     if traversal_algo == "max_score":
         max_node = get_max_score_node(dag)
@@ -216,15 +253,48 @@ def do_consensus(dag, traversal_algo):
     elif traversal_algo == "optimal_random":
         max_node = optimal_random_node(dag)
 
-    cons_seq += max_node['character']
-    while max_node['previous']:
-        prev_node = max_node['previous']
-        #print max_node['previous']
-        cons_seq += dag[prev_node]['character']
-        max_node = dag[prev_node]
-    cons_seq += max_node['character']
+    cons_seq = [dag.characters[max_node]]
+    while dag.previous[max_node]:
+        max_node = dag.previous[max_node]
+        cons_seq.append(dag.characters[max_node])
+    cons_seq.append(dag.characters[max_node])
+
+    return ''.join(reversed(cons_seq))
+
+
+# ========================================= INCREMENTAL CONSENSUS =============================================
+
+class IncrementalConsensus(object):
+    """
+    Generates the consensus of a growing set of sequences: keeps a live POA
+    graph (a PoaAligner) and re-scores and re-traverses it after each sequence
+    is added, which is much cheaper than aligning all the sequences again
+    (band_width and memory_cap_mb are as in align_sequences_to_dag)
+    """
 
-    return cons_seq[::-1]
+    def __init__(self, score_matrix_file, scoring_func, traversal_algo, band_width=0,
+                 memory_cap_mb=0):
+        self.aligner        = PoaAligner(score_matrix_file, band_width=band_width,
+                                         memory_cap_mb=memory_cap_mb)
+        self.scoring_func   = scoring_func
+        self.traversal_algo = traversal_algo
+        self.consensus      = None
+
+    def __len__(self):
+        return len(self.aligner)
+
+    def add_sequence(self, sequence):
+        """
+        Add one more sequence and return the updated consensus
+        """
+        self.aligner.add_sequence(sequence)
+        dag = self.aligner.get_dag()
+        scoring_function(dag, self.scoring_func)
+        self.consensus = do_consensus(dag, self.traversal_algo)
+        return self.consensus
+
+    def close(self):
+        self.aligner.close()
 
 
 def consensus_to_fasta(sequence, out_file=None):
@@ -3,15 +3,21 @@
 Module to convert sequence data between various formats
 """
 import pysam
+import string
 
 
 _SEQ_COMPLEMENTS = {'A': 'T', 'C': 'G', 'G': 'C', 'T': 'A'}
+_bases = ''.join(sorted(_SEQ_COMPLEMENTS))
+try:
+    _COMPLEMENT_TABLE = string.maketrans(_bases, ''.join(_SEQ_COMPLEMENTS[b] for b in _bases))
+except AttributeError: # Python 3
+    _COMPLEMENT_TABLE = str.maketrans(_SEQ_COMPLEMENTS)
 
 def complement(sequence):
     """
     Returns a complemented version of a given DNA sequence string
     """
-    return ''.join(map(lambda s: _SEQ_COMPLEMENTS[s], sequence))
+    return sequence.translate(_COMPLEMENT_TABLE)
 
 
 def reverse_complement(sequence):
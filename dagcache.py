@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+"""
+Module for an on-disk cache of aligned POA graphs (PoaGraphs), kept in an
+SQLite database so that reruns over the same wells can skip the alignment
+"""
+import array
+import hashlib
+import pickle
+import sqlite3
+import time
+import zlib
+
+from poaligner import PoaGraph
+
+CACHE_VERSION = 2   # Bump whenever the way graphs are built or stored changes
+EVICT_TO      = 0.9 # Eviction frees space down to this fraction of max_bytes
+TOUCH_BATCH   = 100 # Cache hits whose last use is written out together
+
+
+def get_cache_key(sequences, *config):
+    """
+    Returns the cache key (a hex digest) of the graph of a well, given its
+    sequences and the configuration values that the graph depends on
+    """
+    digest = hashlib.sha1()
+    digest.update(repr((CACHE_VERSION,) + config).encode('utf-8'))
+    for seq in sequences:
+        digest.update(b'\n')
+        digest.update(seq.encode('ascii'))
+    return digest.hexdigest()
+
+
+def get_file_digest(file_name):
+    """
+    Returns the sha1 digest of the contents of a file
+    """
+    with open(file_name, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def _dag_to_blob(dag, num_passes):
+    data = (dag.characters, dag.incoming_start.tolist(), dag.incoming.tolist(),
+            dag.sequences, dag.get_edge_weights().tolist(), num_passes)
+    return zlib.compress(pickle.dumps(data, 2))
+
+
+def _dag_from_blob(blob):
+    characters, incoming_start, incoming, sequences, edge_weights, num_passes = \
+        pickle.loads(zlib.decompress(bytes(blob)))
+    dag = PoaGraph(characters, incoming_start, incoming, sequences,
+                   array.array('i', edge_weights))
+    return dag, num_passes
+
+
+class DagCache(object):
+    """
+    A cache of (graph, no. of sequences aligned) entries by cache key, stored
+    in an SQLite database file that any no. of processes can share. When the
+    entries take more than max_bytes, the least recently used ones are evicted
+
+    The total size of the entries is kept in a one-row table, updated along with
+    them, so that a put does not read the whole cache. The last use of the
+    entries that get returns is only written out with the next put, every
+    TOUCH_BATCH hits or on close, so that a hit does not commit
+    """
+    def __init__(self, cache_file, max_bytes):
+        self.max_bytes = max_bytes
+        self.touched   = {} # key -> last use, not written out yet
+        # Autocommit, the transactions are begun explicitly
+        self.conn = sqlite3.connect(cache_file, timeout=60, isolation_level=None)
+        self.conn.execute("BEGIN IMMEDIATE")
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        if version != CACHE_VERSION:
+            # None of the entries of another version could be used anyway
+            self.conn.execute("DROP TABLE IF EXISTS graphs")
+            self.conn.execute("DROP TABLE IF EXISTS total_size")
+            self.conn.execute("PRAGMA user_version = %d" % CACHE_VERSION)
+        # The graphs go last, so that their sizes are read without them
+        self.conn.execute("CREATE TABLE IF NOT EXISTS graphs (key TEXT PRIMARY KEY, "
+                          "size INTEGER, last_used REAL, graph BLOB)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS graphs_last_used ON graphs (last_used)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS total_size (id INTEGER PRIMARY KEY, "
+                          "size INTEGER)")
+        self.conn.execute("INSERT OR IGNORE INTO total_size VALUES (0, 0)")
+        self.conn.execute("COMMIT")
+
+    def get(self, key):
+        """
+        Returns the (graph, no. of sequences aligned) tuple cached for key, or
+        None if there is none
+        """
+        row = self.conn.execute("SELECT graph FROM graphs WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        self.touched[key] = time.time()
+        if len(self.touched) >= TOUCH_BATCH:
+            self.conn.execute("BEGIN IMMEDIATE")
+            self._write_touched()
+            self.conn.execute("COMMIT")
+        return _dag_from_blob(row[0])
+
+    def put(self, key, dag, num_passes):
+        blob = _dag_to_blob(dag, num_passes)
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = self.conn.execute("SELECT size FROM graphs WHERE key = ?", (key,)).fetchone()
+            self.conn.execute("INSERT OR REPLACE INTO graphs VALUES (?, ?, ?, ?)",
+                              (key, len(blob), time.time(), sqlite3.Binary(blob)))
+            self._add_size(len(blob) - (row[0] if row else 0))
+            self._write_touched()
+            self.evict()
+        except:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.conn.execute("COMMIT")
+
+    def _add_size(self, size):
+        self.conn.execute("UPDATE total_size SET size = size + ? WHERE id = 0", (size,))
+
+    def _write_touched(self):
+        """
+        Writes out the last use of the entries returned by get since the last
+        time (within the caller's transaction)
+        """
+        if self.touched:
+            self.conn.executemany("UPDATE graphs SET last_used = ? WHERE key = ?",
+                                  [(used, key) for key, used in self.touched.items()])
+            self.touched = {}
+
+    def evict(self):
+        """
+        If the entries take more than max_bytes, delete the least recently used
+        ones until the rest take at most EVICT_TO * max_bytes (within the
+        caller's transaction)
+        """
+        total = self.conn.execute("SELECT size FROM total_size WHERE id = 0").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        evicted, evicted_size = [], 0
+        for key, size in self.conn.execute("SELECT key, size FROM graphs ORDER BY last_used"):
+            if total - evicted_size <= self.max_bytes * EVICT_TO:
+                break
+            evicted.append((key,))
+            evicted_size += size
+        self.conn.executemany("DELETE FROM graphs WHERE key = ?", evicted)
+        self._add_size(-evicted_size)
+
+    def close(self):
+        if self.touched:
+            self.conn.execute("BEGIN IMMEDIATE")
+            self._write_touched()
+            self.conn.execute("COMMIT")
+        self.conn.close()
@@ -22,6 +22,68 @@ typedef struct {
 DPScore_T;
 
 
+/** if >0, align_lpo_po() only fills the cells of a linear sequence y that
+    are near the diagonal implied by the lengths of x and y (see
+    lpo_band_limits()), so that its DP matrices take O(len_y*band) instead
+    of O(len_y*len_x) memory. faster, but it may miss the best alignment
+    if x and y are not colinear end to end */
+int lpo_band_width = 0;
+
+/** if >0, align_lpo_po() keeps the memory of its DP matrices under this
+    many bytes if it can (see dp_segment_rows()), at the cost of filling
+    them twice. only linear sequences y are capped */
+long lpo_dp_memory_cap = 0;
+
+/** the peak DP memory (in bytes) of the align_lpo_po() calls since it was
+    last reset to 0 */
+long lpo_dp_peak_bytes = 0;
+
+/* SCORE OF THE CELLS OUTSIDE THE BAND, NEVER CHOSEN AS A PREDECESSOR */
+static DPScore_T out_of_band_score = { -999999, 0, 0 };
+
+#define BAND_SCORE(ROW,K,LO,HI) \
+  (((K) >= 0 && ((K) < (LO) || (K) > (HI))) ? &out_of_band_score : &(ROW)[K])
+
+
+/** sets [*lo,*hi] to the nodes of x that align_lpo_po() fills for
+    position i of y when banded: band_width around the diagonal, widened
+    by len_x/len_y when x is longer (the parallel branches of a partial
+    order add nodes but not length) */
+void lpo_band_limits (int i, int len_x, int len_y, int band_width,
+		      int *lo, int *hi)
+{
+  long center = (long)i * len_x / len_y;
+  long half = (len_x > len_y) ? (long)band_width * len_x / len_y : band_width;
+
+  *lo = (center - half > 0) ? (int)(center - half) : 0;
+  *hi = (center + half < len_x - 1) ? (int)(center + half) : len_x - 1;
+}
+
+
+/** no. of DP cells that align_lpo_po() keeps moves for to align lposeq_y
+    to lposeq_x */
+long lpo_dp_cells (LPOSequence_T *lposeq_x, LPOSequence_T *lposeq_y)
+{
+  int lo, hi;
+  long half;
+
+  long cells = (long)lposeq_x->length * lposeq_y->length;
+
+  if (lposeq_y->nsource_seq > 1 || lposeq_y->length <= 0)
+    return cells;
+  if (lpo_band_width > 0) {
+    lpo_band_limits (0, lposeq_x->length, lposeq_y->length, lpo_band_width, &lo, &hi);
+    half = hi - lo; /* FULL WIDTH OF THE BAND AWAY FROM THE EDGES */
+    if (2 * half + 1 < lposeq_x->length)
+      cells = (2 * half + 1) * lposeq_y->length;
+  }
+  /* THE MOVES KEPT UNDER A MEMORY CAP (SEE dp_segment_rows()) */
+  if (lpo_dp_memory_cap > 0 && cells > lpo_dp_memory_cap / (long)sizeof(DPMove_T))
+    cells = lpo_dp_memory_cap / (long)sizeof(DPMove_T);
+  return cells;
+}
+
+
 
 #define LPO_INITIAL_NODE 1
 #define LPO_FINAL_NODE 2
@@ -105,10 +167,247 @@ static void get_lpo_stats (LPOSequence_T *lposeq,
 }
 
 
-static void trace_back_lpo_alignment (int len_x, int len_y,
-				      DPMove_T **move,
-				      LPOLetterLink_T **x_left,
-				      LPOLetterLink_T **y_left,
+/* THE DP MATRICES OF ONE align_lpo_po() CALL, AND ALL THAT IS NEEDED TO
+   FILL ANY OF THEIR ROWS (AGAIN) WITH fill_dp_row() */
+typedef struct {
+  int len_x, len_y;
+  LPOLetter_T *seq_x, *seq_y;
+  LPOLetterLink_T **x_left, **y_left;
+  int *node_type_x, *node_type_y;
+  ResidueScoreMatrix_T *m;
+  LPOScore_T (*scoring_function)
+    (int, int, LPOLetter_T *, LPOLetter_T *, ResidueScoreMatrix_T *);
+  int use_global_alignment;
+  int *next_gap_array, *next_perp_gap_array;
+  int *band_lo, *band_hi; /* [-1..len_y-1]: ROW i FILLS NODES band_lo[i]..band_hi[i] OF x */
+  DPScore_T *init_col_score; /* [-1..len_y-1] */
+  DPScore_T **score_rows; /* [-1..len_y-1], NULL UNLESS LIVE */
+  DPMove_T **move; /* [0..len_y-1]: move[i][j - band_lo[i]] IS THE MOVE OF
+		      CELL (i,j), NULL UNLESS KEPT */
+  int segment_rows; /* IF >0, THE MOVES ARE ONLY KEPT FOR ONE SEGMENT OF
+		       THIS MANY ROWS AT A TIME (SEE fill_segment()) */
+  DPScore_T **checkpoints; /* [nsegment]: SCORE ROW BEFORE EACH SEGMENT */
+  int segment; /* THE SEGMENT WHOSE MOVES ARE KEPT, -1 FOR NONE */
+  long bytes, peak_bytes; /* DP MEMORY IN USE, AND ITS PEAK */
+} DPMatrix_T;
+
+
+static void dp_use (DPMatrix_T *dp, long nbytes)
+{
+  dp->bytes += nbytes;
+  if (dp->bytes > dp->peak_bytes)
+    dp->peak_bytes = dp->bytes;
+}
+
+#define SCORE_ROW_BYTES(DP) ((long)((DP)->len_x + 1) * sizeof(DPScore_T))
+#define MOVE_ROW_BYTES(DP,I) \
+  ((long)((DP)->band_hi[I] - (DP)->band_lo[I] + 1) * sizeof(DPMove_T))
+
+
+/** no. of rows per segment for the DP matrices of dp to take at most
+    lpo_dp_memory_cap bytes on top of fixed_bytes: 0 (keep all the moves)
+    if they fit, else the length that takes the least memory for the moves
+    of one segment and the score rows checkpointed before each segment
+    (the cap may still be exceeded then) */
+static int dp_segment_rows (DPMatrix_T *dp, int is_linear_y, long fixed_bytes)
+{
+  int i, k;
+  long move_bytes = 0, row_bytes = SCORE_ROW_BYTES (dp);
+
+  if (lpo_dp_memory_cap <= 0 || !is_linear_y || dp->len_y < 2)
+    return 0;
+  for (i=0; i<dp->len_y; i++)
+    move_bytes += MOVE_ROW_BYTES (dp, i);
+  if (fixed_bytes + move_bytes + 2 * row_bytes <= lpo_dp_memory_cap)
+    return 0;
+
+  /* k ROWS PER SEGMENT TAKE len_y/k CHECKPOINTS AND k ROWS OF MOVES, AT
+     LEAST WHEN k*k = len_y*len_y * row_bytes/move_bytes */
+  for (k=1; k<dp->len_y && (long)k * k * move_bytes < (long)dp->len_y * dp->len_y * row_bytes; k++)
+    ;
+  return k;
+}
+
+
+/** fills row i of the DP matrices of dp, from the score rows of its
+    predecessors in y (which must be live), into dp->score_rows[i] and (if
+    kept) dp->move[i]. if best_score isn't NULL, the best end of the
+    alignment so far is updated in *best_score, *best_x and *best_y */
+static void fill_dp_row (DPMatrix_T *dp, int i,
+			 LPOScore_T *best_score, int *best_x, int *best_y)
+{
+  int j, xcount, ycount, prev_gap, lo, hi;
+  int possible_end_square;
+  LPOScore_T min_score = -999999;
+  LPOLetterLink_T *xl, *yl;
+  DPScore_T *curr_score, *prev_score, *my_score;
+  DPMove_T *my_move, dummy_move;
+  LPOScore_T *gap_penalty_x = dp->m->gap_penalty_x, *gap_penalty_y = dp->m->gap_penalty_y;
+  int *next_gap_array = dp->next_gap_array, *next_perp_gap_array = dp->next_perp_gap_array;
+  LPOScore_T try_score, insert_x_score, insert_y_score, match_score;
+  int insert_x_x, insert_x_gap;
+  int insert_y_y, insert_y_gap;
+  int match_x, match_y;
+
+  curr_score = dp->score_rows[i];
+  curr_score[-1] = dp->init_col_score[i];
+
+  /* INNER LOOP (j-th position in LPO x): */
+  for (j=dp->band_lo[i]; j<=dp->band_hi[i]; j++) {
+
+    match_score = (dp->use_global_alignment) ? min_score : 0;
+    match_x = match_y = 0;
+
+    insert_x_score = insert_y_score = min_score;
+    insert_x_x = insert_y_y = 0;
+    insert_x_gap = insert_y_gap = 0;
+
+    /* THIS SQUARE CAN END THE ALIGNMENT IF WE'RE USING LOCAL ALIGNMENT, */
+    /* OR IF BOTH THE X- AND Y-NODES CONTAIN THE END OF A SEQUENCE. */
+    possible_end_square = ((0 == dp->use_global_alignment) || ((dp->node_type_x[j] & LPO_FINAL_NODE) && (dp->node_type_y[i] & LPO_FINAL_NODE)));
+
+    /* LOOP OVER y-predecessors: */
+    for (ycount = 1, yl = dp->y_left[i]; yl != NULL; ycount++, yl = yl->more) {
+
+      prev_score = dp->score_rows[yl->ipos];
+      lo = dp->band_lo[yl->ipos];
+      hi = dp->band_hi[yl->ipos];
+
+      /* IMPROVE Y-INSERTION?: trace back to (i'=yl->ipos, j) */
+      my_score = BAND_SCORE (prev_score, j, lo, hi);
+      prev_gap = my_score->gap_y;
+      try_score = my_score->score + yl->score - gap_penalty_y[prev_gap];
+      if (try_score > insert_y_score) {
+	insert_y_score = try_score;
+	insert_y_y = ycount;
+	insert_y_gap = prev_gap;
+      }
+
+      /* LOOP OVER x-predecessors (INSIDE y-predecessor LOOP): */
+      for (xcount = 1, xl = dp->x_left[j]; xl != NULL; xcount++, xl = xl->more) {
+
+	/* IMPROVE XY-MATCH?: trace back to (i'=yl->ipos, j'=xl->ipos) */
+	try_score = BAND_SCORE (prev_score, xl->ipos, lo, hi)->score + xl->score + yl->score;
+	if (try_score > match_score) {
+	  match_score = try_score;
+	  match_x = xcount;
+	  match_y = ycount;
+	}
+      }
+    }
+
+    /* LOOP OVER x-predecessors (OUTSIDE y-predecessor LOOP): */
+    for (xcount = 1, xl = dp->x_left[j]; xl != NULL; xcount++, xl = xl->more) {
+
+      /* IMPROVE X-INSERTION?: trace back to (i, j'=xl->ipos) */
+      my_score = BAND_SCORE (curr_score, xl->ipos, dp->band_lo[i], dp->band_hi[i]);
+      prev_gap = my_score->gap_x;
+      try_score = my_score->score + xl->score - gap_penalty_x[prev_gap];
+      if (try_score > insert_x_score) {
+	insert_x_score = try_score;
+	insert_x_x = xcount;
+	insert_x_gap = prev_gap;
+      }
+    }
+
+    /* USE CUSTOM OR DEFAULT SCORING FUNCTION: */
+    if (dp->scoring_function != NULL) {
+      match_score += dp->scoring_function (j, i, dp->seq_x, dp->seq_y, dp->m);
+    }
+    else {
+      match_score += dp->m->score[dp->seq_x[i].letter][dp->seq_y[j].letter];
+    }
+
+    my_score = &curr_score[j];
+    my_move = dp->move[i] ? &dp->move[i][j - dp->band_lo[i]] : &dummy_move;
+
+    if (match_score > insert_y_score && match_score > insert_x_score) {
+      /* XY-MATCH */
+      my_score->score = match_score;
+      my_score->gap_x = 0;
+      my_score->gap_y = 0;
+      my_move->x = match_x;
+      my_move->y = match_y;
+    }
+    else if (insert_x_score > insert_y_score) {
+      /* X-INSERTION */
+      my_score->score = insert_x_score;
+      my_score->gap_x = next_gap_array[insert_x_gap];
+      my_score->gap_y = next_perp_gap_array[insert_x_gap];
+      my_move->x = insert_x_x;
+      my_move->y = 0;
+    }
+    else {
+      /* Y-INSERTION */
+      my_score->score = insert_y_score;
+      my_score->gap_x = next_perp_gap_array[insert_y_gap];
+      my_score->gap_y = next_gap_array[insert_y_gap];
+      my_move->x = 0;
+      my_move->y = insert_y_y;
+    }
+
+    /* RECORD BEST ALIGNMENT END FOR TRACEBACK: */
+    if (best_score && possible_end_square && my_score->score >= *best_score) {
+      /* BREAK TIES BY CHOOSING MINIMUM (x,y): */
+      if (my_score->score > *best_score || (j == *best_x && i < *best_y) || j < *best_x) {
+	*best_score = my_score->score;
+	*best_x = j;
+	*best_y = i;
+      }
+    }
+  }
+}
+
+
+static void free_segment_moves (DPMatrix_T *dp)
+{
+  int i, first;
+
+  if (dp->segment < 0)
+    return;
+  first = dp->segment * dp->segment_rows;
+  for (i=first; i<first+dp->segment_rows && i<dp->len_y; i++) {
+    FREE (dp->move[i]);
+    dp_use (dp, -MOVE_ROW_BYTES (dp, i));
+  }
+  dp->segment = -1;
+}
+
+
+/** fills the rows of segment s again, from the score row checkpointed
+    before it, keeping their moves (and dropping those of the segment kept
+    before). y must be linear, so that row i only depends on row i-1 */
+static void fill_segment (DPMatrix_T *dp, int s)
+{
+  int i, first = s * dp->segment_rows;
+  int last = (first + dp->segment_rows < dp->len_y) ? first + dp->segment_rows : dp->len_y;
+  DPScore_T *rows[2];
+
+  free_segment_moves (dp);
+  for (i=0; i<2; i++) {
+    CALLOC (rows[i], dp->len_x+1, DPScore_T);
+    dp_use (dp, SCORE_ROW_BYTES (dp));
+  }
+  dp->score_rows[first-1] = dp->checkpoints[s];
+  for (i=first; i<last; i++) {
+    CALLOC (dp->move[i], dp->band_hi[i] - dp->band_lo[i] + 1, DPMove_T);
+    dp_use (dp, MOVE_ROW_BYTES (dp, i));
+    dp->score_rows[i] = &(rows[i % 2][1]);
+    fill_dp_row (dp, i, NULL, NULL, NULL);
+  }
+  for (i=first-1; i<last; i++) {
+    if (i >= 0)
+      dp->score_rows[i] = NULL;
+  }
+  for (i=0; i<2; i++) {
+    FREE (rows[i]);
+    dp_use (dp, -SCORE_ROW_BYTES (dp));
+  }
+  dp->segment = s;
+}
+
+
+static void trace_back_lpo_alignment (DPMatrix_T *dp,
 				      LPOLetterRef_T best_x, LPOLetterRef_T best_y,
 				      LPOLetterRef_T **x_to_y,
 				      LPOLetterRef_T **y_to_x)
@@ -117,15 +416,19 @@ static void trace_back_lpo_alignment (int len_x, int len_y,
   LPOLetterRef_T *x_al = NULL, *y_al = NULL;
   LPOLetterLink_T *left;
   
-  CALLOC (x_al, len_x, LPOLetterRef_T);
-  CALLOC (y_al, len_y, LPOLetterRef_T);
-  LOOP (i,len_x) x_al[i] = INVALID_LETTER_POSITION;
-  LOOP (i,len_y) y_al[i] = INVALID_LETTER_POSITION;
+  CALLOC (x_al, dp->len_x, LPOLetterRef_T);
+  CALLOC (y_al, dp->len_y, LPOLetterRef_T);
+  LOOP (i,dp->len_x) x_al[i] = INVALID_LETTER_POSITION;
+  LOOP (i,dp->len_y) y_al[i] = INVALID_LETTER_POSITION;
   
   while (best_x >= 0 && best_y >= 0) {
 
-    xmove = move[best_y][best_x].x;
-    ymove = move[best_y][best_x].y;
+    if (best_x < dp->band_lo[best_y] || best_x > dp->band_hi[best_y])
+      break; /* LEFT THE BAND: NO MOVE WAS RECORDED HERE */
+    if (!dp->move[best_y]) /* CHECKPOINTED: FILL ITS SEGMENT AGAIN */
+      fill_segment (dp, best_y / dp->segment_rows);
+    xmove = dp->move[best_y][best_x - dp->band_lo[best_y]].x;
+    ymove = dp->move[best_y][best_x - dp->band_lo[best_y]].y;
     
     if (xmove>0 && ymove>0) { /* ALIGNED! MAP best_x <--> best_y */
       x_al[best_x]=best_y;
@@ -139,7 +442,7 @@ static void trace_back_lpo_alignment (int len_x, int len_y,
     }
     
     if (xmove>0) { /* TRACE BACK ON X */
-      left = x_left[best_x];
+      left = dp->x_left[best_x];
       while ((--xmove)>0) {
 	left = left->more;
       }
@@ -147,7 +450,7 @@ static void trace_back_lpo_alignment (int len_x, int len_y,
     }
     
     if (ymove>0) { /* TRACE BACK ON Y */
-      left = y_left[best_y];
+      left = dp->y_left[best_y];
       while ((--ymove)>0) {
 	left = left->more;
       }
@@ -184,36 +487,36 @@ LPOScore_T align_lpo_po (LPOSequence_T *lposeq_x,
 			 (int, int, LPOLetter_T *, LPOLetter_T *, ResidueScoreMatrix_T *),
 			 int use_global_alignment)
 {
-  LPOLetter_T *seq_x = lposeq_x->letter;
-  LPOLetter_T *seq_y = lposeq_y->letter;
-  
   int len_x, len_y;
   int n_edges_x, n_edges_y;
-  int *node_type_x, *node_type_y;
   int *refs_from_right_x, *refs_from_right_y;
   int max_rows_alloced_x, max_rows_alloced_y, n_score_rows_alloced = 0;
   
-  int i, j, xcount, ycount, prev_gap;
+  int i, j, xcount, ycount, prev_gap, nsegment = 0, is_linear_y;
   int best_x = -1, best_y = -1;
   LPOScore_T min_score = -999999, best_score = -999999;
-  int possible_end_square;
-  LPOLetterLink_T **x_left = NULL, **y_left = NULL, *xl, *yl;
-  DPMove_T **move = NULL, *my_move;
-  
-  DPScore_T *curr_score = NULL, *prev_score = NULL, *init_col_score = NULL, *my_score;
-  DPScore_T **score_rows = NULL;
+  LPOLetterLink_T *xl, *yl;
+  DPMatrix_T dp;
+  DPScore_T *curr_score = NULL;
 
-  int max_gap_length;
+  int band_width, max_gap_length;
   LPOScore_T *gap_penalty_x, *gap_penalty_y;
-  int *next_gap_array, *next_perp_gap_array;
+  int *next_gap_array = NULL, *next_perp_gap_array = NULL;
   
-  LPOScore_T try_score, insert_x_score, insert_y_score, match_score;
-  int insert_x_x, insert_x_gap;
-  int insert_y_y, insert_y_gap;
-  int match_x, match_y;
+  LPOScore_T try_score;
   
-  get_lpo_stats (lposeq_x, &len_x, &n_edges_x, &node_type_x, &refs_from_right_x, &max_rows_alloced_x, &x_left);
-  get_lpo_stats (lposeq_y, &len_y, &n_edges_y, &node_type_y, &refs_from_right_y, &max_rows_alloced_y, &y_left);
+  memset (&dp, 0, sizeof(dp));
+  dp.seq_x = lposeq_x->letter;
+  dp.seq_y = lposeq_y->letter;
+  dp.m = m;
+  dp.scoring_function = scoring_function;
+  dp.use_global_alignment = use_global_alignment;
+  dp.segment = -1;
+
+  get_lpo_stats (lposeq_x, &len_x, &n_edges_x, &dp.node_type_x, &refs_from_right_x, &max_rows_alloced_x, &dp.x_left);
+  get_lpo_stats (lposeq_y, &len_y, &n_edges_y, &dp.node_type_y, &refs_from_right_y, &max_rows_alloced_y, &dp.y_left);
+  dp.len_x = len_x;
+  dp.len_y = len_y;
 
   /*
     fprintf (stdout, "sequence x:  %ld nodes, %ld edges, %ld rows at most --> %ld mem\n", len_x, n_edges_x, max_rows_alloced_x, max_rows_alloced_x * len_y);
@@ -226,6 +529,8 @@ LPOScore_T align_lpo_po (LPOSequence_T *lposeq_x,
   gap_penalty_y = m->gap_penalty_y;
   CALLOC (next_gap_array, max_gap_length + 2, int);
   CALLOC (next_perp_gap_array, max_gap_length + 2, int);
+  dp.next_gap_array = next_gap_array;
+  dp.next_perp_gap_array = next_perp_gap_array;
 
   for (i=0; i<max_gap_length+1; i++) {
     /* GAP LENGTH EXTENSION RULE: */
@@ -248,23 +553,52 @@ LPOScore_T align_lpo_po (LPOSequence_T *lposeq_x,
     next_perp_gap_array[max_gap_length+1] = next_perp_gap_array[0];
   }
   
+
+  /* ONLY A LINEAR y IS BANDED (OR CHECKPOINTED). ROW i OF y FILLS THE NODES
+     band_lo[i] .. band_hi[i] OF x (ALL OF THEM WHEN NOT BANDED), AND ROW
+     -1 ALL OF THEM */
+  is_linear_y = (lposeq_y->nsource_seq <= 1);
+  band_width = (lpo_band_width > 0 && is_linear_y) ? lpo_band_width : 0;
+  CALLOC (dp.band_lo, len_y+1, int);
+  CALLOC (dp.band_hi, len_y+1, int);
+  dp.band_lo = &(dp.band_lo[1]);
+  dp.band_hi = &(dp.band_hi[1]);
+  for (i=-1; i<len_y; i++) {
+    dp.band_lo[i] = 0;
+    dp.band_hi[i] = len_x - 1;
+    if (band_width > 0 && i >= 0)
+      lpo_band_limits (i, len_x, len_y, band_width, &dp.band_lo[i], &dp.band_hi[i]);
+  }
   
   /* ALLOCATE MEMORY FOR 'MOVE' AND 'SCORE' MATRICES: */
   
-  CALLOC (move, len_y, DPMove_T *);
-  for (i=0; i<len_y; i++) {
-    CALLOC (move[i], len_x, DPMove_T);
+  CALLOC (dp.move, len_y, DPMove_T *);
+
+  CALLOC (dp.init_col_score, len_y+1, DPScore_T);
+  dp.init_col_score = &(dp.init_col_score[1]);
+  
+  CALLOC (dp.score_rows, len_y+1, DPScore_T *);
+  dp.score_rows = &(dp.score_rows[1]);
+  CALLOC (dp.score_rows[-1], len_x+1, DPScore_T);
+  dp.score_rows[-1] = &(dp.score_rows[-1][1]);
+  curr_score = dp.score_rows[-1];
+
+  dp_use (&dp, (long)len_y * (sizeof(DPMove_T *) + sizeof(DPScore_T *)
+			      + sizeof(DPScore_T) + 2 * sizeof(int))
+	  + SCORE_ROW_BYTES (&dp));
+
+  /* IF THE MOVES DON'T FIT UNDER THE MEMORY CAP, THEY ARE ONLY KEPT FOR
+     ONE SEGMENT OF ROWS AT A TIME: THE FIRST PASS ONLY FINDS THE BEST
+     SCORE, CHECKPOINTING THE SCORE ROW BEFORE EACH SEGMENT, AND THE
+     TRACEBACK FILLS THE SEGMENTS IT GOES THROUGH AGAIN */
+  dp.segment_rows = dp_segment_rows (&dp, is_linear_y, dp.bytes);
+  if (dp.segment_rows > 0) {
+    nsegment = (len_y + dp.segment_rows - 1) / dp.segment_rows;
+    CALLOC (dp.checkpoints, nsegment, DPScore_T *);
+    dp_use (&dp, nsegment * sizeof(DPScore_T *));
+    dp.checkpoints[0] = dp.score_rows[-1];
   }
 
-  CALLOC (init_col_score, len_y+1, DPScore_T);
-  init_col_score = &(init_col_score[1]);
-  
-  CALLOC (score_rows, len_y+1, DPScore_T *);
-  score_rows = &(score_rows[1]);
-  CALLOC (score_rows[-1], len_x+1, DPScore_T);
-  score_rows[-1] = &(score_rows[-1][1]);
-  curr_score = score_rows[-1];
-
 
   /* FILL INITIAL ROW (-1). */
   /* GAP LENGTH = M+1 IS USED FOR INITIAL STATE. */
@@ -274,7 +608,7 @@ LPOScore_T align_lpo_po (LPOSequence_T *lposeq_x,
   
   for (i=0; i<len_x; i++) {
     curr_score[i].score = min_score;
-    for (xcount = 1, xl = x_left[i]; xl != NULL; xcount++, xl = xl->more) {
+    for (xcount = 1, xl = dp.x_left[i]; xl != NULL; xcount++, xl = xl->more) {
       prev_gap = curr_score[xl->ipos].gap_x;
       try_score = curr_score[xl->ipos].score + xl->score - gap_penalty_x[prev_gap];
       if (try_score > curr_score[i].score) {
@@ -287,16 +621,16 @@ LPOScore_T align_lpo_po (LPOSequence_T *lposeq_x,
   
   /* FILL INITIAL COLUMN (-1). */
   
-  init_col_score[-1] = curr_score[-1];
+  dp.init_col_score[-1] = curr_score[-1];
   for (i=0; i<len_y; i++) {
-    init_col_score[i].score = min_score;
-    for (ycount = 1, yl = y_left[i]; yl != NULL; ycount++, yl = yl->more) {
-      prev_gap = init_col_score[yl->ipos].gap_y;
-      try_score = init_col_score[yl->ipos].score + yl->score - gap_penalty_y[prev_gap];
-      if (try_score > init_col_score[i].score) {
-	init_col_score[i].score = try_score;
-	init_col_score[i].gap_x = next_perp_gap_array[prev_gap];
-	init_col_score[i].gap_y = next_gap_array[prev_gap];
+    dp.init_col_score[i].score = min_score;
+    for (ycount = 1, yl = dp.y_left[i]; yl != NULL; ycount++, yl = yl->more) {
+      prev_gap = dp.init_col_score[yl->ipos].gap_y;
+      try_score = dp.init_col_score[yl->ipos].score + yl->score - gap_penalty_y[prev_gap];
+      if (try_score > dp.init_col_score[i].score) {
+	dp.init_col_score[i].score = try_score;
+	dp.init_col_score[i].gap_x = next_perp_gap_array[prev_gap];
+	dp.init_col_score[i].gap_y = next_gap_array[prev_gap];
       }
     }
   }
@@ -308,147 +642,62 @@ LPOScore_T align_lpo_po (LPOSequence_T *lposeq_x,
   /* OUTER LOOP (i-th position in LPO y): */
   for (i=0; i<len_y; i++) {
     
-    /* ALLOCATE MEMORY FOR 'SCORE' ROW i: */
-    CALLOC (score_rows[i], len_x+1, DPScore_T);
-    score_rows[i] = &(score_rows[i][1]);
+    /* ALLOCATE MEMORY FOR 'SCORE' (AND 'MOVE') ROW i: */
+    CALLOC (dp.score_rows[i], len_x+1, DPScore_T);
+    dp.score_rows[i] = &(dp.score_rows[i][1]);
     n_score_rows_alloced++;
-        
-    curr_score = score_rows[i];
-    curr_score[-1] = init_col_score[i];
-          
-    /* INNER LOOP (j-th position in LPO x): */
-    for (j=0; j<len_x; j++) {
-
-      match_score = (use_global_alignment) ? min_score : 0;
-      match_x = match_y = 0;
-      
-      insert_x_score = insert_y_score = min_score;
-      insert_x_x = insert_y_y = 0;
-      insert_x_gap = insert_y_gap = 0;
-      
-      /* THIS SQUARE CAN END THE ALIGNMENT IF WE'RE USING LOCAL ALIGNMENT, */
-      /* OR IF BOTH THE X- AND Y-NODES CONTAIN THE END OF A SEQUENCE. */
-      possible_end_square = ((0 == use_global_alignment) || ((node_type_x[j] & LPO_FINAL_NODE) && (node_type_y[i] & LPO_FINAL_NODE)));
-      
-      /* LOOP OVER y-predecessors: */
-      for (ycount = 1, yl = y_left[i]; yl != NULL; ycount++, yl = yl->more) {
-	
-	prev_score = score_rows[yl->ipos];
-	
-	/* IMPROVE Y-INSERTION?: trace back to (i'=yl->ipos, j) */
-	prev_gap = prev_score[j].gap_y;
-	try_score = prev_score[j].score + yl->score - gap_penalty_y[prev_gap];
-	if (try_score > insert_y_score) {
-	  insert_y_score = try_score;
-	  insert_y_y = ycount;
-	  insert_y_gap = prev_gap;
-	}
-	
-	/* LOOP OVER x-predecessors (INSIDE y-predecessor LOOP): */
-	for (xcount = 1, xl = x_left[j]; xl != NULL; xcount++, xl = xl->more) {
-	  
-	  /* IMPROVE XY-MATCH?: trace back to (i'=yl->ipos, j'=xl->ipos) */
-	  try_score = prev_score[xl->ipos].score + xl->score + yl->score;
-	  if (try_score > match_score) {
-	    match_score = try_score;
-	    match_x = xcount;
-	    match_y = ycount;
-	  }
-	}
-      }
-      
-      /* LOOP OVER x-predecessors (OUTSIDE y-predecessor LOOP): */
-      for (xcount = 1, xl = x_left[j]; xl != NULL; xcount++, xl = xl->more) {
-
-	/* IMPROVE X-INSERTION?: trace back to (i, j'=xl->ipos) */
-	prev_gap = curr_score[xl->ipos].gap_x;
-	try_score = curr_score[xl->ipos].score + xl->score - gap_penalty_x[prev_gap];
-	if (try_score > insert_x_score) {
-	  insert_x_score = try_score;
-	  insert_x_x = xcount;
-	  insert_x_gap = prev_gap;
-	}
-      }
-      
-      /* USE CUSTOM OR DEFAULT SCORING FUNCTION: */
-      if (scoring_function != NULL) {
-	match_score += scoring_function (j, i, seq_x, seq_y, m);
-      }
-      else {
-	match_score += m->score[seq_x[i].letter][seq_y[j].letter];
-      }
-      
-      my_score = &curr_score[j];
-      my_move = &move[i][j];
-      
-      if (match_score > insert_y_score && match_score > insert_x_score) {
-	/* XY-MATCH */
-	my_score->score = match_score;
-	my_score->gap_x = 0;
-	my_score->gap_y = 0;
-	my_move->x = match_x;
-	my_move->y = match_y;
-      }
-      else if (insert_x_score > insert_y_score) {
-	/* X-INSERTION */
-	my_score->score = insert_x_score;
-	my_score->gap_x = next_gap_array[insert_x_gap];
-	my_score->gap_y = next_perp_gap_array[insert_x_gap];
-	my_move->x = insert_x_x;
-	my_move->y = 0;
-      }
-      else {
-	/* Y-INSERTION */
-	my_score->score = insert_y_score;
-	my_score->gap_x = next_perp_gap_array[insert_y_gap];
-	my_score->gap_y = next_gap_array[insert_y_gap];
-	my_move->x = 0;
-	my_move->y = insert_y_y;
-      }
+    dp_use (&dp, SCORE_ROW_BYTES (&dp));
+    if (dp.segment_rows == 0) {
+      CALLOC (dp.move[i], dp.band_hi[i] - dp.band_lo[i] + 1, DPMove_T);
+      dp_use (&dp, MOVE_ROW_BYTES (&dp, i));
+    }
 
-      /* RECORD BEST ALIGNMENT END FOR TRACEBACK: */
-      if (possible_end_square && my_score->score >= best_score) {
-	/* BREAK TIES BY CHOOSING MINIMUM (x,y): */
-	if (my_score->score > best_score || (j == best_x && i < best_y) || j < best_x) {
-	  best_score = my_score->score;
-	  best_x = j;
-	  best_y = i;
-	}
-      }
+    fill_dp_row (&dp, i, &best_score, &best_x, &best_y);
+
+    /* CHECKPOINT THE ROW BEFORE EACH SEGMENT: */
+    if (dp.segment_rows > 0 && (i+1) % dp.segment_rows == 0 && i+1 < len_y) {
+      CALLOC (dp.checkpoints[(i+1) / dp.segment_rows], len_x+1, DPScore_T);
+      memcpy (dp.checkpoints[(i+1) / dp.segment_rows], &(dp.score_rows[i][-1]),
+	      (len_x+1) * sizeof(DPScore_T));
+      dp.checkpoints[(i+1) / dp.segment_rows]++;
+      dp_use (&dp, SCORE_ROW_BYTES (&dp));
     }
 
     /* UPDATE # OF REFS TO 'SCORE' ROWS; FREE MEMORY WHEN POSSIBLE: */
-    for (yl = y_left[i]; yl != NULL; yl = yl->more) if ((j = yl->ipos) >= 0) {
+    for (yl = dp.y_left[i]; yl != NULL; yl = yl->more) if ((j = yl->ipos) >= 0) {
       if ((--refs_from_right_y[j]) == 0) {
-	score_rows[j] = &(score_rows[j][-1]);
-	FREE (score_rows[j]);
+	dp.score_rows[j] = &(dp.score_rows[j][-1]);
+	FREE (dp.score_rows[j]);
 	n_score_rows_alloced--;
+	dp_use (&dp, -SCORE_ROW_BYTES (&dp));
       }
     }
     if (refs_from_right_y[i] == 0) {
-      score_rows[i] = &(score_rows[i][-1]);
-      FREE (score_rows[i]);
+      dp.score_rows[i] = &(dp.score_rows[i][-1]);
+      FREE (dp.score_rows[i]);
       n_score_rows_alloced--;
+      dp_use (&dp, -SCORE_ROW_BYTES (&dp));
     }
   }
   
   IF_GUARD(best_x>=len_x || best_y>=len_y,1.1,(ERRTXT,"Bounds exceeded!\nbest_x,best_y:%d,%d\tlen:%d,%d\n",best_x,best_y,len_x,len_y),CRASH);
   
-  /**/
+  if (lpo_report_progress) {
     fprintf (stderr, "aligned (%d nodes, %ld edges) to (%d nodes, %ld edges): ", len_x, n_edges_x, len_y, n_edges_y);
     fprintf (stderr, "best %s score = %d @ (%d %d)\n", (use_global_alignment ? "global" : "local"), best_score, best_x, best_y);
-    /**/
+  }
     
   /* DYNAMIC PROGRAMING MATRIX COMPLETE, NOW TRACE BACK FROM best_x, best_y */
-  trace_back_lpo_alignment (len_x, len_y, move, x_left, y_left,
-			    best_x, best_y,
-			    x_to_y, y_to_x);
+  trace_back_lpo_alignment (&dp, best_x, best_y, x_to_y, y_to_x);
+
+  if (dp.peak_bytes > lpo_dp_peak_bytes)
+    lpo_dp_peak_bytes = dp.peak_bytes;
 
 
   /* CLEAN UP AND RETURN: */
   
-  FREE (node_type_x);
-  FREE (node_type_y);
+  FREE (dp.node_type_x);
+  FREE (dp.node_type_y);
   
   FREE (refs_from_right_x);
   FREE (refs_from_right_y);
@@ -456,32 +705,43 @@ LPOScore_T align_lpo_po (LPOSequence_T *lposeq_x,
   FREE (next_gap_array);
   FREE (next_perp_gap_array);
   
-  score_rows[-1] = &(score_rows[-1][-1]);
-  FREE (score_rows[-1]);
-  score_rows = &(score_rows[-1]);
-  FREE (score_rows);
+  dp.score_rows[-1] = &(dp.score_rows[-1][-1]);
+  FREE (dp.score_rows[-1]);
+  dp.score_rows = &(dp.score_rows[-1]);
+  FREE (dp.score_rows);
   
-  init_col_score = &(init_col_score[-1]);
-  FREE (init_col_score);
+  dp.init_col_score = &(dp.init_col_score[-1]);
+  FREE (dp.init_col_score);
     
   for (i=0; i<len_x; i++) {
-    if (x_left[i] != &seq_x[i].left) {
-      FREE (x_left[i]);
+    if (dp.x_left[i] != &dp.seq_x[i].left) {
+      FREE (dp.x_left[i]);
     }
   }
-  FREE (x_left);
+  FREE (dp.x_left);
   
   for (i=0; i<len_y; i++) {
-    if (y_left[i] != &seq_y[i].left) {
-      FREE (y_left[i]);
+    if (dp.y_left[i] != &dp.seq_y[i].left) {
+      FREE (dp.y_left[i]);
     }
   }
-  FREE (y_left);
+  FREE (dp.y_left);
   
   for (i=0; i<len_y; i++) {
-    FREE (move[i]);
+    FREE (dp.move[i]);
   }
-  FREE (move);
+  FREE (dp.move);
+
+  for (i=1; i<nsegment; i++) {
+    dp.checkpoints[i] = &(dp.checkpoints[i][-1]);
+    FREE (dp.checkpoints[i]);
+  }
+  FREE (dp.checkpoints);
+
+  dp.band_lo = &(dp.band_lo[-1]);
+  FREE (dp.band_lo);
+  dp.band_hi = &(dp.band_hi[-1]);
+  FREE (dp.band_hi);
   
   return best_score;
 }
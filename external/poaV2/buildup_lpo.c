@@ -6,6 +6,11 @@
 #include "lpo.h"
 
 
+/** set to zero to keep the progress messages below off stderr
+    (e.g. when the library is loaded into another program) */
+int lpo_report_progress = 1;
+
+
 /** if two align-rings are aligned to each other, make sure
     that the (single) aligned residue pair consists of identical
     residues, if possible.
@@ -101,7 +106,7 @@ LPOSequence_T *buildup_lpo(LPOSequence_T *new_seq,
   for (i=0;i<nseq;i++) { /* ALIGN ALL SEQUENCES TO my_lpo ONE BY ONE */
     if (seq[i].letter == NULL) /* HMM.  HASN'T BEEN INITIALIZED AT ALL YET */
       initialize_seqs_as_lpo(1,seq+i,score_matrix);
-    total_alloc=new_seq->length*seq[i].length
+    total_alloc=lpo_dp_cells(new_seq,seq+i) /* SMALLER IF BANDED */
       + sizeof(LPOLetter_T)*new_seq->length;
     if (total_alloc>max_alloc) { /* DP RECTANGLE ARRAY SIZE */
       max_alloc=total_alloc;
@@ -221,7 +226,7 @@ LPOSequence_T *buildup_clipped_lpo(LPOSequence_T *new_seq,
   for (i=0;i<nseq;i++) { /* ALIGN ALL SEQUENCES TO new_seq ONE BY ONE */
     if (seq[i].letter == NULL) /* HMM.  HASN'T BEEN INITIALIZED AT ALL YET */
       initialize_seqs_as_lpo(1,seq+i,score_matrix);
-    total_alloc=new_seq->length*seq[i].length
+    total_alloc=lpo_dp_cells(new_seq,seq+i) /* SMALLER IF BANDED */
       + sizeof(LPOLetter_T)*new_seq->length;
     if (total_alloc>max_alloc) { /* DP RECTANGLE ARRAY SIZE */
       max_alloc=total_alloc;
@@ -363,7 +368,8 @@ SeqPairScore_T *read_seqpair_scorefile (int nseq, LPOSequence_T **seq,
 			score_matrix,&al1,&al2,scoring_function,use_global_alignment); 
       FREE(al1); /* DUMP TEMPORARY MAPPING ARRAYS */
       FREE(al2);
-      fprintf(stderr,"Saving alignment score %d (%s), %d (%s) : %.2f\n",i,seq[i]->name,j,seq[j]->name,x);
+      if (lpo_report_progress)
+	fprintf(stderr,"Saving alignment score %d (%s), %d (%s) : %.2f\n",i,seq[i]->name,j,seq[j]->name,x);
       score_list[nscore].i = i;
       score_list[nscore].j = j;
       score_list[nscore].score = x;
@@ -380,7 +386,8 @@ SeqPairScore_T *read_seqpair_scorefile (int nseq, LPOSequence_T **seq,
   }
   else {  /* NOT DOING PROGRESSIVE ALIGNMENT */
     /* USE DEFAULT (=0.0) PAIRSCORES, ENSURING ITERATIVE ALIGNMENT: */
-    fprintf(stderr,"Performing iterative alignment...\n");
+    if (lpo_report_progress)
+      fprintf(stderr,"Performing iterative alignment...\n");
   }
   
   for (i=1;i<nseq;i++) {
@@ -493,13 +500,15 @@ LPOSequence_T *buildup_progressive_lpo(int nseq,LPOSequence_T **all_seqs,
     else /* CLUSTERS ALREADY FUSED, SO SKIP THIS PAIR */
       continue;
 
-    fprintf(stderr,"Fusing cluster %d (%s, nseq=%d) --> %d (%s, nseq=%d)... score %.2f\n",
-	    cluster_j,all_seqs[cluster_j]->name,all_seqs[cluster_j]->nsource_seq,
-	    cluster_i,all_seqs[cluster_i]->name,all_seqs[cluster_i]->nsource_seq,
-	    score[iscore].score);
+    if (lpo_report_progress)
+      fprintf(stderr,"Fusing cluster %d (%s, nseq=%d) --> %d (%s, nseq=%d)... score %.2f\n",
+	      cluster_j,all_seqs[cluster_j]->name,all_seqs[cluster_j]->nsource_seq,
+	      cluster_i,all_seqs[cluster_i]->name,all_seqs[cluster_i]->nsource_seq,
+	      score[iscore].score);
     
     new_seq = all_seqs[cluster_i];
-    total_alloc = new_seq->length * (sizeof(LPOLetter_T) + all_seqs[cluster_j]->length);
+    total_alloc = new_seq->length * sizeof(LPOLetter_T)
+      + lpo_dp_cells(new_seq, all_seqs[cluster_j]); /* SMALLER IF BANDED */
     if (total_alloc>max_alloc) { /* DP RECTANGLE ARRAY SIZE */
       max_alloc=total_alloc;
 #ifdef REPORT_MAX_ALLOC
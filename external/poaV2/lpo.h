@@ -82,8 +82,21 @@ LPOScore_T align_lpo_po(LPOSequence_T *lposeq_x,
 			  ResidueScoreMatrix_T *),
 			int use_global_alignment);
 
+extern int lpo_band_width;
+
+extern long lpo_dp_memory_cap;
+
+extern long lpo_dp_peak_bytes;
+
+void lpo_band_limits(int i,int len_x,int len_y,int band_width,
+		     int *lo,int *hi);
+
+long lpo_dp_cells(LPOSequence_T *lposeq_x,LPOSequence_T *lposeq_y);
+
 
 /************************************************** FROM buildup_lpo.c */
+extern int lpo_report_progress;
+
 LPOSequence_T *buildup_lpo(LPOSequence_T *new_seq,
 			   int nseq,LPOSequence_T seq[],
 			   ResidueScoreMatrix_T *score_matrix,
@@ -22,7 +22,7 @@ int main(int argc,char *argv[])
     *po_list_filename=NULL, *hbmin=NULL,*numeric_data=NULL,*numeric_data_name="Nmiscall",
     *dna_to_aa=NULL,*pair_score_file=NULL,*aafreq_file=NULL,*termval_file=NULL,
     *bold_seq_name=NULL,*subset_file=NULL,*subset2_file=NULL,*rm_subset_file=NULL,
-    *rm_subset2_file=NULL;
+    *rm_subset2_file=NULL,*band_width=NULL,*max_dp_mb=NULL;
   float bundling_threshold=0.9;
   int exit_code=0,count_sequence_errors=0,please_print_snps=0,
     report_consensus_seqs=0,report_major_allele=0,use_aggressive_fusion=0;
@@ -59,6 +59,11 @@ int main(int argc,char *argv[])
 "                           (If not provided, scores are constructed\n"
 "                           using pairwise sequence alignment.)\n"
 "  -fuse_all              Fuse identical letters on align rings.\n"
+"  -band_width VALUE      Only align each sequence within VALUE letters of\n"
+"                           the diagonal implied by the lengths (faster,\n"
+"                           and memory linear in the sequence length).\n"
+"  -max_dp_mb VALUE       Keep the DP matrices of each alignment under VALUE\n"
+"                           MB where possible, by filling them twice.\n"
 "\nANALYSIS:\n"
 "  -hb                    Perform heaviest bundling to generate consensi.\n"
 "  -hbmin VALUE           Include in heaviest bundle sequences with\n"
@@ -94,6 +99,8 @@ int main(int argc,char *argv[])
     ARGMATCH("-preserve_seqorder",do_preserve_sequence_order);  /* DO PRESERVE SEQUENCE ORDER */
     ARGGET("-hbmin",hbmin); /* SET THRESHOLD FOR BUNDLING */
     ARGMATCH("-fuse_all",use_aggressive_fusion);
+    ARGGET("-band_width",band_width); /* BANDED ALIGNMENT */
+    ARGGET("-max_dp_mb",max_dp_mb); /* DP MEMORY CAP */
     ARGMATCH("-do_global",do_global); /* DO GLOBAL */
     ARGGET("-read_pairscores",pair_score_file); /* FILENAME TO READ PAIR SCORES*/
     ARGMATCH("-do_progressive", do_progressive); /* DO PROGRESSIVE ALIGNMENT */
@@ -136,7 +143,11 @@ int main(int argc,char *argv[])
   }
   
   if (hbmin)
-    bundling_threshold=atof(hbmin);  
+    bundling_threshold=atof(hbmin);
+  if (band_width)
+    lpo_band_width=atoi(band_width);  
+  if (max_dp_mb)
+    lpo_dp_memory_cap=(long)atoi(max_dp_mb)<<20;
 
   if (!matrix_filename ||
       read_score_matrix(matrix_filename,&score_matrix)<=0){/* READ MATRIX */
@@ -0,0 +1,566 @@
+
+
+#include "default.h"
+#include "poa.h"
+#include "seq_util.h"
+#include "lpo.h"
+#include "align_score.h"
+#include "poa_api.h"
+#include "poa_simd.h"
+
+
+/** reads a score matrix file once, so that it can be passed to any number
+    of the calls below (free it with poa_free_score_matrix); returns NULL on
+    failure. the aligners only ever write the initial-gap slot of its gap
+    penalty arrays, and always set it before use, so it can be shared by
+    all the alignments of a process */
+ResidueScoreMatrix_T *poa_read_score_matrix(char matrix_filename[])
+{
+  ResidueScoreMatrix_T *score_matrix=NULL;
+
+  lpo_report_progress=0; /* WE ARE RUNNING INSIDE SOMEONE ELSE'S PROCESS */
+  if (!matrix_filename)
+    return NULL;
+  CALLOC(score_matrix,1,ResidueScoreMatrix_T);
+  if (read_score_matrix(matrix_filename,score_matrix)<=0) {
+    FREE(score_matrix);
+    return NULL;
+  }
+  return score_matrix;
+}
+
+
+void poa_free_score_matrix(ResidueScoreMatrix_T *score_matrix)
+{
+  FREE(score_matrix->gap_penalty_x);
+  FREE(score_matrix->gap_penalty_y);
+  FREE(score_matrix);
+}
+
+
+/** saves a sequence string as (*p_seq)[i], named and titled exactly as
+    read_fasta() would name the i-th sequence of a FASTA file; returns 1,
+    or 0 on failure */
+static int load_sequence(int i,char sequence[],Sequence_T **p_seq)
+{
+  int ok;
+  char seq_name[FASTA_NAME_MAX],*tmp_seq;
+
+  sprintf(seq_name,"Sequence_%d",i);
+  tmp_seq=strdup(sequence); /* create_seq() COMPACTS ITS INPUT IN PLACE */
+  ok=create_seq(i,p_seq,seq_name,"untitled",tmp_seq,dont_switch_case);
+  free(tmp_seq);
+  return ok;
+}
+
+
+/** saves nseq sequence strings to *p_seq (see load_sequence());
+    returns nseq, or 0 on failure */
+static int load_sequences(int nseq,char *sequences[],Sequence_T **p_seq)
+{
+  int i;
+
+  *p_seq=NULL;
+  LOOPF (i,nseq)
+    if (!load_sequence(i,sequences[i],p_seq))
+      return 0;
+  return nseq;
+}
+
+
+static void free_sequences(int nseq,Sequence_T *seq)
+{
+  int i;
+  LOOP (i,nseq)
+    free_lpo_sequence(seq+i,FALSE);
+  FREE(seq);
+}
+
+
+/** flattens the partial order in seq into a new POAGraph_T */
+static POAGraph_T *flatten_lpo(LPOSequence_T *seq,
+			       ResidueScoreMatrix_T *score_matrix)
+{
+  int i,j,k,nlink=0,nsource=0,*mark=NULL;
+  LPOLetterLink_T *link;
+  LPOLetterSource_T *source;
+  POAGraph_T *graph=NULL;
+
+  LOOP (i,seq->length) { /* COUNT LINKS AND SOURCES FIRST */
+    for (link= &seq->letter[i].left;link && link->ipos>=0;link=link->more)
+      nlink++;
+    for (source= &seq->letter[i].source;source;source=source->more)
+      nsource++;
+  }
+
+  CALLOC(graph,1,POAGraph_T);
+  graph->length=seq->length;
+  graph->nsource_seq=seq->nsource_seq;
+  CALLOC(graph->letters,seq->length+1,char);
+  CALLOC(graph->incoming_start,seq->length+1,int);
+  CALLOC(graph->incoming,nlink+1,int);
+  CALLOC(graph->edge_weights,nlink+1,int);
+  CALLOC(graph->source_start,seq->length+1,int);
+  CALLOC(graph->sources,nsource+1,int);
+
+  nlink=nsource=0;
+  LOOPF (i,seq->length) { /* SAME TRANSLATION AS write_lpo() */
+    graph->letters[i]= score_matrix && seq->letter[i].letter < score_matrix->nsymbol ?
+      score_matrix->symbol[seq->letter[i].letter] : seq->letter[i].letter;
+    graph->incoming_start[i]=nlink;
+    for (link= &seq->letter[i].left;link && link->ipos>=0;link=link->more)
+      graph->incoming[nlink++]=link->ipos;
+    graph->source_start[i]=nsource;
+    for (source= &seq->letter[i].source;source;source=source->more)
+      graph->sources[nsource++]=source->iseq;
+  }
+  graph->incoming_start[seq->length]=nlink;
+  graph->source_start[seq->length]=nsource;
+
+  /* EDGE WEIGHT = NO. OF SOURCES SHARED BY THE TWO NODES: MARK THE SOURCES
+     OF EACH NODE AND COUNT THE MARKED ONES IN EACH OF ITS PREDECESSORS */
+  CALLOC(mark,seq->nsource_seq+1,int);
+  LOOPF (i,seq->length) {
+    for (k=graph->source_start[i];k<graph->source_start[i+1];k++)
+      mark[graph->sources[k]]=i+1;
+    for (j=graph->incoming_start[i];j<graph->incoming_start[i+1];j++)
+      for (k=graph->source_start[graph->incoming[j]];
+	   k<graph->source_start[graph->incoming[j]+1];k++)
+	if (mark[graph->sources[k]]==i+1)
+	  graph->edge_weights[j]++;
+  }
+  FREE(mark);
+
+  return graph;
+}
+
+
+/** aligns nseq sequence strings into a partial order, the same way as
+    `poa -read_fasta FILE MATRIXFILE [-do_global] [-do_progressive]
+    [-band_width N] [-max_dp_mb N]' does (band_width and memory_cap_mb 0
+    for none), and returns it flattened into a POAGraph_T (free it with
+    poa_free_graph); returns NULL on failure */
+POAGraph_T *poa_align_sequences(int nseq,char *sequences[],
+				ResidueScoreMatrix_T *score_matrix,
+				int do_global,int do_progressive,
+				int band_width,int memory_cap_mb)
+{
+  int i;
+  Sequence_T *seq=NULL;
+  LPOSequence_T **input_seqs=NULL,*lpo_out=NULL;
+  POAGraph_T *graph=NULL;
+
+  if (nseq<=0 || !score_matrix || load_sequences(nseq,sequences,&seq)!=nseq)
+    return NULL;
+
+  CALLOC(input_seqs,nseq,LPOSequence_T *);
+  LOOPF (i,nseq) {
+    input_seqs[i]= &(seq[i]);
+    initialize_seqs_as_lpo(1,&(seq[i]),score_matrix);
+  }
+
+  lpo_band_width=band_width;
+  lpo_dp_memory_cap=(long)memory_cap_mb<<20;
+  lpo_out = buildup_progressive_lpo(nseq,input_seqs,score_matrix,
+				    0,do_progressive,NULL,
+				    matrix_scoring_function,do_global,0);
+  lpo_band_width=0;
+  lpo_dp_memory_cap=0;
+  if (lpo_out)
+    graph=flatten_lpo(lpo_out,score_matrix);
+
+  FREE(input_seqs);
+  free_sequences(nseq,seq);
+  return graph;
+}
+
+
+/** reads a partial order file (as written by `poa -po FILE') and returns it
+    flattened into a POAGraph_T (free it with poa_free_graph); returns NULL
+    on failure */
+POAGraph_T *poa_read_po_file(char po_filename[])
+{
+  FILE *ifile=NULL;
+  LPOSequence_T *seq=NULL;
+  POAGraph_T *graph=NULL;
+
+  if (!(ifile=fopen(po_filename,"r")))
+    return NULL;
+  seq=read_lpo(ifile);
+  fclose(ifile);
+  if (seq) { /* THE LETTERS ARE READ AS CHARACTERS, NO TRANSLATION NEEDED */
+    graph=flatten_lpo(seq,NULL);
+    free_lpo_sequence(seq,TRUE);
+  }
+  return graph;
+}
+
+
+/** saves to *score the alignment score of two sequence strings, as reported
+    by `poa' when aligning just those two; returns 1, or 0 on failure */
+int poa_pairwise_score(char seq1[],char seq2[],
+		       ResidueScoreMatrix_T *score_matrix,
+		       int do_global,int *score)
+{
+  char *sequences[2];
+  Sequence_T *seq=NULL;
+  LPOLetterRef_T *al1=NULL,*al2=NULL;
+
+  sequences[0]=seq1;
+  sequences[1]=seq2;
+  if (!score_matrix || load_sequences(2,sequences,&seq)!=2)
+    return 0;
+
+  initialize_seqs_as_lpo(2,seq,score_matrix);
+  *score=align_lpo_po(seq,seq+1,score_matrix,&al1,&al2,
+		      matrix_scoring_function,do_global);
+  FREE(al1);
+  FREE(al2);
+
+  free_sequences(2,seq);
+  return 1;
+}
+
+
+/* WITHOUT DOUBLE-GAP-SCORING align_lpo_po() ALWAYS GIVES A CELL THE SAME
+   gap_x AND gap_y, SO A SINGLE GAP LENGTH IS ENOUGH HERE */
+typedef struct {
+  LPOScore_T score;
+  int gap;
+} PairScore_T;
+
+
+/** score-only version of align_lpo_po() for two linear sequences x and y
+    (already translated to matrix indexes): the same recurrence, gap length
+    tracking and tie breaking, but only two score rows are kept. if
+    band_width>0, only cells within band_width of the diagonal implied by
+    the two lengths are filled, which is faster but may miss the best
+    alignment if the reads are not colinear. if use_simd and the CPU
+    supports it, the unbanded score is computed by the AVX2 kernel of
+    poa_simd.c instead (the same score; this loop is the reference) */
+static LPOScore_T score_linear_pair(int len_x,char seq_x[],
+				    int len_y,char seq_y[],
+				    ResidueScoreMatrix_T *m,
+				    int use_global_alignment,int band_width,
+				    int use_simd,
+				    PairScore_T *prev_row,PairScore_T *curr_row,
+				    PairScore_T *init_col,int next_gap_array[])
+{
+  int i,j,j_min,j_max,prev_gap,possible_end_square;
+  int max_gap_length=m->max_gap_length;
+  LPOScore_T *gap_penalty_x=m->gap_penalty_x,*gap_penalty_y=m->gap_penalty_y;
+  LPOScore_T min_score= -999999,best_score= -999999;
+  LPOScore_T try_score,insert_x_score,insert_y_score,match_score;
+  int insert_x_gap,insert_y_gap;
+  PairScore_T *swap;
+
+  /* GAP LENGTH EXTENSION RULE, AS IN align_lpo_po() */
+  LOOPF (i,max_gap_length+1)
+    next_gap_array[i] = (i<max_gap_length) ? i+1 : i;
+  if (0 == use_global_alignment) { /* FREE EXTENSION OF INITIAL GAP */
+    gap_penalty_x[max_gap_length+1] = gap_penalty_y[max_gap_length+1] = 0;
+    next_gap_array[max_gap_length+1] = max_gap_length+1;
+  }
+  else {
+    gap_penalty_x[max_gap_length+1] = gap_penalty_x[0];
+    gap_penalty_y[max_gap_length+1] = gap_penalty_y[0];
+    next_gap_array[max_gap_length+1] = next_gap_array[0];
+  }
+
+  if (use_simd && band_width<=0 && poa_simd_supported())
+    return score_linear_pair_avx2(len_x,seq_x,len_y,seq_y,m,
+				  use_global_alignment,next_gap_array);
+
+  /* ROWS AND COLUMN ARE OFFSET BY ONE SO THAT INDEX -1 IS THE INITIAL STATE */
+  prev_row[0].score=0;
+  prev_row[0].gap=max_gap_length+1;
+  LOOPF (j,len_x) { /* FILL INITIAL ROW (-1) */
+    prev_gap=prev_row[j].gap;
+    try_score=prev_row[j].score - gap_penalty_x[prev_gap];
+    prev_row[j+1].score=min_score;
+    prev_row[j+1].gap=0;
+    if (try_score > min_score) {
+      prev_row[j+1].score=try_score;
+      prev_row[j+1].gap=next_gap_array[prev_gap];
+    }
+  }
+  init_col[0]=prev_row[0];
+  LOOPF (i,len_y) { /* FILL INITIAL COLUMN (-1) */
+    prev_gap=init_col[i].gap;
+    try_score=init_col[i].score - gap_penalty_y[prev_gap];
+    init_col[i+1].score=min_score;
+    init_col[i+1].gap=0;
+    if (try_score > min_score) {
+      init_col[i+1].score=try_score;
+      init_col[i+1].gap=next_gap_array[prev_gap];
+    }
+  }
+
+  LOOPF (i,len_y) {
+    curr_row[0]=init_col[i+1];
+    j_min=0;
+    j_max=len_x-1;
+    if (band_width>0) { /* ONLY FILL THE BAND AROUND THE DIAGONAL */
+      j=(int)((long)i*len_x/len_y);
+      j_min= j-band_width > 0 ? j-band_width : 0;
+      j_max= j+band_width < len_x-1 ? j+band_width : len_x-1;
+      for (j=0;j<j_min;j++) {
+	curr_row[j+1].score=min_score;
+	curr_row[j+1].gap=0;
+      }
+      for (j=j_max+1;j<len_x;j++) {
+	curr_row[j+1].score=min_score;
+	curr_row[j+1].gap=0;
+      }
+    }
+    for (j=j_min;j<=j_max;j++) {
+      match_score = (use_global_alignment) ? min_score : 0;
+      insert_x_score = insert_y_score = min_score;
+      insert_x_gap = insert_y_gap = 0;
+      possible_end_square = ((0 == use_global_alignment) ||
+			     (j == len_x-1 && i == len_y-1));
+
+      /* Y-INSERTION: trace back to (i-1, j) */
+      prev_gap = prev_row[j+1].gap;
+      try_score = prev_row[j+1].score - gap_penalty_y[prev_gap];
+      if (try_score > insert_y_score) {
+	insert_y_score = try_score;
+	insert_y_gap = prev_gap;
+      }
+      /* XY-MATCH: trace back to (i-1, j-1) */
+      try_score = prev_row[j].score;
+      if (try_score > match_score)
+	match_score = try_score;
+      /* X-INSERTION: trace back to (i, j-1) */
+      prev_gap = curr_row[j].gap;
+      try_score = curr_row[j].score - gap_penalty_x[prev_gap];
+      if (try_score > insert_x_score) {
+	insert_x_score = try_score;
+	insert_x_gap = prev_gap;
+      }
+
+      match_score += m->score[(int)seq_x[j]][(int)seq_y[i]];
+
+      if (match_score > insert_y_score && match_score > insert_x_score) {
+	curr_row[j+1].score = match_score;
+	curr_row[j+1].gap = 0;
+      }
+      else if (insert_x_score > insert_y_score) {
+	curr_row[j+1].score = insert_x_score;
+	curr_row[j+1].gap = next_gap_array[insert_x_gap];
+      }
+      else {
+	curr_row[j+1].score = insert_y_score;
+	curr_row[j+1].gap = next_gap_array[insert_y_gap];
+      }
+
+      if (possible_end_square && curr_row[j+1].score > best_score)
+	best_score = curr_row[j+1].score;
+    }
+    swap=prev_row;
+    prev_row=curr_row;
+    curr_row=swap;
+  }
+
+  return best_score;
+}
+
+
+/** scores npair pairs of sequence strings in one call: scores[k] is what
+    poa_pairwise_score() gives for sequences[pair_x[k]], sequences[pair_y[k]]
+    (or its banded approximation if band_width>0), computed with SIMD
+    instructions if use_simd and the CPU supports them (see
+    poa_simd_supported()). each sequence is translated only once; returns
+    1, or 0 on failure */
+int poa_pairwise_scores(int nseq,char *sequences[],
+			int npair,int pair_x[],int pair_y[],
+			ResidueScoreMatrix_T *score_matrix,
+			int do_global,int band_width,int use_simd,
+			int scores[])
+{
+  int i,k,max_length=0,*lengths=NULL;
+  char **indexed=NULL;
+  PairScore_T *prev_row=NULL,*curr_row=NULL,*init_col=NULL;
+  int *next_gap_array=NULL;
+
+  if (!score_matrix)
+    return 0;
+
+  CALLOC(lengths,nseq+1,int);
+  CALLOC(indexed,nseq+1,char *);
+  LOOPF (i,nseq) { /* SAME TRANSLATION AS initialize_seqs_as_lpo() */
+    indexed[i]=strdup(sequences[i]);
+    lengths[i]=strlen(indexed[i]);
+    limit_residues(indexed[i],score_matrix->symbol);
+    index_symbols(lengths[i],indexed[i],indexed[i],
+		  score_matrix->nsymbol,score_matrix->symbol);
+    if (lengths[i]>max_length)
+      max_length=lengths[i];
+  }
+
+  CALLOC(prev_row,max_length+1,PairScore_T);
+  CALLOC(curr_row,max_length+1,PairScore_T);
+  CALLOC(init_col,max_length+1,PairScore_T);
+  CALLOC(next_gap_array,score_matrix->max_gap_length+2,int);
+  LOOPF (k,npair)
+    scores[k]=score_linear_pair(lengths[pair_x[k]],indexed[pair_x[k]],
+				lengths[pair_y[k]],indexed[pair_y[k]],
+				score_matrix,do_global,band_width,use_simd,
+				prev_row,curr_row,init_col,next_gap_array);
+
+  FREE(prev_row);
+  FREE(curr_row);
+  FREE(init_col);
+  FREE(next_gap_array);
+  LOOP (i,nseq)
+    FREE(indexed[i]);
+  FREE(indexed);
+  FREE(lengths);
+  return 1;
+}
+
+
+/** the scoring sweep of consensus.py over a flattened partial order (see
+    PoaGraph there): sets score[i] and previous[i] (-1 for none) for every
+    node, in one pass in topological order. if pb_like, score(node) =
+    2*nsequences[node] - no. of outgoing edges, else score(node) =
+    score(best predecessor) + weight of the edge from it. the best
+    predecessor is the one with the heaviest edge, ties going to the one
+    with the higher score (the first one, if those tie too) */
+void poa_score_dag(int length,int incoming_start[],int incoming[],
+		   int edge_weights[],int nsequences[],int pb_like,
+		   int score[],int previous[])
+{
+  int i,e,best_edge,max_weight;
+
+  if (pb_like) {
+    LOOPF (i,length)
+      score[i]=2*nsequences[i];
+    LOOPF (e,incoming_start[length]) /* MINUS OUT-DEGREE */
+      score[incoming[e]]--;
+  }
+  else
+    LOOPF (i,length)
+      score[i]=0;
+
+  LOOPF (i,length) {
+    best_edge= -1;
+    max_weight=0;
+    for (e=incoming_start[i];e<incoming_start[i+1];e++) {
+      if (edge_weights[e]>max_weight || best_edge<0) {
+	max_weight=edge_weights[e];
+	best_edge=e;
+      }
+      else if (edge_weights[e]==max_weight &&
+	       score[incoming[best_edge]]+edge_weights[best_edge] <
+	       score[incoming[e]]+edge_weights[e])
+	best_edge=e;
+    }
+    previous[i]= best_edge>=0 ? incoming[best_edge] : -1;
+    if (!pb_like && i>0 && best_edge>=0)
+      score[i]=score[incoming[best_edge]]+edge_weights[best_edge];
+  }
+}
+
+
+/** a partial order that sequences are added to one at a time (see
+    poa_add_sequence()) */
+struct POAAligner_S {
+  ResidueScoreMatrix_T *score_matrix;
+  int do_global;
+  int band_width;
+  int memory_cap_mb;
+  int nseq;
+  Sequence_T *seq; /* seq[0] IS THE PARTIAL ORDER, THE REST ARE FUSED IN */
+};
+
+
+/** starts a new, empty incremental alignment (free it with
+    poa_free_aligner), banded if band_width>0 and with its DP memory
+    capped if memory_cap_mb>0 (see poa_align_sequences()); the score
+    matrix must outlive it */
+POAAligner_T *poa_new_aligner(ResidueScoreMatrix_T *score_matrix,
+			      int do_global,int band_width,int memory_cap_mb)
+{
+  POAAligner_T *aligner=NULL;
+
+  if (!score_matrix)
+    return NULL;
+  CALLOC(aligner,1,POAAligner_T);
+  aligner->score_matrix=score_matrix;
+  aligner->do_global=do_global;
+  aligner->band_width=band_width;
+  aligner->memory_cap_mb=memory_cap_mb;
+  return aligner;
+}
+
+
+/** aligns one more sequence string to the partial order and fuses it in.
+    after k calls the partial order is the same as poa_align_sequences()
+    gives for those k sequences without do_progressive (which fuses them
+    one by one, in order); returns the no. of sequences aligned so far, or
+    0 on failure */
+int poa_add_sequence(POAAligner_T *aligner,char sequence[])
+{
+  int i=aligner->nseq;
+  Sequence_T *seq;
+
+  if (!load_sequence(i,sequence,&aligner->seq))
+    return 0;
+  seq=aligner->seq; /* load_sequence() MAY HAVE MOVED THE ARRAY */
+  initialize_seqs_as_lpo(1,seq+i,aligner->score_matrix);
+  if (i>0) { /* AS buildup_progressive_lpo() FUSES THE NEXT CLUSTER IN */
+    lpo_band_width=aligner->band_width;
+    lpo_dp_memory_cap=(long)aligner->memory_cap_mb<<20;
+    buildup_pairwise_lpo(seq,seq+i,aligner->score_matrix,0,
+			 matrix_scoring_function,aligner->do_global);
+    lpo_band_width=0;
+    lpo_dp_memory_cap=0;
+  }
+  return ++aligner->nseq;
+}
+
+
+/** returns the partial order so far flattened into a new POAGraph_T (free
+    it with poa_free_graph), or NULL if no sequence has been added yet */
+POAGraph_T *poa_aligner_graph(POAAligner_T *aligner)
+{
+  if (aligner->nseq<=0)
+    return NULL;
+  return flatten_lpo(aligner->seq,aligner->score_matrix);
+}
+
+
+void poa_free_aligner(POAAligner_T *aligner)
+{
+  if (!aligner)
+    return;
+  free_sequences(aligner->nseq,aligner->seq);
+  free(aligner);
+}
+
+
+/** returns the peak memory (in bytes) that the DP matrices of any
+    alignment took since the last call (or since the library was loaded),
+    and starts over */
+long poa_take_dp_peak_bytes(void)
+{
+  long peak=lpo_dp_peak_bytes;
+
+  lpo_dp_peak_bytes=0;
+  return peak;
+}
+
+
+void poa_free_graph(POAGraph_T *graph)
+{
+  if (!graph)
+    return;
+  FREE(graph->letters);
+  FREE(graph->incoming_start);
+  FREE(graph->incoming);
+  FREE(graph->edge_weights);
+  FREE(graph->source_start);
+  FREE(graph->sources);
+  free(graph);
+}
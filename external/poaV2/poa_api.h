@@ -0,0 +1,72 @@
+#ifndef POA_API_HEADER_INCLUDED
+#define POA_API_HEADER_INCLUDED
+
+#include <default.h>
+#include <poa.h>
+#include <seq_util.h>
+
+/** a partial order flattened into plain arrays, for callers that load
+    libpoa.so in-process (e.g. poaligner.py through ctypes) instead of
+    reading a .po file written by the poa program.
+
+    the incoming links of node i are
+      incoming[incoming_start[i]] .. incoming[incoming_start[i+1]-1]
+    and the source sequences it contains are
+      sources[source_start[i]] .. sources[source_start[i+1]-1]
+    in the same order as the L and S fields that write_lpo() prints */
+typedef struct {
+  int length; /* NUMBER OF NODES */
+  int nsource_seq; /* NUMBER OF SEQUENCES ALIGNED */
+  char *letters; /* [length] RESIDUE OF EACH NODE */
+  int *incoming_start; /* [length+1] */
+  int *incoming;
+  int *source_start; /* [length+1] */
+  int *sources;
+  int *edge_weights; /* [incoming_start[length]] NO. OF SOURCES SHARED BY
+			THE TWO NODES OF EACH incoming LINK */
+} POAGraph_T;
+
+typedef struct POAAligner_S POAAligner_T;
+
+/*********************************************************** poa_api.c */
+ResidueScoreMatrix_T *poa_read_score_matrix(char matrix_filename[]);
+
+void poa_free_score_matrix(ResidueScoreMatrix_T *score_matrix);
+
+POAGraph_T *poa_align_sequences(int nseq,char *sequences[],
+				ResidueScoreMatrix_T *score_matrix,
+				int do_global,int do_progressive,
+				int band_width,int memory_cap_mb);
+
+POAGraph_T *poa_read_po_file(char po_filename[]);
+
+int poa_pairwise_score(char seq1[],char seq2[],
+		       ResidueScoreMatrix_T *score_matrix,
+		       int do_global,int *score);
+
+int poa_pairwise_scores(int nseq,char *sequences[],
+			int npair,int pair_x[],int pair_y[],
+			ResidueScoreMatrix_T *score_matrix,
+			int do_global,int band_width,int use_simd,
+			int scores[]);
+
+int poa_simd_supported(void);
+
+void poa_score_dag(int length,int incoming_start[],int incoming[],
+		   int edge_weights[],int nsequences[],int pb_like,
+		   int score[],int previous[]);
+
+POAAligner_T *poa_new_aligner(ResidueScoreMatrix_T *score_matrix,
+			      int do_global,int band_width,int memory_cap_mb);
+
+int poa_add_sequence(POAAligner_T *aligner,char sequence[]);
+
+POAGraph_T *poa_aligner_graph(POAAligner_T *aligner);
+
+void poa_free_aligner(POAAligner_T *aligner);
+
+long poa_take_dp_peak_bytes(void);
+
+void poa_free_graph(POAGraph_T *graph);
+
+#endif
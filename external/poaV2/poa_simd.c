@@ -0,0 +1,204 @@
+#include "default.h"
+#include "poa.h"
+#include "seq_util.h"
+#include "poa_simd.h"
+
+#ifdef POA_SIMD_X86
+#include <immintrin.h>
+
+#define NLANE 8 /* 32-BIT CELLS PER AVX2 VECTOR */
+
+
+/** 1 if this CPU can run score_linear_pair_avx2(), else 0 */
+int poa_simd_supported(void)
+{
+  static int supported= -1;
+
+  if (supported<0) {
+    __builtin_cpu_init();
+    supported=__builtin_cpu_supports("avx2") ? 1 : 0;
+  }
+  return supported;
+}
+
+
+#define LOAD(P) _mm256_loadu_si256((__m256i *)(P))
+#define STORE(P,V) _mm256_storeu_si256((__m256i *)(P),(V))
+#define GATHER(BASE,INDEX) _mm256_i32gather_epi32((int *)(BASE),(INDEX),4)
+
+/** score_linear_pair() of poa_api.c (unbanded), NLANE cells at a time:
+    the cells of an anti-diagonal i+j=k only depend on the two diagonals
+    before it, so they are filled together, with the same recurrence, gap
+    length tracking and comparisons as the scalar kernel, so the score is
+    the same. the gap penalties, next gap lengths and substitution scores
+    are looked up with gathers. the gap penalty arrays and next_gap_array
+    must be set up for use_global_alignment by the caller, as
+    score_linear_pair() does */
+__attribute__((target("avx2")))
+LPOScore_T score_linear_pair_avx2(int len_x,char seq_x[],
+				  int len_y,char seq_y[],
+				  ResidueScoreMatrix_T *m,
+				  int use_global_alignment,
+				  int next_gap_array[])
+{
+  int i,j,k,lo,hi,prev_gap,nbuf=len_y+NLANE+2,max_gap_length=m->max_gap_length;
+  LPOScore_T *gap_penalty_x=m->gap_penalty_x,*gap_penalty_y=m->gap_penalty_y;
+  LPOScore_T min_score= -999999,best_score= -999999,try_score;
+  int *buf=NULL,*x_rev,*y_index,*row_score,*row_gap,*col_score,*col_gap;
+  int *diag_score[3],*diag_gap[3],*swap;
+  int lanes[NLANE],best[NLANE];
+  __m256i vmin,vmatch,vlanes,vbest,vhi;
+  __m256i up_score,up_gap,left_score,left_gap,sub,try,mask,ys,yg,xs,xg,ms,xy,xgt;
+
+  if (len_x<=0 || len_y<=0)
+    return best_score;
+
+  /* x REVERSED (SO THAT x[k-i] IS CONTIGUOUS IN i) AND PRE-SCALED TO
+     MATRIX ROWS, y, THE INITIAL ROW AND COLUMN (OFFSET BY ONE SO THAT
+     INDEX 0 IS -1) AND THREE ROLLING DIAGONALS (OFFSET BY ONE IN i). THE
+     PADDING LETS THE LAST VECTOR OF A DIAGONAL RUN PAST ITS END: ITS
+     EXTRA LANES READ ZEROS OR OTHER EXTRA LANES, WHICH ARE VALID GAP
+     LENGTHS AND LETTERS, AND ARE NEVER USED */
+  CALLOC(buf,(len_x+NLANE)+(len_y+NLANE)+2*(len_x+1)+2*(len_y+1)+6*nbuf,int);
+  x_rev=buf;
+  y_index=x_rev+len_x+NLANE;
+  row_score=y_index+len_y+NLANE;
+  row_gap=row_score+len_x+1;
+  col_score=row_gap+len_x+1;
+  col_gap=col_score+len_y+1;
+  LOOP (i,3) {
+    diag_score[i]=col_gap+len_y+1+2*i*nbuf;
+    diag_gap[i]=diag_score[i]+nbuf;
+  }
+  LOOPF (j,len_x)
+    x_rev[len_x-1-j]=seq_x[j]*MATRIX_SYMBOL_MAX;
+  LOOPF (i,len_y)
+    y_index[i]=seq_y[i];
+
+  /* INITIAL ROW AND COLUMN, AS IN score_linear_pair() */
+  row_score[0]=col_score[0]=0;
+  row_gap[0]=col_gap[0]=max_gap_length+1;
+  LOOPF (j,len_x) {
+    prev_gap=row_gap[j];
+    try_score=row_score[j] - gap_penalty_x[prev_gap];
+    row_score[j+1]=min_score;
+    row_gap[j+1]=0;
+    if (try_score > min_score) {
+      row_score[j+1]=try_score;
+      row_gap[j+1]=next_gap_array[prev_gap];
+    }
+  }
+  LOOPF (i,len_y) {
+    prev_gap=col_gap[i];
+    try_score=col_score[i] - gap_penalty_y[prev_gap];
+    col_score[i+1]=min_score;
+    col_gap[i+1]=0;
+    if (try_score > min_score) {
+      col_score[i+1]=try_score;
+      col_gap[i+1]=next_gap_array[prev_gap];
+    }
+  }
+
+  /* DIAGONALS -2 (CELL (-1,-1)) AND -1 (CELLS (-1,0) AND (0,-1)) */
+  diag_score[0][0]=row_score[0];
+  diag_gap[0][0]=row_gap[0];
+  diag_score[1][0]=row_score[1];
+  diag_gap[1][0]=row_gap[1];
+  diag_score[1][1]=col_score[1];
+  diag_gap[1][1]=col_gap[1];
+
+  LOOPF (i,NLANE)
+    lanes[i]=i;
+  vlanes=LOAD(lanes);
+  vmin=_mm256_set1_epi32(min_score);
+  vmatch=use_global_alignment ? vmin : _mm256_setzero_si256();
+  vbest=vmin;
+
+  for (k=0;k<len_x+len_y-1;k++) { /* DIAGONAL i+j=k: i FROM lo TO hi */
+    lo= k-len_x+1 > 0 ? k-len_x+1 : 0;
+    hi= k < len_y-1 ? k : len_y-1;
+    vhi=_mm256_set1_epi32(hi);
+    for (i=lo;i<=hi;i+=NLANE) {
+      /* Y-INSERTION: trace back to (i-1, j), ON DIAGONAL k-1 */
+      up_score=LOAD(diag_score[1]+i);
+      up_gap=LOAD(diag_gap[1]+i);
+      try=_mm256_sub_epi32(up_score,GATHER(gap_penalty_y,up_gap));
+      mask=_mm256_cmpgt_epi32(try,vmin);
+      ys=_mm256_blendv_epi8(vmin,try,mask);
+      yg=_mm256_and_si256(mask,up_gap);
+      /* X-INSERTION: trace back to (i, j-1), ON DIAGONAL k-1 */
+      left_score=LOAD(diag_score[1]+i+1);
+      left_gap=LOAD(diag_gap[1]+i+1);
+      try=_mm256_sub_epi32(left_score,GATHER(gap_penalty_x,left_gap));
+      mask=_mm256_cmpgt_epi32(try,vmin);
+      xs=_mm256_blendv_epi8(vmin,try,mask);
+      xg=_mm256_and_si256(mask,left_gap);
+      /* XY-MATCH: trace back to (i-1, j-1), ON DIAGONAL k-2 */
+      sub=GATHER(&(m->score[0][0]),
+		 _mm256_add_epi32(LOAD(x_rev+len_x-1-k+i),LOAD(y_index+i)));
+      ms=_mm256_add_epi32(_mm256_max_epi32(vmatch,LOAD(diag_score[0]+i)),sub);
+
+      xy=_mm256_and_si256(_mm256_cmpgt_epi32(ms,ys),_mm256_cmpgt_epi32(ms,xs));
+      xgt=_mm256_cmpgt_epi32(xs,ys);
+      STORE(diag_score[2]+i+1,
+	    _mm256_blendv_epi8(_mm256_blendv_epi8(ys,xs,xgt),ms,xy));
+      STORE(diag_gap[2]+i+1,
+	    _mm256_andnot_si256(xy,GATHER(next_gap_array,_mm256_blendv_epi8(yg,xg,xgt))));
+
+      if (0 == use_global_alignment) { /* EVERY CELL (UP TO hi) CAN END IT */
+	mask=_mm256_cmpgt_epi32(_mm256_add_epi32(_mm256_set1_epi32(i),vlanes),vhi);
+	vbest=_mm256_max_epi32(vbest,_mm256_blendv_epi8(LOAD(diag_score[2]+i+1),vmin,mask));
+      }
+    }
+
+    /* CELLS (-1, k+1) AND (k+1, -1), FOR THE NEXT TWO DIAGONALS */
+    if (k+1<len_x) {
+      diag_score[2][0]=row_score[k+2];
+      diag_gap[2][0]=row_gap[k+2];
+    }
+    if (k+1<len_y) {
+      diag_score[2][k+2]=col_score[k+2];
+      diag_gap[2][k+2]=col_gap[k+2];
+    }
+    swap=diag_score[0]; /* ROLL THE DIAGONALS */
+    diag_score[0]=diag_score[1];
+    diag_score[1]=diag_score[2];
+    diag_score[2]=swap;
+    swap=diag_gap[0];
+    diag_gap[0]=diag_gap[1];
+    diag_gap[1]=diag_gap[2];
+    diag_gap[2]=swap;
+  }
+
+  if (use_global_alignment) { /* ONLY (len_y-1, len_x-1) CAN END IT */
+    if (diag_score[1][len_y] > best_score)
+      best_score=diag_score[1][len_y];
+  }
+  else {
+    STORE(best,vbest);
+    LOOPF (i,NLANE)
+      if (best[i] > best_score)
+	best_score=best[i];
+  }
+
+  FREE(buf);
+  return best_score;
+}
+
+#else
+
+int poa_simd_supported(void)
+{
+  return 0;
+}
+
+LPOScore_T score_linear_pair_avx2(int len_x,char seq_x[],
+				  int len_y,char seq_y[],
+				  ResidueScoreMatrix_T *m,
+				  int use_global_alignment,
+				  int next_gap_array[])
+{
+  return -999999; /* NEVER CALLED: poa_simd_supported() IS 0 */
+}
+
+#endif
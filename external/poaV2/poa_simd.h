@@ -0,0 +1,23 @@
+#ifndef POA_SIMD_HEADER_INCLUDED
+#define POA_SIMD_HEADER_INCLUDED
+
+#include <default.h>
+#include <poa.h>
+#include <seq_util.h>
+
+/* THE AVX2 KERNEL IS ONLY BUILT FOR x86 WITH GCC OR CLANG (FOR THE target
+   ATTRIBUTE AND __builtin_cpu_supports); ELSEWHERE THE SCALAR PATH IS USED */
+#if (defined(__x86_64__) || defined(__i386__)) && defined(__GNUC__)
+#define POA_SIMD_X86 1
+#endif
+
+/************************************************************ poa_simd.c */
+int poa_simd_supported(void);
+
+LPOScore_T score_linear_pair_avx2(int len_x,char seq_x[],
+				  int len_y,char seq_y[],
+				  ResidueScoreMatrix_T *m,
+				  int use_global_alignment,
+				  int next_gap_array[]);
+
+#endif
@@ -0,0 +1,35 @@
+#!/usr/bin/env python
+"""
+Module for MinHash sketches of reads, to estimate how much two reads (or their
+reverse complements) overlap in linear time instead of aligning them
+"""
+import heapq
+import zlib
+
+KMER_SIZE   = 12  # Short enough for k-mers to survive the subreads' error rate
+SKETCH_SIZE = 256 # No. of smallest k-mer hashes kept per read
+
+
+def minhash_sketch(sequence, kmer_size=KMER_SIZE, sketch_size=SKETCH_SIZE):
+    """
+    Returns the MinHash (bottom-sketch_size) sketch of a DNA sequence string: the
+    set of the smallest hashes of its k-mers. The hashes are crc32s, so that
+    sketches are the same in every process and run
+    """
+    data = sequence.encode('ascii')
+    hashes = set(zlib.crc32(data[i:i+kmer_size]) & 0xffffffff
+                 for i in range(len(data) - kmer_size + 1))
+    return frozenset(heapq.nsmallest(sketch_size, hashes))
+
+
+def sketch_similarity(sketch1, sketch2, sketch_size=SKETCH_SIZE):
+    """
+    Returns the estimated Jaccard similarity (0 to 1) of the k-mer sets of two
+    sequences, from their sketches: the fraction of the smallest hashes of the
+    union of both that are in both
+    """
+    union = heapq.nsmallest(sketch_size, sketch1 | sketch2)
+    if not union:
+        return 0.0
+    shared = sum(1 for h in union if h in sketch1 and h in sketch2)
+    return shared / float(len(union))
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+"""
+Module to read PacBio BAM index (.pbi) files
+"""
+import gzip
+import os
+import struct
+
+PBI_MAGIC       = b'PBI\x01'
+PBI_HEADER_SIZE = 32 # magic, version, flags, no. of reads and 18 reserved bytes
+PBI_VERSION     = 0x030001 # 3.0.1
+
+
+def get_pbi_file(bam_file):
+    """
+    Returns the location of the .pbi index of a bam file, or None if it has
+    not been indexed (e.g. with pacbio's 'pbindex')
+    """
+    pbi_file = bam_file + '.pbi'
+    return pbi_file if os.path.isfile(pbi_file) else None
+
+
+def read_pbi_index(pbi_file):
+    """
+    Reads the BasicData section of a .pbi file (a BGZF compressed file, that
+    gzip can read as is). Returns (hole_numbers, file_offsets), with one entry
+    per bam record in file order. The file offsets are BGZF virtual offsets,
+    that pysam's AlignmentFile.seek() accepts
+    """
+    with gzip.open(pbi_file, 'rb') as f:
+        data = f.read()
+    if data[:4] != PBI_MAGIC:
+        raise ValueError("Not a PacBio BAM index file: %s" % pbi_file)
+    nreads = struct.unpack_from('<I', data, 10)[0]
+
+    # BasicData is a column per field: rgId, qStart, qEnd, holeNumber (int32),
+    # readQual (float), ctxtFlag (uint8) and fileOffset (int64)
+    hole_numbers_start = PBI_HEADER_SIZE + 3 * 4 * nreads
+    file_offsets_start = PBI_HEADER_SIZE + 5 * 4 * nreads + nreads
+    if len(data) < file_offsets_start + 8 * nreads:
+        raise ValueError("Truncated PacBio BAM index file: %s" % pbi_file)
+    hole_numbers = struct.unpack_from('<%di' % nreads, data, hole_numbers_start)
+    file_offsets = struct.unpack_from('<%dq' % nreads, data, file_offsets_start)
+    return hole_numbers, file_offsets
+
+
+def get_indexed_wells(pbi_file, is_selected_well):
+    """
+    Returns a list of (well_id, file_offset, nreads, end_offset) tuples, in
+    file order, for each well for which is_selected_well(well_id) is True:
+    the offset of its first record, its no. of records and the offset of the
+    record right after its last one (None for the last well of the file)
+
+    The records of each well must be together, with increasing well ids (as
+    in a sorted-by-qname bam file)
+    """
+    hole_numbers, file_offsets = read_pbi_index(pbi_file)
+    wells = []
+    start = 0
+    for end in range(1, len(hole_numbers) + 1):
+        if end < len(hole_numbers) and hole_numbers[end] == hole_numbers[start]:
+            continue
+        if end < len(hole_numbers) and hole_numbers[end] < hole_numbers[start]:
+            raise ValueError('This program expects a sorted .bam file')
+        well_id = hole_numbers[start]
+        if is_selected_well(well_id):
+            end_offset = file_offsets[end] if end < len(hole_numbers) else None
+            wells.append((well_id, file_offsets[start], end - start, end_offset))
+        start = end
+    return wells
+
+
+def _get_tag(record, tag, default):
+    return record.get_tag(tag) if record.has_tag(tag) else default
+
+
+def write_pbi_index(bam_file):
+    """
+    Writes the .pbi index of a PacBio bam file, with just the BasicData
+    section (as read by read_pbi_index). Returns the .pbi file name
+    """
+    import pysam
+
+    columns = dict((field, []) for field in ('rgId', 'qStart', 'qEnd', 'holeNumber',
+                                             'readQual', 'ctxtFlag', 'fileOffset'))
+    inf = pysam.AlignmentFile(bam_file, 'rb', check_sq=False)
+    while True:
+        file_offset = inf.tell()
+        try:
+            record = next(inf)
+        except StopIteration:
+            break
+        # Read group ids are 8 hex digits, stored as a signed int32
+        rg_id = int(_get_tag(record, 'RG', '0'), 16)
+        columns['rgId'].append(rg_id - (1 << 32) if rg_id >= (1 << 31) else rg_id)
+        columns['qStart'].append(_get_tag(record, 'qs', -1))
+        columns['qEnd'].append(_get_tag(record, 'qe', -1))
+        columns['holeNumber'].append(_get_tag(record, 'zm', int(record.query_name.split('/')[1])))
+        columns['readQual'].append(_get_tag(record, 'rq', 0.0))
+        columns['ctxtFlag'].append(_get_tag(record, 'cx', 0))
+        columns['fileOffset'].append(file_offset)
+    inf.close()
+
+    nreads = len(columns['fileOffset'])
+    data = [PBI_MAGIC, struct.pack('<IHI', PBI_VERSION, 0, nreads), b'\0' * 18]
+    for field, code in (('rgId', 'i'), ('qStart', 'i'), ('qEnd', 'i'), ('holeNumber', 'i'),
+                        ('readQual', 'f'), ('ctxtFlag', 'B'), ('fileOffset', 'q')):
+        data.append(struct.pack('<%d%s' % (nreads, code), *columns[field]))
+
+    pbi_file = bam_file + '.pbi'
+    outf = pysam.BGZFile(pbi_file, 'wb')
+    outf.write(b''.join(data))
+    outf.close()
+    return pbi_file
@@ -4,16 +4,22 @@ Module to perform Partial Order Alignments
 """
 from __future__ import print_function
 
+import array
+import ctypes
 import os
 import re
 import subprocess
-import tempfile
 
 PO_DEBUG = False
 def debug(message):
     if PO_DEBUG:
         print('DEBUG:', message)
 
+# Use the in-process poa library (external/poaV2/libpoa.so) when it has been
+# built. Otherwise (or if this is set to False) every alignment runs the poa
+# command in a separate process
+USE_POA_LIBRARY = True
+
 
 def get_poa_command():
     """
@@ -24,41 +30,231 @@ def get_poa_command():
     return os.path.join(repo_root, 'external', 'poaV2', 'poa')
 
 
-def _align(input_files_command,
-           score_matrix_file,
-           po_out_file=None,
-           pir_out_file=None,
-           clustal_out_file=None,
-           do_global=False,
-           do_progressive=True):
+def get_poa_library_path():
+    """
+    Returns the location of the poa shared library (built by 'make')
+    """
+    repo_root = os.path.dirname(os.path.abspath(__file__))
+    return os.path.join(repo_root, 'external', 'poaV2', 'libpoa.so')
+
+
+class _POAGraph(ctypes.Structure):
+    """
+    Mirrors POAGraph_T in external/poaV2/poa_api.h
+    """
+    _fields_ = [('length',         ctypes.c_int),
+                ('nsource_seq',    ctypes.c_int),
+                ('letters',        ctypes.POINTER(ctypes.c_char)),
+                ('incoming_start', ctypes.POINTER(ctypes.c_int)),
+                ('incoming',       ctypes.POINTER(ctypes.c_int)),
+                ('source_start',   ctypes.POINTER(ctypes.c_int)),
+                ('sources',        ctypes.POINTER(ctypes.c_int)),
+                ('edge_weights',   ctypes.POINTER(ctypes.c_int))]
+
+
+_POA_LIBRARY = None
+def get_poa_library():
+    """
+    Returns the loaded poa shared library, or None if it is not available
+    (it is loaded only once per process)
+    """
+    global _POA_LIBRARY
+    if not USE_POA_LIBRARY:
+        return None
+    if _POA_LIBRARY is None:
+        library_path = get_poa_library_path()
+        if not os.path.exists(library_path):
+            debug('%s not found, falling back to the poa command' % library_path)
+            _POA_LIBRARY = False
+            return None
+        lib = ctypes.CDLL(library_path)
+        lib.poa_read_score_matrix.restype  = ctypes.c_void_p
+        lib.poa_read_score_matrix.argtypes = [ctypes.c_char_p]
+        lib.poa_align_sequences.restype  = ctypes.POINTER(_POAGraph)
+        lib.poa_align_sequences.argtypes = [ctypes.c_int,
+                                            ctypes.POINTER(ctypes.c_char_p),
+                                            ctypes.c_void_p,
+                                            ctypes.c_int,
+                                            ctypes.c_int,
+                                            ctypes.c_int,
+                                            ctypes.c_int]
+        lib.poa_read_po_file.restype     = ctypes.POINTER(_POAGraph)
+        lib.poa_read_po_file.argtypes    = [ctypes.c_char_p]
+        lib.poa_pairwise_score.restype   = ctypes.c_int
+        lib.poa_pairwise_score.argtypes  = [ctypes.c_char_p,
+                                            ctypes.c_char_p,
+                                            ctypes.c_void_p,
+                                            ctypes.c_int,
+                                            ctypes.POINTER(ctypes.c_int)]
+        lib.poa_pairwise_scores.restype  = ctypes.c_int
+        lib.poa_pairwise_scores.argtypes = [ctypes.c_int,
+                                            ctypes.POINTER(ctypes.c_char_p),
+                                            ctypes.c_int,
+                                            ctypes.POINTER(ctypes.c_int),
+                                            ctypes.POINTER(ctypes.c_int),
+                                            ctypes.c_void_p,
+                                            ctypes.c_int,
+                                            ctypes.c_int,
+                                            ctypes.c_int,
+                                            ctypes.POINTER(ctypes.c_int)]
+        lib.poa_simd_supported.restype   = ctypes.c_int
+        lib.poa_simd_supported.argtypes  = []
+        lib.poa_score_dag.restype        = None
+        lib.poa_score_dag.argtypes       = [ctypes.c_int] + \
+                                           [ctypes.POINTER(ctypes.c_int)] * 4 + \
+                                           [ctypes.c_int] + \
+                                           [ctypes.POINTER(ctypes.c_int)] * 2
+        lib.poa_new_aligner.restype      = ctypes.c_void_p
+        lib.poa_new_aligner.argtypes     = [ctypes.c_void_p] + [ctypes.c_int] * 3
+        lib.poa_add_sequence.restype     = ctypes.c_int
+        lib.poa_add_sequence.argtypes    = [ctypes.c_void_p, ctypes.c_char_p]
+        lib.poa_aligner_graph.restype    = ctypes.POINTER(_POAGraph)
+        lib.poa_aligner_graph.argtypes   = [ctypes.c_void_p]
+        lib.poa_free_aligner.restype     = None
+        lib.poa_free_aligner.argtypes    = [ctypes.c_void_p]
+        lib.poa_take_dp_peak_bytes.restype  = ctypes.c_long
+        lib.poa_take_dp_peak_bytes.argtypes = []
+        lib.poa_free_graph.restype       = None
+        lib.poa_free_graph.argtypes      = [ctypes.POINTER(_POAGraph)]
+        _POA_LIBRARY = lib
+    return _POA_LIBRARY or None
+
+
+def resolve_score_matrix_file(score_matrix_file):
+    """
+    Returns the absolute path of a score matrix file, so that the poa command
+    finds it whatever its working directory is
+    """
+    path = os.path.abspath(score_matrix_file)
+    if not os.path.isfile(path):
+        raise ValueError("Score matrix file not found: %s" % score_matrix_file)
+    return path
+
+
+_SCORE_MATRICES = {}
+def get_score_matrix(score_matrix_file):
+    """
+    Returns the score matrix parsed by the poa library (an opaque handle), or
+    None if the library is not available
+
+    Each matrix file is parsed only once per process and then shared by all
+    the alignments. Worker processes forked after this has been called inherit
+    the parsed matrix. It is never modified, so it is never freed either
+    """
+    lib = get_poa_library()
+    if lib is None:
+        return None
+    path = os.path.abspath(score_matrix_file)
+    if path not in _SCORE_MATRICES:
+        matrix = lib.poa_read_score_matrix(_to_c_string(path))
+        if not matrix:
+            raise ValueError("Could not read score matrix file %s" % score_matrix_file)
+        _SCORE_MATRICES[path] = matrix
+    return _SCORE_MATRICES[path]
+
+
+_SCORE_MATRIX_VALUES = {}
+def get_score_matrix_values(score_matrix_file):
     """
-    The common aligner used by other methods. Constructs a command and call's
-    the C POA program. 
+    Returns the substitution scores of a score matrix file, as a dict of dicts
+    (scores[a][b] is the score of aligning residue a to residue b). The gap
+    penalties and the comment lines are skipped
     """
-    poa_command  = get_poa_command()
-    poa_command += ' ' + input_files_command
-    poa_command += ' ' + score_matrix_file
+    path = os.path.abspath(score_matrix_file)
+    if path not in _SCORE_MATRIX_VALUES:
+        scores, columns = {}, None
+        with open(path) as f:
+            for line in f:
+                if not line.strip() or line.startswith('#') or '=' in line:
+                    continue
+                fields = line.split()
+                if columns is None:
+                    columns = fields
+                    continue
+                if len(fields) != len(columns) + 1:
+                    raise ValueError("Invalid score matrix row in %s: %s" % (score_matrix_file, line))
+                scores[fields[0]] = dict(zip(columns, map(int, fields[1:])))
+        _SCORE_MATRIX_VALUES[path] = scores
+    return _SCORE_MATRIX_VALUES[path]
+
+
+def _to_c_string(string):
+    if not isinstance(string, bytes):
+        string = string.encode('ascii')
+    return string
+
+
+def _to_c_ints(int_array):
+    """
+    Returns a ctypes view (no copy) of an array.array('i')
+    """
+    return (ctypes.c_int * len(int_array)).from_buffer(int_array)
+
+
+def _poa_command(input_args,
+                 score_matrix_file,
+                 po_out_file=None,
+                 pir_out_file=None,
+                 clustal_out_file=None,
+                 do_global=False,
+                 do_progressive=True,
+                 band_width=0,
+                 memory_cap_mb=0):
+    """
+    Constructs the argument list to run the C POA program with
+    """
+    poa_command  = [get_poa_command()] + input_args + [score_matrix_file]
 
     if po_out_file:
-        poa_command += ' -po ' + po_out_file
+        poa_command += ['-po', po_out_file]
     if pir_out_file:
-        poa_command += ' -pir ' + pir_out_file
+        poa_command += ['-pir', pir_out_file]
     if clustal_out_file:
-        poa_command += ' -clustal ' + clustal_out_file
+        poa_command += ['-clustal', clustal_out_file]
 
     if do_global:
-        poa_command += ' -do_global'
+        poa_command += ['-do_global']
     if do_progressive:
-        poa_command += ' -do_progressive'
+        poa_command += ['-do_progressive']
+    if band_width:
+        poa_command += ['-band_width', str(band_width)]
+    if memory_cap_mb:
+        poa_command += ['-max_dp_mb', str(memory_cap_mb)]
+
+    debug('Running "%s"' % ' '.join(poa_command))
+    return poa_command
+
+
+def _align(input_args,
+           score_matrix_file,
+           po_out_file=None,
+           pir_out_file=None,
+           clustal_out_file=None,
+           do_global=False,
+           do_progressive=True,
+           input_data=None):
+    """
+    The common aligner used by other methods. Calls the C POA program, feeding
+    it input_data (if any) through its stdin, and returns its output
+    """
+    poa_command = _poa_command(input_args, score_matrix_file, po_out_file,
+                               pir_out_file, clustal_out_file, do_global, do_progressive)
 
     debug('Triggering Partial Order Alignment...')
-    debug('Running "%s"' % poa_command)
+    process = subprocess.Popen(poa_command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                               stderr=subprocess.STDOUT, universal_newlines=True)
+    out, _ = process.communicate(input_data)
+    if process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, poa_command, out)
 
     # Return command output
-    out = subprocess.check_output(poa_command, stderr=subprocess.STDOUT, shell=True)
     return out
 
 
+def _to_fasta(sequences):
+    return ''.join('>Sequence_%s\n%s\n' % (i, sequence) for i, sequence in enumerate(sequences))
+
+
 def align_sequences_from_fasta_file(fasta_file,
                     score_matrix_file,
                     po_out_file=None,
@@ -69,8 +265,7 @@ def align_sequences_from_fasta_file(fasta_file,
     """
     Align a set of sequences present in a fasta file into a po_msa
     """
-    input_files_command = '-read_fasta ' + fasta_file
-    return _align(input_files_command, score_matrix_file, po_out_file, 
+    return _align(['-read_fasta', fasta_file], score_matrix_file, po_out_file,
             pir_out_file, clustal_out_file, do_global, do_progressive)
 
 
@@ -83,21 +278,12 @@ def align_sequences(sequences,
                     do_progressive=True):
     """
     Align a list of sequence strings into a po_msa
-    """
-    temp_fasta_file = tempfile.NamedTemporaryFile(delete=False)
 
-    # Converting sequences to fasta format
-    for i, sequence in enumerate(sequences):
-        temp_fasta_file.write('>' + 'Sequence_%s' % i + '\n')
-        temp_fasta_file.write(sequence + '\n')
-    temp_fasta_file.close()
-
-    out = align_sequences_from_fasta_file(temp_fasta_file.name, score_matrix_file,
-                                    po_out_file, pir_out_file, clustal_out_file,
-                                    do_global, do_progressive)
-    os.unlink(temp_fasta_file.name)
-
-    return out
+    The sequences are piped into poa in fasta format, without a temporary file
+    """
+    return _align(['-read_fasta', '/dev/stdin'], score_matrix_file, po_out_file,
+            pir_out_file, clustal_out_file, do_global, do_progressive,
+            input_data=_to_fasta(sequences))
 
 
 def align_po_msas(po_msa_files,
@@ -109,20 +295,164 @@ def align_po_msas(po_msa_files,
                     do_progressive=True):
     """
     Align a list of po_msa files to a consensus po_msa
+
+    The list of files is piped into poa, without a temporary file
     """
-    temp_list_file = tempfile.NamedTemporaryFile(delete=False)
+    return _align(['-read_msa_list', '/dev/stdin'], score_matrix_file, po_out_file,
+            pir_out_file, clustal_out_file, do_global, do_progressive,
+            input_data=''.join(po_msa_file + '\n' for po_msa_file in po_msa_files))
 
-    for po_msa_file in po_msa_files:
-        temp_list_file.write(po_msa_file + '\n')
-    temp_list_file.close()
 
-    input_files_command = '-read_msa_list ' + temp_list_file.name
-    out = _align(input_files_command, score_matrix_file, po_out_file, 
-            pir_out_file, clustal_out_file, do_global, do_progressive)
+def _align_sequences_to_dag_with_command(sequences, score_matrix_file, do_global,
+                                         do_progressive, band_width, memory_cap_mb):
+    """
+    Runs poa on the sequences, with the po_msa written to its stdout, and
+    parses it into a DAG as it streams out of the pipe
+    """
+    poa_command = _poa_command(['-read_fasta', '/dev/stdin'], score_matrix_file,
+                               po_out_file='/dev/stdout', do_global=do_global,
+                               do_progressive=do_progressive, band_width=band_width,
+                               memory_cap_mb=memory_cap_mb)
+    process = subprocess.Popen(poa_command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE, universal_newlines=True)
+    # poa reads all of its input before it writes anything out
+    process.stdin.write(_to_fasta(sequences))
+    process.stdin.close()
+    dag = parse_po_msa(process.stdout)
+    err = process.stderr.read()
+    process.stdout.close()
+    process.stderr.close()
+    if process.wait():
+        raise subprocess.CalledProcessError(process.returncode, poa_command, err)
+    return dag
 
-    os.unlink(temp_list_file.name)
 
-    return out
+def align_sequences_to_dag(sequences,
+                           score_matrix_file,
+                           do_global=False,
+                           do_progressive=True,
+                           band_width=0,
+                           memory_cap_mb=0):
+    """
+    Align a list of sequence strings and return the po_msa as a Directed Acyclic
+    Graph (a PoaGraph, as convert_po_msa_to_dag)
+
+    If band_width > 0, each sequence is only aligned to the graph within a band
+    around the diagonal implied by their lengths (band_width bases, widened by
+    the graph's extra nodes). That takes memory linear in the sequence length
+    instead of length x graph size, but may misalign reads that aren't full
+    passes. Two partial orders aligned to each other (with do_progressive)
+    never are
+
+    If memory_cap_mb > 0, the dynamic programming matrices of each alignment of
+    a sequence are kept under memory_cap_mb MB where possible: when the
+    traceback moves don't fit, a first pass only keeps the scores of some
+    checkpoint rows, and the traceback recomputes the moves between two
+    checkpoints as it reaches them. The alignments are the same, at the cost
+    of up to twice the time. See take_dp_peak_mb for the memory taken
+
+    Uses the in-process poa library if available, so that no process is spawned
+    and no files are written. Otherwise runs poa through pipes
+    """
+    lib = get_poa_library()
+    if lib is None:
+        return _align_sequences_to_dag_with_command(sequences, score_matrix_file,
+                                                    do_global, do_progressive, band_width,
+                                                    memory_cap_mb)
+
+    c_sequences = (ctypes.c_char_p * len(sequences))(*[_to_c_string(s) for s in sequences])
+    graph_p = lib.poa_align_sequences(len(sequences), c_sequences,
+                                      get_score_matrix(score_matrix_file),
+                                      int(do_global), int(do_progressive), band_width,
+                                      memory_cap_mb)
+    if not graph_p:
+        raise ValueError("align_sequences_to_dag: poa failed (matrix file %s)" % score_matrix_file)
+    try:
+        dag = convert_poa_graph_to_dag(graph_p.contents)
+    finally:
+        lib.poa_free_graph(graph_p)
+
+    return dag
+
+
+class PoaAligner(object):
+    """
+    A partial order alignment that sequences are added to one at a time
+
+    After k sequences have been added, get_dag() gives the same DAG as
+    align_sequences_to_dag does for those k sequences with do_progressive=False.
+    With the poa library the graph is kept alive in-process and each addition
+    only aligns the new sequence to it. Without it, every get_dag() realigns
+    all the sequences from scratch. band_width and memory_cap_mb are as in
+    align_sequences_to_dag
+    """
+
+    def __init__(self, score_matrix_file, do_global=False, band_width=0, memory_cap_mb=0):
+        self.score_matrix_file = score_matrix_file
+        self.do_global         = do_global
+        self.band_width        = band_width
+        self.memory_cap_mb     = memory_cap_mb
+        self.sequences         = []
+        self._lib              = get_poa_library()
+        self._aligner          = None
+        if self._lib is not None:
+            self._aligner = self._lib.poa_new_aligner(get_score_matrix(score_matrix_file),
+                                                      int(do_global), band_width,
+                                                      memory_cap_mb)
+
+    def __len__(self):
+        return len(self.sequences)
+
+    def add_sequence(self, sequence):
+        """
+        Align one more sequence to the graph. Returns the no. of sequences in it
+        """
+        if self._lib is not None:
+            if not self._lib.poa_add_sequence(self._aligner, _to_c_string(sequence)):
+                raise ValueError("PoaAligner: poa failed to add sequence %s" % len(self.sequences))
+        self.sequences.append(sequence)
+        return len(self.sequences)
+
+    def get_dag(self):
+        """
+        Returns the graph of the sequences added so far as a PoaGraph
+        """
+        if not self.sequences:
+            raise ValueError("PoaAligner: no sequences added yet")
+        if self._lib is None:
+            return align_sequences_to_dag(self.sequences, self.score_matrix_file,
+                                          do_global=self.do_global, do_progressive=False,
+                                          band_width=self.band_width,
+                                          memory_cap_mb=self.memory_cap_mb)
+        graph_p = self._lib.poa_aligner_graph(self._aligner)
+        try:
+            dag = convert_poa_graph_to_dag(graph_p.contents)
+        finally:
+            self._lib.poa_free_graph(graph_p)
+        return dag
+
+    def close(self):
+        """
+        Frees the graph held by the poa library
+        """
+        if self._aligner is not None:
+            self._lib.poa_free_aligner(self._aligner)
+            self._aligner = None
+
+    def __del__(self):
+        self.close()
+
+
+def take_dp_peak_mb():
+    """
+    Returns the peak memory (in MB) that the dynamic programming matrices of
+    any alignment took in this process since the last call, and starts over.
+    None without the poa library, as the poa command's alignments can't be seen
+    """
+    lib = get_poa_library()
+    if lib is None:
+        return None
+    return lib.poa_take_dp_peak_bytes() / float(1 << 20)
 
 
 def get_best_score(sequences, score_matrix_file, do_global=False):
@@ -132,6 +462,16 @@ def get_best_score(sequences, score_matrix_file, do_global=False):
     if len(sequences) > 2:
         raise ValueError("get_best_score: Cannot get score for >2 sequences")
 
+    lib = get_poa_library()
+    if lib is not None:
+        score = ctypes.c_int()
+        if not lib.poa_pairwise_score(_to_c_string(sequences[0]),
+                                      _to_c_string(sequences[1]),
+                                      get_score_matrix(score_matrix_file),
+                                      int(do_global), ctypes.byref(score)):
+            raise ValueError("get_best_score: poa failed (matrix file %s)" % score_matrix_file)
+        return score.value
+
     out_data = align_sequences(sequences, score_matrix_file=score_matrix_file,
                                 do_global=do_global, do_progressive=False)
 
@@ -141,47 +481,233 @@ def get_best_score(sequences, score_matrix_file, do_global=False):
     return int(best_score)
 
 
+def simd_supported():
+    """
+    Whether get_pairwise_scores can use the SIMD (AVX2) kernel of the poa
+    library: the library is available and this CPU supports it
+    """
+    lib = get_poa_library()
+    return lib is not None and bool(lib.poa_simd_supported())
+
+
+def get_pairwise_scores(sequences, pairs, score_matrix_file, do_global=False,
+                        band_width=0, use_simd=True):
+    """
+    Get the best score for each (i, j) in pairs, aligning sequences[i] to
+    sequences[j], in one call. The scores are the same as get_best_score's.
+
+    With the poa library this runs a score-only dynamic programming with two
+    rows per pair. If band_width > 0, only the cells within band_width of the
+    diagonal are computed, which is faster but can give lower scores than the
+    full alignment (not used without the library). If use_simd and
+    simd_supported(), the full alignments fill a whole anti-diagonal of cells
+    at a time with AVX2 instructions, which gives the same scores faster
+    """
+    pairs = list(pairs)
+    if not pairs:
+        return []
+
+    lib = get_poa_library()
+    if lib is None:
+        return [get_best_score([sequences[i], sequences[j]], score_matrix_file,
+                               do_global=do_global)
+                for i, j in pairs]
+
+    c_sequences = (ctypes.c_char_p * len(sequences))(*[_to_c_string(s) for s in sequences])
+    pair_x = (ctypes.c_int * len(pairs))(*[i for i, j in pairs])
+    pair_y = (ctypes.c_int * len(pairs))(*[j for i, j in pairs])
+    scores = (ctypes.c_int * len(pairs))()
+    if not lib.poa_pairwise_scores(len(sequences), c_sequences,
+                                   len(pairs), pair_x, pair_y,
+                                   get_score_matrix(score_matrix_file),
+                                   int(do_global), int(band_width), int(use_simd),
+                                   scores):
+        raise ValueError("get_pairwise_scores: poa failed (matrix file %s)" % score_matrix_file)
+    return list(scores)
+
+
 # ==============================================================================
 
+try:
+    popcount = int.bit_count # Python >= 3.10
+except AttributeError:
+    def popcount(bits):
+        """
+        Returns the no. of bits set in bits
+        """
+        return bin(bits).count('1')
+
+
+class PoaGraph(object):
+    """
+    A po_msa as a Directed Acyclic Graph, stored in flat per-node columns
+    rather than as a dict per node. For node i (nodes are in the topological
+    order that poa writes them in):
+        characters[i]   the actual character at the node
+        incoming[incoming_start[i]:incoming_start[i+1]]
+                        ids of the nodes with an edge into it
+        sequences[i]    bitset (an int) of the ids of the sequences it contains
+    The edge weights (see get_edge_weights) are computed once, on first use.
+    The consensus module fills in score[i], previous[i] (back-pointer) and
+    outgoing[i] (no. of outgoing edges)
+    """
+    __slots__ = ('characters', 'incoming_start', 'incoming', 'sequences',
+                 'edge_weights', 'score', 'previous', 'outgoing')
+
+    def __init__(self, characters, incoming_start, incoming, sequences,
+                 edge_weights=None):
+        self.characters     = characters
+        self.incoming_start = array.array('i', incoming_start)
+        self.incoming       = array.array('i', incoming)
+        self.sequences      = sequences
+        self.edge_weights   = edge_weights
+        self.score          = [0] * len(characters)
+        self.previous       = [None] * len(characters)
+        self.outgoing       = [0] * len(characters)
+
+    def __len__(self):
+        return len(self.characters)
+
+    def get_incoming(self, i):
+        return self.incoming[self.incoming_start[i]:self.incoming_start[i+1]]
+
+    def num_incoming(self, i):
+        return self.incoming_start[i+1] - self.incoming_start[i]
+
+    def get_sequences(self, i):
+        seqs, bits, seq_id = set(), self.sequences[i], 0
+        while bits:
+            if bits & 1:
+                seqs.add(seq_id)
+            bits >>= 1
+            seq_id += 1
+        return seqs
+
+    def num_sequences(self, i):
+        return popcount(self.sequences[i])
+
+    def num_shared_sequences(self, i, j):
+        return popcount(self.sequences[i] & self.sequences[j])
+
+    def get_edge_weights(self):
+        """
+        Returns an array with the weight of each edge, i.e. the no. of sequences
+        shared by its two nodes, in the same order as incoming
+        """
+        if self.edge_weights is None:
+            seqs = self.sequences
+            self.edge_weights = array.array('i', [popcount(seqs[prev_node] & seqs[node])
+                                                  for prev_node, node in zip(self.incoming,
+                                                                             self.edge_targets())])
+        return self.edge_weights
+
+    def edge_targets(self):
+        """
+        Returns the node each edge goes into, in the same order as incoming
+        """
+        targets = array.array('i')
+        for i in range(len(self)):
+            targets.extend([i] * self.num_incoming(i))
+        return targets
+
+
 def convert_po_msa_to_dag(po_msa_file):
     """
-    Convert a po_msa_file to a Directed Acyclic Graph
+    Convert a po_msa_file to a Directed Acyclic Graph (a PoaGraph)
+
+    The file is read by the poa library if it is available (poa_read_po_file),
+    and by parse_po_msa otherwise
+    """
+    lib = get_poa_library()
+    if lib is not None:
+        graph_p = lib.poa_read_po_file(_to_c_string(po_msa_file))
+        if not graph_p:
+            raise ValueError("Could not read po_msa file %s" % po_msa_file)
+        try:
+            return convert_poa_graph_to_dag(graph_p.contents)
+        finally:
+            lib.poa_free_graph(graph_p)
 
-    The output is a list with each element being a dict containing keys:
-        index(vertex id),
-        incoming(list of incoming vertex ids)
-        sequences(list of sequence ids contained in this vertex)
-        charecter(the actual character here)
+    with open(po_msa_file, 'r') as f:
+        return parse_po_msa(f)
+
+
+def parse_po_msa(lines):
+    """
+    Parse the lines of a po_msa (e.g. a file or a pipe), one at a time, into a
+    Directed Acyclic Graph (a PoaGraph)
+
+    A node line (see write_lpo() in lpo_format.c) is the character of the node
+    and ':', followed by the ids of its incoming nodes (L<id>), of its source
+    sequences (S<id>) and optionally of the next node on its align ring
+    (A<id>), always in that order. The other lines are headers (NAME=...)
     """
-    dag = []
-    
-    f = open(po_msa_file, 'r')
-    i = 0
-    for line in f:
-        if '=' in line:
+    characters, incoming_start, sequences = [], [0], []
+    incoming = array.array('i')
+
+    for line in lines:
+        if line[1:2] != ':':
             continue
-        char, rest = line.split(':')
-        node_data = re.findall('([LS]\d+)', rest)
-        node = {'index': i,
-                'character': char,
-                'incoming': [],
-                'sequences': set(),
-                'previous': int,
-                'score': int,
-                'outgoing': int}
-        for data in node_data:
-            identifier, number = data[0], int(data[1:])
-            if identifier == 'L':
-                node['incoming'].append(number)
-            elif identifier == 'S':
-                node['sequences'].add(number)
-        dag.append(node)
-        i += 1
-
-    f.close()
-    
-    return dag
+        fields = line[2:].rstrip()
+        if 'A' in fields:
+            fields = fields[:fields.index('A')]
+        links_and_sources = fields.split('S')
+        if links_and_sources[0]:
+            incoming.extend([int(link) for link in links_and_sources[0][1:].split('L')])
+        seq_bits = 0
+        for source in links_and_sources[1:]:
+            seq_bits |= 1 << int(source)
+        characters.append(line[0])
+        sequences.append(seq_bits)
+        incoming_start.append(len(incoming))
+
+    return PoaGraph(''.join(characters), incoming_start, incoming, sequences)
+
+
+def convert_poa_graph_to_dag(graph):
+    """
+    Convert a graph returned by the in-process poa library to a Directed Acyclic
+    Graph (a PoaGraph, as convert_po_msa_to_dag)
+    """
+    letters = ctypes.string_at(graph.letters, graph.length)
+    if not isinstance(letters, str):
+        letters = letters.decode('ascii')
+    incoming_start = graph.incoming_start[:graph.length + 1]
+    incoming       = graph.incoming[:incoming_start[-1]]
+    source_start   = graph.source_start[:graph.length + 1]
+    sources        = graph.sources[:source_start[-1]]
+
+    sequences = []
+    for i in range(graph.length):
+        seq_bits = 0
+        for seq_id in sources[source_start[i]:source_start[i+1]]:
+            seq_bits |= 1 << seq_id
+        sequences.append(seq_bits)
 
+    # The library has worked out the edge weights already
+    edge_weights = array.array('i', graph.edge_weights[:incoming_start[-1]])
 
+    return PoaGraph(letters, incoming_start, incoming, sequences, edge_weights)
 
 
+def score_dag_with_library(dag, pb_like):
+    """
+    Does the single-sweep scoring of consensus.fused_score_assignment in the
+    poa library. Returns False (having done nothing) if it is not available
+    """
+    lib = get_poa_library()
+    if lib is None:
+        return False
+
+    length     = len(dag)
+    nsequences = array.array('i', [popcount(bits) for bits in dag.sequences]) if pb_like else None
+    score      = array.array('i', [0]) * length
+    previous   = array.array('i', [0]) * length
+    lib.poa_score_dag(length, _to_c_ints(dag.incoming_start), _to_c_ints(dag.incoming),
+                      _to_c_ints(dag.get_edge_weights()),
+                      _to_c_ints(nsequences) if pb_like else None,
+                      int(pb_like), _to_c_ints(score), _to_c_ints(previous))
+
+    dag.score    = score.tolist()
+    dag.previous = [prev_node if prev_node >= 0 else None for prev_node in previous]
+    return True
@@ -0,0 +1,122 @@
+#!/usr/local/bin/python
+"""
+Benchmarks the banded POA alignment (stonyccs.py --poa_band_width), and the
+full one with its memory capped (stonyccs.py --dp_memory_cap_mb), against the
+full one on simulated wells of growing read length: a random template read
+a number of times with PacBio-like errors. For each read length and mode it
+reports the alignment time, the peak memory it took and how close the
+consensus is to the template (its global alignment score against the template,
+relative to the template's own score)
+
+The full alignment (uncapped) is skipped beyond --max_full_length, as its
+memory grows with read length x graph size
+
+Run using benchmark_band.py <matrix_file> [options] (see --help)
+"""
+from __future__ import print_function
+
+import argparse
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from consensus import scoring_function, do_consensus
+from poaligner import align_sequences_to_dag, get_pairwise_scores
+
+
+def simulate_reads(length, passes, error_rate, seed):
+    """
+    Returns a random template of the given length and passes reads of it, each
+    with error_rate insertions, deletions and substitutions (in equal parts)
+    """
+    rand = random.Random(seed)
+    template = ''.join(rand.choice('ACGT') for _ in range(length))
+    reads = []
+    for _ in range(passes):
+        read = []
+        for base in template:
+            r = rand.random()
+            if r < error_rate / 3:
+                continue
+            elif r < 2 * error_rate / 3:
+                read.append(rand.choice('ACGT'))
+                read.append(base)
+            elif r < error_rate:
+                read.append(rand.choice('ACGT'))
+            else:
+                read.append(base)
+        reads.append(''.join(read))
+    return template, reads
+
+
+def _max_rss_mb():
+    # ru_maxrss is in kilobytes on Linux (bytes on macOS)
+    scale = 1024.0 * 1024 if sys.platform == 'darwin' else 1024.0
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+
+
+def align_and_score(args):
+    """
+    Runs in a fresh worker process, so that its peak memory is the alignment's.
+    Returns (time, peak memory increase in MB, consensus closeness)
+    """
+    template, reads, matrix_file, band_width, memory_cap_mb = args
+    base_rss = _max_rss_mb()
+    start = time.time()
+    dag = align_sequences_to_dag(reads, matrix_file, do_progressive=False, band_width=band_width,
+                                 memory_cap_mb=memory_cap_mb)
+    elapsed = time.time() - start
+    peak_mb = _max_rss_mb() - base_rss
+
+    scoring_function(dag, "edge_weight_based_score")
+    ccs = do_consensus(dag, "max_score")
+    score, ref_score = get_pairwise_scores([ccs, template], [(0, 1), (1, 1)], matrix_file,
+                                           do_global=True, band_width=len(template) // 10)
+    return elapsed, peak_mb, score / float(ref_score)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the banded POA alignment")
+    parser.add_argument("matrix_file", help="Score matrix file")
+    parser.add_argument("--band_width", type=int, default=200,
+        help="Band width to benchmark (default 200)")
+    parser.add_argument("--memory_cap_mb", type=int, default=64,
+        help="DP memory cap of the capped full alignment, 0 to skip it (default 64)")
+    parser.add_argument("--lengths", default="2000,5000,10000,20000,30000",
+        help="Comma separated read lengths (default 2000,5000,10000,20000,30000)")
+    parser.add_argument("--passes", type=int, default=6,
+        help="No. of reads per well (default 6)")
+    parser.add_argument("--error_rate", type=float, default=0.12,
+        help="Error rate of the reads (default 0.12)")
+    parser.add_argument("--max_full_length", type=int, default=10000,
+        help="Longest reads to do the full alignment for (default 10000)")
+    opts = parser.parse_args()
+    matrix_file = os.path.abspath(opts.matrix_file)
+
+    # (name, band width, memory cap)
+    modes = [("full", 0, 0), (str(opts.band_width), opts.band_width, 0)]
+    if opts.memory_cap_mb:
+        modes.append(("cap %s" % opts.memory_cap_mb, 0, opts.memory_cap_mb))
+
+    print("%7s %8s %10s %10s %10s" % ("length", "mode", "time (s)", "peak MB", "closeness"))
+    for length in [int(l) for l in opts.lengths.split(',')]:
+        template, reads = simulate_reads(length, opts.passes, opts.error_rate, seed=length)
+        for name, band_width, memory_cap_mb in modes:
+            if name == "full" and length > opts.max_full_length:
+                print("%7s %8s %10s" % (length, name, "skipped"))
+                continue
+            pool = multiprocessing.Pool(1)
+            try:
+                elapsed, peak_mb, closeness = pool.apply(align_and_score,
+                    ((template, reads, matrix_file, band_width, memory_cap_mb),))
+            finally:
+                pool.terminate()
+            print("%7s %8s %10.2f %10.1f %10.4f" % (length, name, elapsed, peak_mb, closeness))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+#!/usr/local/bin/python
+"""
+Compares the star_minhash ordering algo of stonyccs.py with star_forward_reverse
+on the wells of a bam file: the time each takes to order the reads, how often
+they choose the same center read, and how close their consensus sequences are.
+The closeness is the global alignment score of the star_minhash consensus (or
+its reverse complement, as the center's orientation decides the consensus')
+against the star_forward_reverse one, relative to the score of the latter
+against itself (1.0 when they are identical)
+
+Run using benchmark_ordering.py <bam_file> <matrix_file> [max_wells]
+(e.g. on sample_tests/sample_bam.bam, or on the full data bam file)
+"""
+from __future__ import print_function
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import pysam
+
+import stonyccs
+from   converter import reverse_complement
+from   poaligner import get_pairwise_scores
+
+ORDERING_ALGOS = ("star_forward_reverse", "star_minhash")
+
+
+def ordered_consensus(well_id, seqs, matrix_file, ordering_algo):
+    """
+    Returns (ordered sequences, ordering time, consensus) of a well
+    """
+    stonyccs.MY_ORDERING_ALGO = ordering_algo
+    start = time.time()
+    ordered = stonyccs.order_well(seqs, matrix_file)
+    elapsed = time.time() - start
+    ccs, _ = stonyccs.do_stonyccs(well_id, seqs, matrix_file)
+    return ordered, elapsed, ccs
+
+
+def main():
+    try:
+        bam_file, matrix_file = sys.argv[1], sys.argv[2]
+    except IndexError:
+        sys.exit("Run using benchmark_ordering.py <bam_file> <matrix_file> [max_wells]")
+    max_wells = int(sys.argv[3]) if len(sys.argv) > 3 else None
+
+    stonyccs.LOG_FH = open(os.devnull, 'w')
+    inf   = pysam.AlignmentFile(bam_file, 'rb', check_sq=False)
+    wells = stonyccs.filter_wells(stonyccs.read_wells(inf, {'reads': 0}))
+
+    times = dict((algo, 0.0) for algo in ORDERING_ALGOS)
+    nwells, same_center, same_ccs, closeness = 0, 0, 0, []
+    for well_id, seqs in wells:
+        results = dict((algo, ordered_consensus(well_id, seqs, matrix_file, algo))
+                       for algo in ORDERING_ALGOS)
+        for algo in ORDERING_ALGOS:
+            times[algo] += results[algo][1]
+        (ref_ordered, _, ref_ccs), (ordered, _, ccs) = [results[algo] for algo in ORDERING_ALGOS]
+        same_center += int(ordered[0] in (ref_ordered[0], reverse_complement(ref_ordered[0])))
+        same_ccs    += int(ccs in (ref_ccs, reverse_complement(ref_ccs)))
+        if ccs and ref_ccs:
+            score, rc_score, ref_score = get_pairwise_scores(
+                [ccs, reverse_complement(ccs), ref_ccs], [(0, 2), (1, 2), (2, 2)],
+                matrix_file, do_global=True)
+            closeness.append(max(score, rc_score) / float(ref_score))
+        nwells += 1
+        if max_wells and nwells >= max_wells:
+            break
+    inf.close()
+
+    print("%s wells" % nwells)
+    for algo in ORDERING_ALGOS:
+        print("  %-22s ordering %8.2f s  (x%.1f)" % (algo, times[algo],
+              times[ORDERING_ALGOS[0]] / max(times[algo], 1e-9)))
+    print("  same center: %s, same consensus: %s, mean consensus closeness: %.4f" % (
+          same_center, same_ccs, sum(closeness) / max(len(closeness), 1)))
+
+if __name__ == '__main__':
+    main()
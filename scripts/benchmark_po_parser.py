@@ -0,0 +1,117 @@
+#!/usr/local/bin/python
+"""
+Benchmarks the .po (po_msa) file parsers of poaligner.py on the wells of a bam
+file: the former regex based parser against the tokenizer (parse_po_msa) and
+the poa library's reader (poa_read_po_file, used by convert_po_msa_to_dag).
+The graphs of every parser are checked against the reference.
+The .po files are written by the poa command, as without the poa library.
+
+Run using benchmark_po_parser.py <bam_file> <matrix_file> [max_wells] [repeats]
+(e.g. on sample_tests/sample_bam.bam, or on the full data bam file)
+"""
+from __future__ import print_function
+
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import pysam
+
+import poaligner
+import stonyccs
+
+
+def regex_parser(po_msa_file):
+    """
+    The former parser of convert_po_msa_to_dag, as the reference
+    """
+    characters, incoming_start, incoming, sequences = [], [], [], []
+    with open(po_msa_file, 'r') as f:
+        for line in f:
+            if '=' in line:
+                continue
+            char, rest = line.split(':')
+            incoming_start.append(len(incoming))
+            seq_bits = 0
+            for data in re.findall('([LS]\d+)', rest):
+                identifier, number = data[0], int(data[1:])
+                if identifier == 'L':
+                    incoming.append(number)
+                elif identifier == 'S':
+                    seq_bits |= 1 << number
+            characters.append(char)
+            sequences.append(seq_bits)
+    incoming_start.append(len(incoming))
+    return poaligner.PoaGraph(''.join(characters), incoming_start, incoming, sequences)
+
+def tokenizer(po_msa_file):
+    with open(po_msa_file, 'r') as f:
+        return poaligner.parse_po_msa(f)
+
+def library(po_msa_file):
+    if poaligner.get_poa_library() is None:
+        raise ValueError("The poa library is not available (run 'make')")
+    return poaligner.convert_po_msa_to_dag(po_msa_file)
+
+PARSERS = [("regex", regex_parser),
+           ("tokenizer", tokenizer),
+           ("library", library)]
+
+
+def same_graph(dag, ref):
+    return (dag.characters == ref.characters and
+            list(dag.incoming_start) == list(ref.incoming_start) and
+            list(dag.incoming) == list(ref.incoming) and
+            list(dag.sequences) == list(ref.sequences) and
+            list(dag.get_edge_weights()) == list(ref.get_edge_weights()))
+
+
+def main():
+    try:
+        bam_file, matrix_file = sys.argv[1], sys.argv[2]
+    except IndexError:
+        sys.exit("Run using benchmark_po_parser.py <bam_file> <matrix_file> [max_wells] [repeats]")
+    max_wells = int(sys.argv[3]) if len(sys.argv) > 3 else None
+    repeats   = int(sys.argv[4]) if len(sys.argv) > 4 else 5
+
+    stonyccs.LOG_FH = open(os.devnull, 'w')
+    inf   = pysam.AlignmentFile(bam_file, 'rb', check_sq=False)
+    wells = stonyccs.filter_wells(stonyccs.read_wells(inf, {'reads': 0}))
+
+    po_dir   = tempfile.mkdtemp()
+    po_files = []
+    try:
+        for well_id, seqs in wells:
+            po_file = os.path.join(po_dir, '%s.po' % well_id)
+            poaligner.align_sequences(seqs, matrix_file, po_file)
+            po_files.append(po_file)
+            if max_wells and len(po_files) >= max_wells:
+                break
+        inf.close()
+        print("%s wells, %.1f MB of .po files" % (len(po_files),
+              sum(os.path.getsize(f) for f in po_files) / 1e6))
+
+        refs = [regex_parser(po_file) for po_file in po_files]
+        ref_time = None
+        for name, parser in PARSERS:
+            elapsed = 0.0
+            for po_file, ref in zip(po_files, refs):
+                start = time.time()
+                for _ in range(repeats):
+                    dag = parser(po_file)
+                elapsed += time.time() - start
+                if not same_graph(dag, ref):
+                    raise ValueError("%s gives a different graph for %s" % (name, po_file))
+            elapsed /= repeats
+            ref_time = ref_time or elapsed
+            print("  %-10s %8.2f ms  (x%.1f)" % (name, elapsed * 1000, ref_time / elapsed))
+    finally:
+        shutil.rmtree(po_dir)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+#!/usr/local/bin/python
+"""
+Benchmarks the graph scoring functions of consensus.py on the wells of a bam
+file: the multi-pass reference versions (score_assignment and
+pb_like_score_assignment) against the fused single sweep, in python and in the
+poa library. The consensus of every variant is checked against the reference.
+As in stonyccs, the graphs come from the poa library with their edge weights.
+
+Run using benchmark_scoring.py <bam_file> <matrix_file> [max_wells] [repeats]
+(e.g. on sample_tests/sample_bam.bam, or on the full data bam file)
+"""
+from __future__ import print_function
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import pysam
+
+import consensus
+import stonyccs
+from   poaligner import align_sequences_to_dag, score_dag_with_library
+
+
+def reference(dag, pb_like):
+    if pb_like:
+        consensus.pb_like_score_assignment(dag)
+    else:
+        consensus.score_assignment(dag)
+
+def fused_python(dag, pb_like):
+    consensus.fused_score_assignment(dag, pb_like)
+
+def fused_library(dag, pb_like):
+    if not score_dag_with_library(dag, pb_like):
+        raise ValueError("The poa library is not available (run 'make')")
+
+VARIANTS = [("multi-pass", reference),
+            ("fused python", fused_python),
+            ("fused library", fused_library)]
+
+
+def main():
+    try:
+        bam_file, matrix_file = sys.argv[1], sys.argv[2]
+    except IndexError:
+        sys.exit("Run using benchmark_scoring.py <bam_file> <matrix_file> [max_wells] [repeats]")
+    max_wells = int(sys.argv[3]) if len(sys.argv) > 3 else None
+    repeats   = int(sys.argv[4]) if len(sys.argv) > 4 else 5
+
+    stonyccs.LOG_FH = open(os.devnull, 'w')
+    inf   = pysam.AlignmentFile(bam_file, 'rb', check_sq=False)
+    wells = stonyccs.filter_wells(stonyccs.read_wells(inf, {'reads': 0}))
+
+    dags = []
+    for well_id, seqs in wells:
+        dags.append(align_sequences_to_dag(seqs, matrix_file))
+        if max_wells and len(dags) >= max_wells:
+            break
+    inf.close()
+    print("%s wells, %s nodes in all" % (len(dags), sum(len(dag) for dag in dags)))
+
+    for scoring_func in consensus.SCORING_FUNCTIONS:
+        pb_like = (scoring_func == "pb_like_score")
+        print("\n" + scoring_func)
+        ref_time = None
+        for name, variant in VARIANTS:
+            elapsed = 0.0
+            for dag in dags:
+                start = time.time()
+                for _ in range(repeats):
+                    variant(dag, pb_like)
+                elapsed += time.time() - start
+                ccs = consensus.do_consensus(dag, "max_score")
+                reference(dag, pb_like)
+                if ccs != consensus.do_consensus(dag, "max_score"):
+                    raise ValueError("%s gives a different consensus" % name)
+            elapsed /= repeats
+            ref_time = ref_time or elapsed
+            print("  %-14s %8.2f ms  (x%.1f)" % (name, elapsed * 1000, ref_time / elapsed))
+
+if __name__ == '__main__':
+    main()
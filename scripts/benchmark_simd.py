@@ -0,0 +1,62 @@
+#!/usr/local/bin/python
+"""
+Benchmarks the SIMD (AVX2) kernel of the STAR pairwise alignments (see
+stonyccs.py --star_simd) against the scalar one on the wells of a bam file: the
+time the pairwise scores of every well take with each, and the no. of scores
+that differ (there should be none, the scalar kernel is the reference)
+
+Run using benchmark_simd.py <bam_file> <matrix_file> [max_wells]
+(e.g. on sample_tests/sample_bam.bam, or on the full data bam file)
+"""
+from __future__ import print_function
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import pysam
+
+import stonyccs
+from   converter import reverse_complement
+from   poaligner import get_pairwise_scores, simd_supported
+
+
+def main():
+    try:
+        bam_file, matrix_file = sys.argv[1], sys.argv[2]
+    except IndexError:
+        sys.exit("Run using benchmark_simd.py <bam_file> <matrix_file> [max_wells]")
+    max_wells = int(sys.argv[3]) if len(sys.argv) > 3 else None
+    if not simd_supported():
+        sys.exit("The poa library is not available (run 'make') or this CPU does not support AVX2")
+
+    stonyccs.LOG_FH = open(os.devnull, 'w')
+    inf   = pysam.AlignmentFile(bam_file, 'rb', check_sq=False)
+    wells = stonyccs.filter_wells(stonyccs.read_wells(inf, {'reads': 0}))
+
+    nwells, npairs, ndiffer = 0, 0, 0
+    times = {False: 0.0, True: 0.0}
+    for well_id, seqs in wells:
+        # All the orientations of all the pairs, as the STAR ordering scores them
+        all_seqs = seqs + [reverse_complement(s) for s in seqs]
+        pairs    = [(i, j) for i in range(len(all_seqs)) for j in range(len(all_seqs)) if i != j]
+        scores   = {}
+        for use_simd in (False, True):
+            start = time.time()
+            scores[use_simd] = get_pairwise_scores(all_seqs, pairs, matrix_file, use_simd=use_simd)
+            times[use_simd] += time.time() - start
+        ndiffer += sum(1 for a, b in zip(scores[False], scores[True]) if a != b)
+        npairs  += len(pairs)
+        nwells  += 1
+        if max_wells and nwells >= max_wells:
+            break
+    inf.close()
+
+    print("%s wells, %s pairwise alignments, %s different scores" % (nwells, npairs, ndiffer))
+    print("  scalar %8.2f s" % times[False])
+    print("  avx2   %8.2f s  (x%.1f)" % (times[True], times[False] / max(times[True], 1e-9)))
+
+if __name__ == '__main__':
+    main()
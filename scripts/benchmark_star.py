@@ -0,0 +1,87 @@
+#!/usr/local/bin/python
+"""
+Benchmarks the reuse of the symmetric orientation scores by the STAR ordering
+(see stonyccs.py --star_symmetry) on the wells of a bam file. For each well
+size, it reports the no. of pairwise alignments run without and with the reuse,
+their run times and the no. of wells whose ordering is the same both ways
+
+Run using benchmark_star.py <bam_file> <matrix_file> [max_wells]
+(e.g. on sample_tests/sample_bam.bam, or on the full data bam file)
+"""
+from __future__ import print_function
+
+import collections
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import pysam
+
+import stonyccs
+
+
+def counting_pairwise_scores(counter, get_pairwise_scores):
+    def wrapper(sequences, pairs, *args, **kwargs):
+        counter[0] += len(pairs)
+        return get_pairwise_scores(sequences, pairs, *args, **kwargs)
+    return wrapper
+
+
+def run_star(seqs, matrix_file, symmetry):
+    """
+    Returns (ordered sequences, no. of pairwise alignments, run time) of the
+    STAR ordering of a well
+    """
+    stonyccs.STAR_SYMMETRY = symmetry
+    counter = [0]
+    get_pairwise_scores = stonyccs.get_pairwise_scores
+    stonyccs.get_pairwise_scores = counting_pairwise_scores(counter, get_pairwise_scores)
+    try:
+        start = time.time()
+        ordered = stonyccs.star_algorithm_ordering(seqs, matrix_file)
+        elapsed = time.time() - start
+    finally:
+        stonyccs.get_pairwise_scores = get_pairwise_scores
+    return ordered, counter[0], elapsed
+
+
+def main():
+    try:
+        bam_file, matrix_file = sys.argv[1], sys.argv[2]
+    except IndexError:
+        sys.exit("Run using benchmark_star.py <bam_file> <matrix_file> [max_wells]")
+    max_wells = int(sys.argv[3]) if len(sys.argv) > 3 else None
+
+    stonyccs.LOG_FH = open(os.devnull, 'w')
+    stonyccs.STAR_SYMMETRY = "auto"
+    print("%s: complement symmetric scores %s (--star_symmetry auto)" % (matrix_file,
+          "detected" if stonyccs.star_scores_symmetric(matrix_file) else "not detected"))
+
+    inf   = pysam.AlignmentFile(bam_file, 'rb', check_sq=False)
+    wells = stonyccs.filter_wells(stonyccs.read_wells(inf, {'reads': 0}))
+
+    # well size -> [wells, calls, symmetric calls, time, symmetric time, same orderings]
+    sizes = collections.defaultdict(lambda: [0, 0, 0, 0.0, 0.0, 0])
+    nwells = 0
+    for well_id, seqs in wells:
+        ordered, calls, elapsed = run_star(seqs, matrix_file, "never")
+        sym_ordered, sym_calls, sym_elapsed = run_star(seqs, matrix_file, "always")
+        for i, value in enumerate((1, calls, sym_calls, elapsed, sym_elapsed,
+                                   int(ordered == sym_ordered))):
+            sizes[len(seqs)][i] += value
+        nwells += 1
+        if max_wells and nwells >= max_wells:
+            break
+    inf.close()
+
+    print("%5s %6s %10s %10s %6s %9s %9s %6s" % ("reads", "wells", "calls", "sym calls",
+                                               "saved", "time (s)", "sym time", "same"))
+    for size in sorted(sizes):
+        count, calls, sym_calls, elapsed, sym_elapsed, same = sizes[size]
+        print("%5s %6s %10s %10s %5.0f%% %9.2f %9.2f %6s" % (size, count, calls, sym_calls,
+              100.0 * (calls - sym_calls) / calls, elapsed, sym_elapsed, same))
+
+if __name__ == '__main__':
+    main()
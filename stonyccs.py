@@ -5,16 +5,36 @@ Script to run generate consensus sequences given a set of input reads
 Do 'stonycss --help' for detailed information
 """
 
-from   consensus import (scoring_function, do_consensus,
+from   consensus import (scoring_function, do_consensus, IncrementalConsensus,
                          SCORING_FUNCTIONS, TRAVERSAL_ALGOS)
-from   converter import  reverse_complement
-from   poaligner import  align_sequences, convert_po_msa_to_dag, get_best_score
+from   converter import  complement, reverse_complement
+from   dagcache  import  DagCache, get_cache_key, get_file_digest
+from   minhash   import  minhash_sketch, sketch_similarity
+from   pbindex   import  get_pbi_file, get_indexed_wells, write_pbi_index
+from   poaligner import (align_sequences_to_dag, get_pairwise_scores,
+                         get_score_matrix, get_score_matrix_values,
+                         resolve_score_matrix_file, simd_supported, take_dp_peak_mb)
 
 import argparse
+import collections
+import hashlib
+import multiprocessing
+import multiprocessing.util
 import os
 import pysam
 import sys
-import tempfile
+import threading
+import time
+
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
 
 
 PROG_DESC = """
@@ -56,12 +76,47 @@ MEDIAN_DIFFER_ALLOWANCE = 5.0
 DO_FILTERING      = True
 ORDERING_ALGOS    = ["star_only_forward",
                      "star_forward_reverse",
+                     "star_minhash",
                      "no_star_iterative",
                      "no_star_progressive",
                      "no_star_alternate_reversed_progressive"]
 MY_ORDERING_ALGO  = "star_forward_reverse"
 MY_SCORING_FUNC   = "edge_weight_based_score"
 MY_TRAVERSAL_ALGO = "max_score"
+NUM_WORKERS       = 1
+WELLS_IN_FLIGHT   = 4 # Per worker. Bounds the no. of wells held in memory
+IO_THREADS        = 0 # Extra htslib threads for BGZF (de)compression. If set, the
+                      # wells are also read and filtered in a background thread
+STAR_BAND_WIDTH   = 0 # Band for the STAR pairwise alignments. 0 = full alignment
+STAR_SYMMETRY     = "never" # Reuse the fw/fw and fw/rv STAR scores for rv/rv and rv/fw:
+                            # "never", "auto" (when the scoring allows) or "always"
+STAR_SYMMETRY_MODES = ("never", "auto", "always")
+STAR_SIMD         = "auto" # Score the STAR pairwise alignments with the SIMD (AVX2) kernel:
+                           # "never", "auto" (when the CPU supports it) or "always"
+STAR_SIMD_MODES   = ("never", "auto", "always")
+POA_BAND_WIDTH    = 0 # Band for aligning the reads to the POA graph. 0 = full alignment
+DP_MEMORY_CAP_MB  = 0 # Cap on the DP matrices of each POA alignment (traded for
+                      # recomputing them in the traceback). 0 = no cap
+MAX_PASSES        = 0 # Max. no. of reads aligned per well (in ordering order). 0 = all
+CONVERGENCE_PASSES = 0 # Stop adding reads once the consensus hasn't changed for
+                       # this many additions. 0 = always add all of them
+ZMW_RANGE         = None # (first, last) hole numbers of the wells to do ccs for
+SHARD             = None # (i, N): only do ccs for wells with hole number % N == i-1
+ZMW_LIST          = None # Set of the hole numbers of the wells to do ccs for
+USE_PBI_INDEX     = True # Read only the wells that can qualify, using the input's
+                         # .pbi index to seek to them
+CACHE_FILE        = None # SQLite file to cache the aligned graphs of the wells in
+CACHE_MAX_MB      = 1024 # The least recently used graphs are evicted beyond this
+SWEEP_CONFIGS     = None # (scoring_func, traversal_algo) tuples to each make a
+                         # consensus with, from the same graph of each well
+
+# Knobs that worker processes need to see (they are handed over explicitly so
+# that the pool also works where processes are spawned rather than forked)
+WORKER_GLOBALS    = ("MY_ORDERING_ALGO", "MY_SCORING_FUNC", "MY_TRAVERSAL_ALGO",
+                     "DO_FILTERING", "STAR_BAND_WIDTH", "STAR_SYMMETRY", "STAR_SIMD",
+                     "POA_BAND_WIDTH", "DP_MEMORY_CAP_MB", "MAX_PASSES",
+                     "CONVERGENCE_PASSES", "CACHE_FILE", "CACHE_MAX_MB",
+                     "SWEEP_CONFIGS")
 
 
 # Logger
@@ -76,42 +131,50 @@ def enough_required_sequences(seqs):
 
 # ================================= Filters ====================================
 
-def do_adapter_filter(seqs_well):
-    out_seqs_well = []
-    for seq in seqs_well:
-        for tag in seq.tags:
-            if tag[0] == 'cx':
-                break
-        # 3 means both adapter_start and adapter_end are present
-        # http://pacbiofileformats.readthedocs.io/en/3.0/BAM.html
-        if int(tag[1]) == 3:
-            out_seqs_well.append(seq)
-    return out_seqs_well
+# The per-read filters, in the order they are applied. A rejected read is
+# counted against the first filter it fails
+READ_FILTERS = ("adapter", "read_quality", "snr", "length", "median")
 
-def do_read_quality_filter(seqs_well):
-    out_seqs_well = []
-    for seq in seqs_well:
-        for tag in seq.tags:
-            if tag[0] == 'rq':
-                break
-        if float(tag[1]) >= MIN_READ_QUALITY:
-            out_seqs_well.append(seq)
-    return out_seqs_well
+def new_rejection_counts():
+    return dict((read_filter, 0) for read_filter in READ_FILTERS + ("wells",))
+
+def get_tag(seq, tag, default=None):
+    try:
+        return seq.get_tag(tag)
+    except KeyError:
+        return default
 
-def do_snr_filter(seqs_well):
+def failed_read_filter(seq):
+    """
+    Applies the threshold filters to a read, reading each of its tags once.
+    Returns the first filter that the read fails, or None if it passes them all
+    """
+    # 3 means both adapter_start and adapter_end are present
+    # http://pacbiofileformats.readthedocs.io/en/3.0/BAM.html
+    if get_tag(seq, 'cx') != 3:
+        return "adapter"
+    if get_tag(seq, 'rq', 0.0) < MIN_READ_QUALITY:
+        return "read_quality"
+    if min(get_tag(seq, 'sn', [0.0])) < MIN_SNR:
+        return "snr"
+    if not MIN_READ_LENGTH <= len(seq.query) <= MAX_READ_LENGTH:
+        return "length"
+    return None
+
+def do_threshold_filters(seqs_well, rejected):
+    """
+    Adapter, read quality, SNR and length filters, in a single pass
+    """
     out_seqs_well = []
     for seq in seqs_well:
-        for tag in seq.tags:
-            if tag[0] == 'sn':
-                break
-        if all(float(v) >= MIN_SNR for v in tag[1]):
+        failed = failed_read_filter(seq)
+        if failed is None:
             out_seqs_well.append(seq)
+        else:
+            rejected[failed] += 1
     return out_seqs_well
 
-def do_length_filter(seqs_well):
-    return [s for s in seqs_well if MIN_READ_LENGTH <= len(s.query) <= MAX_READ_LENGTH]
-
-def do_median_filter(seqs_well):
+def do_median_filter(seqs_well, rejected):
     if len(seqs_well) == 0:
         return seqs_well
     seq_lengths = [len(seq.query) for seq in seqs_well]
@@ -120,11 +183,41 @@ def do_median_filter(seqs_well):
     for seq, seq_length in zip(seqs_well, seq_lengths):
         if (median / MEDIAN_DIFFER_ALLOWANCE) < seq_length < (median * MEDIAN_DIFFER_ALLOWANCE):
             out_seqs_well.append(seq)
+    rejected["median"] += len(seqs_well) - len(out_seqs_well)
     return out_seqs_well
 
 
 # ========================== Ordering Heuristics ===============================
 
+_SYMMETRIC_MATRICES = {}
+def star_scores_symmetric(score_matrix_file):
+    """
+    Returns True if the STAR ordering reuses the scores of the fw/fw and fw/rv
+    alignments of each pair of reads for the rv/rv and rv/fw ones (see
+    STAR_SYMMETRY). With "auto", that is when the score matrix scores
+    complemented bases the same (score(c(a), c(b)) = score(a, b) for ACGT) and
+    the alignments are not banded (the band isn't symmetric under reversal of
+    reads of different lengths)
+
+    Even then, the reused scores are close rather than exact: poa keeps only
+    the best gap of each cell, so reversed reads can align slightly differently
+    (as can swapped ones, which the ordering already treats as the same)
+    """
+    if STAR_SYMMETRY != "auto":
+        return STAR_SYMMETRY == "always"
+    if STAR_BAND_WIDTH:
+        return False
+    if score_matrix_file not in _SYMMETRIC_MATRICES:
+        scores = get_score_matrix_values(score_matrix_file)
+        try:
+            _SYMMETRIC_MATRICES[score_matrix_file] = all(
+                scores[a][b] == scores[complement(a)][complement(b)]
+                for a in "ACGT" for b in "ACGT")
+        except KeyError:
+            _SYMMETRIC_MATRICES[score_matrix_file] = False
+    return _SYMMETRIC_MATRICES[score_matrix_file]
+
+
 def star_algorithm_ordering(sequences, score_matrix_file, only_forward=False):
     """
     Order the sequences using the STAR alogirthm
@@ -142,36 +235,85 @@ def star_algorithm_ordering(sequences, score_matrix_file, only_forward=False):
     S_c, we will choose the maximum among the forward and reverse alignment scores
     with another strand S_i (Same will be done for all other strands)
     """
+    # The reverse complement of each read is computed once, and then used by
+    # all of its alignments and the final ordering
     seq_data = {i: {'fw': seq,
-                    'rv': reverse_complement(seq)} for i, seq in enumerate(sequences)}
+                    'rv': seq if only_forward else reverse_complement(seq)}
+                for i, seq in enumerate(sequences)}
+
+    # All the pairwise alignments of the well are scored in one batch. Indexes
+    # 0..n-1 of all_seqs are the forward strands and n..2n-1 the reverse ones
+    n = len(seq_data)
+    all_seqs = [seq_data[i]['fw'] for i in range(n)]
+    if not only_forward:
+        all_seqs += [seq_data[i]['rv'] for i in range(n)]
+    fw, rv = 'fw', 'rv'
+    offset = {fw: 0, rv: n}
+    # Reversing both strands of a pair gives the alignment of the other pair of
+    # orientations: score(rv_i, rv_j) ~ score(fw_i, fw_j) and score(rv_i, fw_j)
+    # ~ score(fw_i, rv_j) when the scoring is symmetric, so only half are run
+    symmetric = not only_forward and star_scores_symmetric(score_matrix_file)
+    if only_forward:
+        orientation_pairs = [(fw,fw)]
+    elif symmetric:
+        orientation_pairs = [(fw,fw), (fw,rv)]
+    else:
+        orientation_pairs = [(fw,fw), (rv,rv), (fw,rv), (rv,fw)]
+    pair_keys = [(i, j, o1, o2) for i in range(n) for j in range(i+1, n)
+                                for o1, o2 in orientation_pairs]
+    pair_scores = get_pairwise_scores(all_seqs,
+                                      [(i + offset[o1], j + offset[o2])
+                                       for i, j, o1, o2 in pair_keys],
+                                      score_matrix_file,
+                                      band_width=STAR_BAND_WIDTH,
+                                      use_simd=(STAR_SIMD != "never"))
 
-    neg_inf  = -float("inf")
+    # Assign scores
+    scores = {}
+    flip = {fw: rv, rv: fw}
+    for (i, j, o1, o2), score in zip(pair_keys, pair_scores):
+        scores.setdefault((i,j), {})[(o1,o2)] = score
+        scores.setdefault((j,i), {})[(o2,o1)] = score
+        if symmetric:
+            scores[(i,j)][(flip[o1],flip[o2])] = score
+            scores[(j,i)][(flip[o2],flip[o1])] = score
+
+    return star_order(seq_data, scores, only_forward)
+
+
+def star_minhash_ordering(sequences):
+    """
+    Order the sequences like the STAR algorithm with forward and reverse
+    orientations (see star_algorithm_ordering), but with the estimated k-mer
+    similarity of the MinHash sketches of each pair of strands as their score
+    instead of their alignment score. Sketching is linear in the read length,
+    so the center and the orientations are chosen without any alignment
+    """
+    seq_data = {i: {'fw': seq, 'rv': reverse_complement(seq)} for i, seq in enumerate(sequences)}
+    sketches = dict(((i, orntn), minhash_sketch(seq_data[i][orntn]))
+                    for i in seq_data for orntn in ('fw', 'rv'))
 
     scores = {}
-    fw, rv = 'fw', 'rv'
-    # Assign scores
-    for i in range(len(seq_data)):
-        for j in range(i+1, len(seq_data)):
-            i_fw_seq, j_fw_seq = seq_data[i]['fw'], seq_data[j]['fw']
-            scores.setdefault((i,j), {})
-            scores.setdefault((j,i), {})
-            # Only forward scores first
-            fw_fw_score = get_best_score([i_fw_seq, j_fw_seq], score_matrix_file)
-            scores[(i,j)][(fw,fw)] = fw_fw_score
-            scores[(j,i)][(fw,fw)] = fw_fw_score
-            if not only_forward:
-                i_rv_seq, j_rv_seq = seq_data[i]['rv'], seq_data[j]['rv']
-                # Reverse-reverse scores
-                rv_rv_score = get_best_score([i_rv_seq, j_rv_seq], score_matrix_file)
-                scores[(i,j)][(rv,rv)] = rv_rv_score
-                scores[(j,i)][(rv,rv)] = rv_rv_score
-                # Cross pairing
-                i_fw_j_rv_score = get_best_score([i_fw_seq, j_rv_seq], score_matrix_file)
-                i_rv_j_fw_score = get_best_score([i_rv_seq, j_fw_seq], score_matrix_file)
-                scores[(i,j)][(fw,rv)] = i_fw_j_rv_score
-                scores[(i,j)][(rv,fw)] = i_rv_j_fw_score
-                scores[(j,i)][(fw,rv)] = i_rv_j_fw_score
-                scores[(j,i)][(rv,fw)] = i_fw_j_rv_score
+    n = len(seq_data)
+    for i in range(n):
+        for j in range(i+1, n):
+            for o1, o2 in (('fw','fw'), ('rv','rv'), ('fw','rv'), ('rv','fw')):
+                score = sketch_similarity(sketches[(i,o1)], sketches[(j,o2)])
+                scores.setdefault((i,j), {})[(o1,o2)] = score
+                scores.setdefault((j,i), {})[(o2,o1)] = score
+
+    return star_order(seq_data, scores)
+
+
+def star_order(seq_data, scores, only_forward=False):
+    """
+    The STAR algorithm proper, given the strands of each sequence (seq_data[i]
+    has the 'fw' and 'rv' strands of sequence i) and the score of each pair of
+    strands (scores[(i,j)][(orntn_i,orntn_j)]). The strand with the best total
+    score against the other sequences is the center, and the other sequences
+    follow it, each in the orientation that scores best against it
+    """
+    neg_inf  = -float("inf")
 
     # Choose best
     best_scores = {}
@@ -204,77 +346,565 @@ def star_algorithm_ordering(sequences, score_matrix_file, only_forward=False):
 
 # ============================= Main Read Sanitizer ============================
 
-def process_and_filter_seqs(cur_seq_id, seqs_well, seq_data):
+def process_and_filter_seqs(seqs_well, rejected=None):
+    """
+    Filter a well of reads and return the sequences to do ccs on (or None if
+    the well is rejected). The rejected reads are counted per filter in
+    rejected (see new_rejection_counts), and a rejected well in rejected['wells']
+    """
+    if rejected is None:
+        rejected = new_rejection_counts()
+
     # Rejection checks - 
     # (We check this later on as well but we have a lot of single-read wells
     #  and we want to reject them early on for efficiency)
     if not enough_required_sequences(seqs_well):
-        return
+        rejected["wells"] += 1
+        return None
 
     # Save read order for later access if necessary
     read_order = {s.query: i for (i, s) in enumerate(seqs_well)}
 
     # Filters
-    # A lot of redundant looping here. Optimize?
     if DO_FILTERING:
-        seqs_well = do_adapter_filter(seqs_well)
-        seqs_well = do_read_quality_filter(seqs_well)
-        seqs_well = do_snr_filter(seqs_well)
-        seqs_well = do_length_filter(seqs_well)
-        seqs_well = do_median_filter(seqs_well)
+        seqs_well = do_threshold_filters(seqs_well, rejected)
+        seqs_well = do_median_filter(seqs_well, rejected)
 
     if not enough_required_sequences(seqs_well):
-        return
+        rejected["wells"] += 1
+        return None
 
-    log_info('Adding %s sequences with id %s for ccs (filtered?=%s)' % (len(seqs_well), cur_seq_id, DO_FILTERING))
-    # Good to add these sequences for this id to our seq_data for doing ccs
+    # Good to do ccs on these sequences
     sequences = [s.query for s in seqs_well]
-    seq_data[cur_seq_id] = {'sequences': sequences}
     if MY_ORDERING_ALGO == 'no_star_alternate_reversed_progressive':
         for i, seq in enumerate(sequences):
             # Reverse-complement every odd-numbered sequence
             real_index = read_order[seq]
             if real_index % 2 != 0:
-                seq_data[cur_seq_id]['sequences'][i] = reverse_complement(seq)
+                sequences[i] = reverse_complement(seq)
+
+    return sequences
+
+
+# ============================== Well Pipeline =================================
+
+def is_selected_well(well_id):
+    """
+    Returns True if the well is in this run's ZMW_RANGE, SHARD and ZMW_LIST
+    (if any)
+    """
+    if ZMW_RANGE and not (ZMW_RANGE[0] <= well_id <= ZMW_RANGE[1]):
+        return False
+    if SHARD and well_id % SHARD[1] != SHARD[0] - 1:
+        return False
+    if ZMW_LIST is not None and well_id not in ZMW_LIST:
+        return False
+    return True
+
+
+def read_indexed_wells(inf, stats, indexed_wells, pbi_file=None):
+    """
+    Generator that yields a (well_id, seqs_well) tuple for each well in
+    indexed_wells (see pbindex.get_indexed_wells), seeking straight to the
+    records of each well instead of reading the records in between
+
+    The wells with fewer than MIN_REQUIRED_SEQS reads are rejected anyway, so
+    they are yielded without any reads, and their records are never decoded.
+    The hole number of every decoded record is checked against its well, so
+    that an index (pbi_file) that does not match the input is caught instead
+    of mixing up the reads of the wells
+    """
+    next_offset = None
+    for well_id, file_offset, nreads, end_offset in indexed_wells:
+        stats['reads'] += nreads
+        if nreads < MIN_REQUIRED_SEQS:
+            yield well_id, []
+            continue
+        seqs_well = []
+        try:
+            if file_offset != next_offset:
+                inf.seek(file_offset)
+            for _ in range(nreads):
+                line = next(inf, None)
+                if line is None or int(line.qname.split('/')[1]) != well_id:
+                    found = "the end of the file" if line is None else "read " + line.qname
+                    break
+                seqs_well.append(line)
+        except (IOError, OSError) as e: # The offset is not a record's
+            found = "an unreadable record (%s)" % e
+        if len(seqs_well) < nreads:
+            raise ValueError("The index %s does not match the input: %s instead of a "
+                             "read of well %s. Rebuild the index, or use --no_pbi" %
+                             (pbi_file, found, well_id))
+        yield well_id, seqs_well
+        next_offset = end_offset
+
+
+def read_wells(inf, stats, indexed_wells=None, pbi_file=None):
+    """
+    Generator that reads a sorted-by-qname bam file and yields a
+    (well_id, seqs_well) tuple for each selected well (see is_selected_well),
+    one well at a time
+
+    If the wells are given from the .pbi index (pbi_file), see
+    read_indexed_wells.
+    Otherwise the reads of the other wells are skipped as soon as their hole
+    number has been parsed, and reading stops after the last well of
+    ZMW_RANGE. The total no. of reads read from the selected wells is kept
+    updated in stats['reads']
+    """
+    if indexed_wells is not None:
+        for well in read_indexed_wells(inf, stats, indexed_wells, pbi_file):
+            yield well
+        return
+
+    cur_seq_id = -1
+    seqs_well  = []
+    for line in inf.fetch(until_eof=True):
+        qname  = line.qname # Looks like "name/12345/23_34"
+        seq_id = int(qname.split('/')[1])
+        if ZMW_RANGE and seq_id > ZMW_RANGE[1]:
+            break # The bam is sorted, so no more wells in range
+        if not is_selected_well(seq_id):
+            continue
+        if stats['reads'] == 0:
+            cur_seq_id = seq_id
+        stats['reads'] += 1
+        if seq_id > cur_seq_id:
+            yield cur_seq_id, seqs_well
+            seqs_well  = []
+            cur_seq_id = seq_id
+        elif seq_id < cur_seq_id:
+            raise ValueError('This program expects a sorted .bam file')
+        seqs_well.append(line)
+    if seqs_well:
+        yield cur_seq_id, seqs_well
+
+
+def filter_wells(wells, rejected=None, well_info=None):
+    """
+    Generator that yields a (well_id, sequences) tuple for each well in wells
+    that survives process_and_filter_seqs (which counts the rejections in
+    rejected). If well_info is given, get_well_info is stored in it by well id
+    for each of those wells
+    """
+    for well_id, seqs_well in wells:
+        sequences = process_and_filter_seqs(seqs_well, rejected)
+        if sequences is not None:
+            if well_info is not None:
+                well_info[well_id] = get_well_info(seqs_well)
+            yield well_id, sequences
+
+
+def get_well_info(seqs_well):
+    """
+    Returns the (movie name, read group id, mean read quality) of the reads of
+    a well, for the consensus bam record
+    """
+    read_quals = [seq.get_tag('rq') for seq in seqs_well if seq.has_tag('rq')]
+    read_qual  = sum(read_quals) / len(read_quals) if read_quals else 0.0
+    rg_id      = seqs_well[0].get_tag('RG') if seqs_well[0].has_tag('RG') else None
+    return seqs_well[0].qname.split('/')[0], rg_id, read_qual
+
+
+def open_input(input_file):
+    if IO_THREADS:
+        return pysam.AlignmentFile(input_file, 'rb', check_sq=False, threads=IO_THREADS)
+    return pysam.AlignmentFile(input_file, 'rb', check_sq=False)
+
+
+def prefetch_wells(wells, max_wells):
+    """
+    Generator that yields the items of wells, which are produced in a
+    background thread up to max_wells ahead of the consumer. This overlaps
+    the reading (BGZF decompression and decoding) and filtering of the next
+    wells with the ccs of the current ones
+
+    The thread only starts on the first item (so after the worker processes,
+    if any, have been forked). Errors in it are raised in the consumer
+    """
+    done    = object()
+    items   = queue.Queue(max_wells)
+    stopped = threading.Event()
+
+    def producer():
+        try:
+            for item in wells:
+                while not stopped.is_set():
+                    try:
+                        items.put((item, None), timeout=0.1)
+                        break
+                    except queue.Full:
+                        pass
+                if stopped.is_set():
+                    return
+            items.put((done, None))
+        except Exception as e:
+            items.put((done, e))
+
+    thread = threading.Thread(target=producer)
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            item, error = items.get()
+            if error is not None:
+                raise error
+            if item is done:
+                break
+            yield item
+    finally:
+        stopped.set()
+        thread.join()
 
 
 # =============================== Main CCS =====================================
 
 def do_stonyccs(well_id, seqs, score_matrix_file):
-    po_msa_f = tempfile.NamedTemporaryFile(delete=False)
-    po_msa_f.close()
+    log_info('Adding %s sequences with id %s for ccs (filtered?=%s)' % (len(seqs), well_id, DO_FILTERING))
+
+    if CONVERGENCE_PASSES:
+        ordered_seqs = order_well(seqs, score_matrix_file)
+        log_info("Doing ccs for id %s" % well_id)
+        return converging_consensus(well_id, ordered_seqs, score_matrix_file)
+
+    if CACHE_FILE:
+        cache  = get_dag_cache()
+        key   = well_cache_key(seqs, score_matrix_file)
+        cached = cache.get(key)
+        if cached is not None:
+            log_info("Reusing the cached graph for id %s" % well_id)
+            dag, num_passes = cached
+        else:
+            dag, num_passes = align_well(well_id, seqs, score_matrix_file)
+            cache.put(key, dag, num_passes)
+    else:
+        dag, num_passes = align_well(well_id, seqs, score_matrix_file)
+
+    if SWEEP_CONFIGS:
+        return sweep_consensus(dag), num_passes
 
+    # convert to final CCS
+    # assignment of scoring function
+    scoring_function(dag, scoring_func=MY_SCORING_FUNC)
+    # generating consensus based on given traversal algorithm
+    ccs = do_consensus(dag, traversal_algo=MY_TRAVERSAL_ALGO)
+
+    return ccs, num_passes
+
+
+def sweep_consensus(dag):
+    """
+    Returns the consensus of dag for each (scoring_func, traversal_algo) in
+    SWEEP_CONFIGS, in the same order. The graph is scored once per scoring
+    function, and then traversed once per traversal algo
+    """
+    ccs = {}
+    for scoring_func, traversal_algo in SWEEP_CONFIGS:
+        if scoring_func not in ccs:
+            scoring_function(dag, scoring_func=scoring_func)
+            ccs[scoring_func] = dict((algo, do_consensus(dag, traversal_algo=algo))
+                                     for func, algo in SWEEP_CONFIGS if func == scoring_func)
+    return [ccs[scoring_func][traversal_algo] for scoring_func, traversal_algo in SWEEP_CONFIGS]
+
+
+def order_well(seqs, score_matrix_file):
+    """
+    Returns the sequences of a well in the order (and orientation) that they
+    are to be aligned in, as per MY_ORDERING_ALGO and MAX_PASSES
+    """
     if MY_ORDERING_ALGO == 'star_only_forward':
         ordered_seqs = star_algorithm_ordering(seqs, score_matrix_file, only_forward=True)
     elif MY_ORDERING_ALGO == 'star_forward_reverse':
         ordered_seqs = star_algorithm_ordering(seqs, score_matrix_file, only_forward=False)
+    elif MY_ORDERING_ALGO == 'star_minhash':
+        ordered_seqs = star_minhash_ordering(seqs)
     else:
         ordered_seqs = seqs
 
+    if MAX_PASSES:
+        ordered_seqs = ordered_seqs[:MAX_PASSES]
+    return ordered_seqs
+
+
+def align_well(well_id, seqs, score_matrix_file):
+    """
+    Order and align the sequences of a well. Returns the POA graph and the no.
+    of sequences that went into it
+    """
+    ordered_seqs = order_well(seqs, score_matrix_file)
+
     do_progressive = False
     if MY_ORDERING_ALGO in ('no_star_progressive', 'no_star_alternate_reversed_progressive'):
         do_progressive = True
 
     log_info("Doing ccs for id %s" % well_id)
-    align_sequences(ordered_seqs, score_matrix_file, po_msa_f.name, do_progressive=do_progressive)
-    dag = convert_po_msa_to_dag(po_msa_f.name)
-    os.unlink(po_msa_f.name)
+    take_dp_peak_mb()
+    dag = align_sequences_to_dag(ordered_seqs, score_matrix_file, do_progressive=do_progressive,
+                                 band_width=POA_BAND_WIDTH, memory_cap_mb=DP_MEMORY_CAP_MB)
+    log_dp_peak(well_id)
+    return dag, len(ordered_seqs)
 
-    # convert to final CCS
-    # assignment of scoring function
-    scoring_function(dag, scoring_func=MY_SCORING_FUNC)
-    # generating consensus based on given traversal algorithm
-    ccs = do_consensus(dag, traversal_algo=MY_TRAVERSAL_ALGO)
 
-    return ccs
+def log_dp_peak(well_id):
+    """
+    Logs the peak memory of the POA alignments of a well since the last call to
+    take_dp_peak_mb, when it is capped (and the poa library can tell)
+    """
+    if DP_MEMORY_CAP_MB:
+        peak_mb = take_dp_peak_mb()
+        if peak_mb is not None:
+            log_info("Peak alignment memory for id %s: %.1f MB" % (well_id, peak_mb))
+
+
+def converging_consensus(well_id, ordered_seqs, score_matrix_file):
+    """
+    Add the reads to the POA graph one at a time, in order, and stop as soon as
+    the consensus has not changed for CONVERGENCE_PASSES additions in a row
+
+    The reads are always fused in one by one (as without do_progressive).
+    Returns the consensus and the no. of reads that went into it
+    """
+    take_dp_peak_mb()
+    incremental = IncrementalConsensus(score_matrix_file, MY_SCORING_FUNC, MY_TRAVERSAL_ALGO,
+                                       band_width=POA_BAND_WIDTH, memory_cap_mb=DP_MEMORY_CAP_MB)
+    try:
+        ccs, unchanged = None, 0
+        for seq in ordered_seqs:
+            prev_ccs, ccs = ccs, incremental.add_sequence(seq)
+            unchanged = unchanged + 1 if ccs == prev_ccs else 0
+            if unchanged >= CONVERGENCE_PASSES:
+                break
+        num_passes = len(incremental)
+    finally:
+        incremental.close()
+    log_dp_peak(well_id)
+
+    if num_passes < len(ordered_seqs):
+        log_info("Consensus for id %s converged after %s of %s reads" % (well_id, num_passes, len(ordered_seqs)))
+    return ccs, num_passes
+
+
+# ================================ Graph Cache =================================
+
+_DAG_CACHE = None # This process' connection to CACHE_FILE
+_MATRIX_DIGESTS = {}
+
+def get_dag_cache():
+    global _DAG_CACHE
+    if _DAG_CACHE is None:
+        _DAG_CACHE = DagCache(CACHE_FILE, CACHE_MAX_MB * 1024 * 1024)
+    return _DAG_CACHE
+
+
+def well_cache_key(seqs, score_matrix_file):
+    """
+    Returns the cache key of the graph of a well: it depends on the filtered
+    sequences of the well, the contents of the score matrix file and all the
+    knobs that decide which sequences are aligned, in what order
+    """
+    if score_matrix_file not in _MATRIX_DIGESTS:
+        _MATRIX_DIGESTS[score_matrix_file] = get_file_digest(score_matrix_file)
+    return get_cache_key(seqs, _MATRIX_DIGESTS[score_matrix_file], MY_ORDERING_ALGO,
+                         STAR_BAND_WIDTH, star_scores_symmetric(score_matrix_file), POA_BAND_WIDTH,
+                         MAX_PASSES)
+
+
+def close_dag_cache():
+    global _DAG_CACHE
+    if _DAG_CACHE is not None:
+        _DAG_CACHE.close()
+        _DAG_CACHE = None
+
+
+# ============================== Parallel CCS ==================================
+
+def _init_worker(config):
+    """
+    Initializer for the worker processes. Sets up the knobs and a per-process
+    log buffer (the buffered log lines are handed back to the parent along with
+    the consensus so that they can be written out in well order). The graph
+    cache is closed as the worker exits, to write out its last cache hits
+    """
+    global LOG_FH
+    globals().update(config)
+    LOG_FH = StringIO()
+    multiprocessing.util.Finalize(None, close_dag_cache, exitpriority=10)
+
+
+def timed_stonyccs(well_id, seqs, score_matrix_file):
+    """
+    do_stonyccs, that also returns the time it took (in seconds)
+    """
+    start = time.time()
+    ccs, num_passes = do_stonyccs(well_id, seqs, score_matrix_file)
+    return ccs, num_passes, time.time() - start
+
+
+def _stonyccs_worker(task):
+    well_id, seqs, score_matrix_file = task
+    ccs, num_passes, runtime = timed_stonyccs(well_id, seqs, score_matrix_file)
+    logs = LOG_FH.getvalue()
+    LOG_FH.seek(0)
+    LOG_FH.truncate()
+    return well_id, ccs, num_passes, runtime, logs
+
+
+def stonyccs_wells(wells, score_matrix_file):
+    """
+    Do ccs for each (well_id, sequences) tuple in wells and yield
+    (well_id, sequences, ccs, no. of sequences aligned, runtime) tuples in the
+    same order
+
+    If NUM_WORKERS > 1, the wells are sent to a pool of worker processes. They
+    finish out of order but each one is held back until all the wells before it
+    are done, so that both the output and the logs stay in well order. At most
+    WELLS_IN_FLIGHT wells per worker are queued up at any time
+    """
+    if NUM_WORKERS <= 1:
+        for well_id, seqs in wells:
+            ccs, num_passes, runtime = timed_stonyccs(well_id, seqs, score_matrix_file)
+            yield well_id, seqs, ccs, num_passes, runtime
+        return
+
+    # Flush before forking, or the workers would write out our buffer again
+    LOG_FH.flush()
+    config = dict((name, globals()[name]) for name in WORKER_GLOBALS)
+    pool   = multiprocessing.Pool(NUM_WORKERS, _init_worker, (config,))
+    try:
+        in_flight = collections.deque()
+        for well_id, seqs in wells:
+            task = (well_id, seqs, score_matrix_file)
+            in_flight.append((seqs, pool.apply_async(_stonyccs_worker, (task,))))
+            while len(in_flight) >= NUM_WORKERS * WELLS_IN_FLIGHT:
+                yield _collect_well(in_flight)
+        while in_flight:
+            yield _collect_well(in_flight)
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+def _collect_well(in_flight):
+    seqs, result = in_flight.popleft()
+    well_id, ccs, num_passes, runtime, logs = result.get()
+    LOG_FH.write(logs)
+    return well_id, seqs, ccs, num_passes, runtime
+
+
+# ============================= Consensus Output ===============================
+
+def get_ccs_read_group_id(movie_name):
+    """
+    Returns the id of the ccs read group of a movie, as pacbio makes it
+    """
+    return hashlib.md5((movie_name + '//CCS').encode('ascii')).hexdigest()[:8]
+
+
+class ConsensusBamWriter(object):
+    """
+    Writes the consensus sequences as unaligned records of a pacbio ccs bam
+    file, named <movie>/<hole number>/ccs, with the tags
+        RG  the ccs read group of the movie
+        np  no. of reads (passes) that went into the consensus
+        zm  hole number
+        rq  estimated read quality. There is no quality model for the consensus,
+            so this is the mean read quality of the filtered reads of the well
+        zt  time taken to do ccs for the well (in seconds)
+    The read groups come from the input's, turned into ccs read groups
+    """
+    def __init__(self, bam_file, in_header, command):
+        header = in_header.to_dict() if hasattr(in_header, 'to_dict') else dict(in_header)
+        self.read_groups = {}
+        read_groups = []
+        for read_group in header.get('RG', []):
+            ccs_read_group = dict(read_group)
+            ccs_read_group['ID'] = get_ccs_read_group_id(read_group.get('PU', ''))
+            # Drop the subread kinetics codecs (like Ipd:CodecV1=ip) too
+            ccs_read_group['DS'] = ';'.join(['READTYPE=CCS'] +
+                                            [field for field in read_group.get('DS', '').split(';')
+                                             if field and not field.startswith('READTYPE=')
+                                                      and ':' not in field.split('=')[0]])
+            self.read_groups[read_group['ID']] = ccs_read_group['ID']
+            read_groups.append(ccs_read_group)
+        out_header = {'HD': {'VN': '1.5', 'SO': 'unknown', 'pb': '3.0.1'},
+                      'PG': [{'ID': 'stonyccs', 'PN': 'stonyccs', 'CL': command}]}
+        if read_groups:
+            out_header['RG'] = read_groups
+        if IO_THREADS:
+            self.outf = pysam.AlignmentFile(bam_file, 'wb', header=out_header, threads=IO_THREADS)
+        else:
+            self.outf = pysam.AlignmentFile(bam_file, 'wb', header=out_header)
+        self.name = bam_file
+
+    def write(self, well_id, ccs, num_passes, runtime, well_info):
+        movie_name, rg_id, read_qual = well_info
+        record = pysam.AlignedSegment()
+        record.query_name      = "{0}/{1}/ccs".format(movie_name, well_id)
+        record.flag            = 4
+        record.reference_id    = -1
+        record.reference_start = -1
+        record.mapping_quality = 255
+        record.query_sequence  = ccs
+        tags = [('np', num_passes, 'i'), ('rq', read_qual, 'f'), ('zm', well_id, 'i'),
+                ('zt', runtime, 'f')]
+        if rg_id in self.read_groups:
+            tags.insert(0, ('RG', self.read_groups[rg_id], 'Z'))
+        record.set_tags(tags)
+        self.outf.write(record)
+
+    def close(self):
+        """
+        Close the bam file and write its .pbi index
+        """
+        self.outf.close()
+        write_pbi_index(self.name)
 
 
 # ==============================================================================
 
+def parse_int_pair(value, separator, what):
+    try:
+        first, second = value.split(separator)
+        return int(first), int(second)
+    except ValueError:
+        raise ValueError("Invalid %s: %s" % (what, value))
+
+
+def parse_zmw_list(value):
+    if os.path.isfile(value):
+        with open(value) as f:
+            value = ",".join(f.read().split())
+    try:
+        return frozenset(int(hole) for hole in value.split(',') if hole.strip())
+    except ValueError:
+        raise ValueError("Invalid ZMW list: %s" % value)
+
+
+def parse_choices(value, choices, what):
+    """
+    Parse a comma separated list of some of the choices (all of them if value
+    is empty)
+    """
+    if not value:
+        return list(choices)
+    values = value.split(',')
+    for v in values:
+        if v not in choices:
+            raise ValueError("Invalid %s: %s" % (what, v))
+    return values
+
+
 def parse_opts():
     global MIN_REQUIRED_SEQS, MIN_READ_QUALITY, MIN_SNR, MIN_READ_LENGTH, \
            MEDIAN_DIFFER_ALLOWANCE, MAX_READ_LENGTH, LOG_FH, MY_ORDERING_ALGO, \
-           MY_SCORING_FUNC, MY_TRAVERSAL_ALGO, DO_FILTERING
+           MY_SCORING_FUNC, MY_TRAVERSAL_ALGO, DO_FILTERING, NUM_WORKERS, \
+           STAR_BAND_WIDTH, MAX_PASSES, CONVERGENCE_PASSES, ZMW_RANGE, SHARD, \
+           ZMW_LIST, USE_PBI_INDEX, CACHE_FILE, CACHE_MAX_MB, SWEEP_CONFIGS, \
+           IO_THREADS, STAR_SYMMETRY, STAR_SIMD, POA_BAND_WIDTH, DP_MEMORY_CAP_MB
 
     parser = argparse.ArgumentParser(description=PROG_DESC)
 
@@ -313,6 +943,93 @@ def parse_opts():
         help=("Graph traversal algorithm to use. Specify one in \n" + 
               "[" + ", ".join(TRAVERSAL_ALGOS) + "]\n"
               "(default %s)" % MY_TRAVERSAL_ALGO))
+    parser.add_argument("--sweep", action="store_true",
+        help="Align each well once and make a consensus with every combination "
+             "of the scoring functions and traversal algos given (as comma "
+             "separated lists) to --scoring_func and --traversal_algo, all of "
+             "them by default. The consensus of each combination goes to "
+             "<output_file_prefix>.<scoring_func>.<traversal_algo>.fa")
+
+    parser.add_argument("--workers", type=int,
+        help="No. of worker processes to do ccs with. Wells are processed in "
+             "parallel but the output stays in well order (default %s)" % NUM_WORKERS)
+
+    parser.add_argument("--io_threads", type=int,
+        help="No. of extra threads for htslib to decompress the input bam "
+             "with. If set, the next wells are also read and filtered in a "
+             "background thread while ccs is done on the current ones. "
+             "0 disables both (default %s)" % IO_THREADS)
+    parser.add_argument("--star_band_width", type=int,
+        help="Only score the STAR pairwise alignments within this many bases "
+             "of the diagonal. Faster, but the ordering may change. 0 does the "
+             "full alignments (default %s)" % STAR_BAND_WIDTH)
+    parser.add_argument("--poa_band_width", type=int,
+        help="Only align each read to the POA graph within this many bases of "
+             "the diagonal implied by their lengths. Faster, and the memory per "
+             "alignment becomes linear in the read length (so that long reads can "
+             "be let in with --max_read_length), but reads that are not full "
+             "passes may be misaligned. 0 does the full alignments "
+             "(default %s)" % POA_BAND_WIDTH)
+    parser.add_argument("--dp_memory_cap_mb", type=int,
+        help="Keep the dynamic programming matrices of each alignment of a read "
+             "to the POA graph under this many MB where possible: the traceback "
+             "then recomputes the parts it needs from checkpoints, which takes up "
+             "to twice the time but gives the same alignments. The peak memory "
+             "of each well is logged. 0 for no cap (default %s)" % DP_MEMORY_CAP_MB)
+    parser.add_argument("--star_symmetry", choices=STAR_SYMMETRY_MODES,
+        help="Whether the STAR ordering reuses the fw/fw and fw/rv scores of "
+             "each pair of reads for rv/rv and rv/fw, which halves its "
+             "alignments but may change the ordering. 'auto' only does when the "
+             "score matrix scores complemented bases the same and there is no "
+             "--star_band_width, 'always' does whatever the scoring "
+             "(default %s)" % STAR_SYMMETRY)
+    parser.add_argument("--star_simd", choices=STAR_SIMD_MODES,
+        help="Whether the STAR pairwise alignments are scored with the SIMD "
+             "(AVX2) kernel of the poa library, which gives the same scores "
+             "faster. 'auto' does when the CPU supports it, 'always' fails "
+             "when it does not, 'never' keeps to the scalar kernel (the "
+             "reference). Banded alignments (--star_band_width) are always "
+             "scalar (default %s)" % STAR_SIMD)
+
+    parser.add_argument("--max_passes", type=int,
+        help="Align at most this many reads of a well (the first ones in the "
+             "chosen ordering). 0 aligns all of them (default %s)" % MAX_PASSES)
+    parser.add_argument("--convergence_passes", type=int,
+        help="Add the reads of a well to the alignment one at a time and stop "
+             "once the consensus has not changed for this many reads in a row. "
+             "The reads are then always aligned iteratively, whatever the "
+             "ordering. 0 disables it (default %s)" % CONVERGENCE_PASSES)
+
+    parser.add_argument("--zmw_range", type=str,
+        help="Only do ccs for the wells with hole numbers in FIRST-LAST (inclusive)")
+    parser.add_argument("--shard", type=str,
+        help="Only do ccs for shard i of N (given as i/N, 1 <= i <= N), i.e. the "
+             "wells with hole number %% N == i-1. Run all N shards (e.g. on "
+             "different machines) and combine their outputs with stonymerge.py")
+    parser.add_argument("--zmw_list", type=str,
+        help="Only do ccs for the wells with these hole numbers, given as a "
+             "comma separated list or as a file with one hole number per line")
+    parser.add_argument("--no_pbi", action="store_true",
+        help="Don't use the input's PacBio index (<input_file>.pbi) to seek "
+             "straight to the wells selected by --zmw_range, --shard or "
+             "--zmw_list, skipping the wells with fewer than "
+             "--min_required_sequences reads. Every record of the input is "
+             "read instead")
+
+    parser.add_argument("--cache_file", type=str,
+        help="SQLite file to cache the aligned graph of every well in (created "
+             "if needed). A rerun over the same wells with the same matrix, "
+             "ordering algo, --star_band_width and --max_passes reuses the "
+             "cached graphs, so that only the scoring and traversal are redone. "
+             "Not used with --convergence_passes")
+    parser.add_argument("--cache_max_mb", type=int,
+        help="Max. size of the graphs in the cache file in MB. The least "
+             "recently used ones are evicted beyond it (default %s)" % CACHE_MAX_MB)
+
+    parser.add_argument("--bam_output", action="store_true",
+        help="Also write the consensus sequences to <output_file_prefix>.bam as a "
+             "pacbio ccs bam file (with the np, zm, rq and zt tags, see "
+             "ConsensusBamWriter) and index it (.bam.pbi)")
 
     parser.add_argument("--log_file", type=str,
         help="Log file to write logs to. Defaults to stonyccs_report.txt in cwd")
@@ -337,14 +1054,75 @@ def parse_opts():
         if opts.ordering_algo not in ORDERING_ALGOS:
             raise ValueError("Invalid ordering algo: " + opts.ordering_algo)
         MY_ORDERING_ALGO = opts.ordering_algo
-    if opts.scoring_func:
-        if opts.scoring_func not in SCORING_FUNCTIONS:
-            raise ValueError("Invalid scoring function: " + opts.scoring_func)
-        MY_SCORING_FUNC = opts.scoring_func
-    if opts.traversal_algo:
-        if opts.traversal_algo not in TRAVERSAL_ALGOS:
-            raise ValueError("Invalid traversal algo: " + opts.traversal_algo)
-        MY_TRAVERSAL_ALGO = opts.traversal_algo
+    if opts.sweep:
+        scoring_funcs   = parse_choices(opts.scoring_func, SCORING_FUNCTIONS, "scoring function")
+        traversal_algos = parse_choices(opts.traversal_algo, TRAVERSAL_ALGOS, "traversal algo")
+        SWEEP_CONFIGS   = [(scoring_func, traversal_algo) for scoring_func in scoring_funcs
+                                                          for traversal_algo in traversal_algos]
+        MY_SCORING_FUNC, MY_TRAVERSAL_ALGO = ",".join(scoring_funcs), ",".join(traversal_algos)
+    else:
+        if opts.scoring_func:
+            if opts.scoring_func not in SCORING_FUNCTIONS:
+                raise ValueError("Invalid scoring function: " + opts.scoring_func)
+            MY_SCORING_FUNC = opts.scoring_func
+        if opts.traversal_algo:
+            if opts.traversal_algo not in TRAVERSAL_ALGOS:
+                raise ValueError("Invalid traversal algo: " + opts.traversal_algo)
+            MY_TRAVERSAL_ALGO = opts.traversal_algo
+    if opts.workers is not None:
+        if opts.workers < 1:
+            raise ValueError("Invalid no. of workers: %s" % opts.workers)
+        NUM_WORKERS = opts.workers
+    if opts.io_threads is not None:
+        if opts.io_threads < 0:
+            raise ValueError("Invalid no. of io threads: %s" % opts.io_threads)
+        IO_THREADS = opts.io_threads
+    if opts.star_band_width is not None:
+        if opts.star_band_width < 0:
+            raise ValueError("Invalid STAR band width: %s" % opts.star_band_width)
+        STAR_BAND_WIDTH = opts.star_band_width
+    if opts.star_symmetry:
+        STAR_SYMMETRY = opts.star_symmetry
+    if opts.star_simd:
+        if opts.star_simd == "always" and not simd_supported():
+            raise ValueError("--star_simd always: the poa library is not available "
+                             "or this CPU does not support AVX2")
+        STAR_SIMD = opts.star_simd
+    if opts.poa_band_width is not None:
+        if opts.poa_band_width < 0:
+            raise ValueError("Invalid POA band width: %s" % opts.poa_band_width)
+        POA_BAND_WIDTH = opts.poa_band_width
+    if opts.dp_memory_cap_mb is not None:
+        if opts.dp_memory_cap_mb < 0:
+            raise ValueError("Invalid DP memory cap: %s" % opts.dp_memory_cap_mb)
+        DP_MEMORY_CAP_MB = opts.dp_memory_cap_mb
+    if opts.max_passes is not None:
+        if opts.max_passes < 0:
+            raise ValueError("Invalid max. no. of passes: %s" % opts.max_passes)
+        MAX_PASSES = opts.max_passes
+    if opts.convergence_passes is not None:
+        if opts.convergence_passes < 0:
+            raise ValueError("Invalid no. of convergence passes: %s" % opts.convergence_passes)
+        if opts.convergence_passes and opts.sweep:
+            raise ValueError("--convergence_passes can't be used with --sweep")
+        CONVERGENCE_PASSES = opts.convergence_passes
+    if opts.zmw_range:
+        ZMW_RANGE = parse_int_pair(opts.zmw_range, '-', "ZMW range")
+        if ZMW_RANGE[0] > ZMW_RANGE[1]:
+            raise ValueError("Invalid ZMW range: " + opts.zmw_range)
+    if opts.shard:
+        SHARD = parse_int_pair(opts.shard, '/', "shard")
+        if not 1 <= SHARD[0] <= SHARD[1]:
+            raise ValueError("Invalid shard: " + opts.shard)
+    if opts.zmw_list:
+        ZMW_LIST = parse_zmw_list(opts.zmw_list)
+    USE_PBI_INDEX = not(opts.no_pbi)
+    if opts.cache_file:
+        CACHE_FILE = opts.cache_file
+    if opts.cache_max_mb is not None:
+        if opts.cache_max_mb < 1:
+            raise ValueError("Invalid max. cache size: %s" % opts.cache_max_mb)
+        CACHE_MAX_MB = opts.cache_max_mb
 
     if not opts.log_file:
         opts.log_file = os.path.join(os.getcwd(), 'stonyccs_report.txt')
@@ -356,8 +1134,40 @@ def parse_opts():
               "--ordering_algo {0} ".format(MY_ORDERING_ALGO) + \
               "--scoring_func {0} ".format(MY_SCORING_FUNC) + \
               "--traversal_algo {0} ".format(MY_TRAVERSAL_ALGO)
+    if SWEEP_CONFIGS:
+        message += "--sweep "
     if not DO_FILTERING:
         message += "--disable_filters "
+    if NUM_WORKERS > 1:
+        message += "--workers {0} ".format(NUM_WORKERS)
+    if IO_THREADS:
+        message += "--io_threads {0} ".format(IO_THREADS)
+    if STAR_BAND_WIDTH:
+        message += "--star_band_width {0} ".format(STAR_BAND_WIDTH)
+    if STAR_SYMMETRY != "never":
+        message += "--star_symmetry {0} ".format(STAR_SYMMETRY)
+    if STAR_SIMD != "auto":
+        message += "--star_simd {0} ".format(STAR_SIMD)
+    if POA_BAND_WIDTH:
+        message += "--poa_band_width {0} ".format(POA_BAND_WIDTH)
+    if DP_MEMORY_CAP_MB:
+        message += "--dp_memory_cap_mb {0} ".format(DP_MEMORY_CAP_MB)
+    if MAX_PASSES:
+        message += "--max_passes {0} ".format(MAX_PASSES)
+    if CONVERGENCE_PASSES:
+        message += "--convergence_passes {0} ".format(CONVERGENCE_PASSES)
+    if ZMW_RANGE:
+        message += "--zmw_range {0}-{1} ".format(*ZMW_RANGE)
+    if SHARD:
+        message += "--shard {0}/{1} ".format(*SHARD)
+    if opts.zmw_list:
+        message += "--zmw_list {0} ".format(opts.zmw_list)
+    if not USE_PBI_INDEX:
+        message += "--no_pbi "
+    if opts.bam_output:
+        message += "--bam_output "
+    if CACHE_FILE:
+        message += "--cache_file {0} --cache_max_mb {1} ".format(CACHE_FILE, CACHE_MAX_MB)
     log_info(message)
 
     return opts
@@ -368,58 +1178,91 @@ def main():
 
     print("All logs go to %s..." % LOG_FH.name)
 
-    inf = pysam.AlignmentFile(opts.input_file, 'rb', check_sq=False)
-    
-    seq_data = {}
+    inf = open_input(opts.input_file)
 
-    # Step 1: Read all sequences and choose the relevant ones to do ccs for
-    cur_seq_id = -1
-    seqs_well = []
-    # Start reading
-    for i, line in enumerate(inf.fetch(until_eof=True)):
-        qname  = line.qname # Looks like "name/12345/23_34"
-        seq_id = int(qname.split('/')[1])
-        if i == 0:
-            cur_seq_id = seq_id
-        if seq_id > cur_seq_id:
-            # Process previous sequences
-            process_and_filter_seqs(cur_seq_id, seqs_well, seq_data)
-            seqs_well = []
-            cur_seq_id = seq_id
-        elif seq_id < cur_seq_id:
-            raise ValueError('This program expects a sorted .bam file')
-        seqs_well.append(line)
-    process_and_filter_seqs(cur_seq_id, seqs_well, seq_data)
-    total_seqs_read = i + 1
-    
-    print("\nRead %s sequences\n" % total_seqs_read)
-    print("Doing ccs for %s wells...\n" % len(seq_data))
+    # Parse the score matrix once up front (the workers inherit it)
+    score_matrix_file = resolve_score_matrix_file(opts.matrix_file)
+    get_score_matrix(score_matrix_file)
 
-    # Step 2: Do ccs for chosen wells
     log_info("Configuration for ccs - "
              "Ordering_algo: {0}, Scoring_function: {1}, Traversal_algo: {2}, "
              "Doing Filtering?: {3}".format(MY_ORDERING_ALGO, MY_SCORING_FUNC,
                                             MY_TRAVERSAL_ALGO, DO_FILTERING))
-    ccs_seqs = {}
-    seqs_used_for_ccs = 0
-    for well_id in sorted(seq_data):
-        seqs_used_for_ccs += len(seq_data[well_id]['sequences']) 
-        ccs_seq = do_stonyccs(well_id, seq_data[well_id]['sequences'], opts.matrix_file)
-        ccs_seqs[well_id] = ccs_seq
-
-    # Step 3: Write output to fasta file 
-    if seqs_used_for_ccs > 0:
-        fastaf = open(opts.output_file_prefix + '.fa', 'w')
-        for well_id in sorted(ccs_seqs):
+
+    # The wells are streamed through the pipeline one at a time:
+    # Step 1: Read the sequences of a well and choose the relevant ones
+    # Step 2: Do ccs for the chosen wells
+    # Step 3: Write output to fasta file as soon as a consensus is ready
+    indexed_wells = None
+    pbi_file      = get_pbi_file(opts.input_file)
+    if USE_PBI_INDEX and pbi_file:
+        indexed_wells = get_indexed_wells(pbi_file, is_selected_well)
+        log_info("Using index {0}: reading {1} of the {2} selected wells (the rest have "
+                 "fewer than {3} reads)".format(pbi_file,
+                    sum(1 for well in indexed_wells if well[2] >= MIN_REQUIRED_SEQS),
+                    len(indexed_wells), MIN_REQUIRED_SEQS))
+
+    stats    = {'reads': 0}
+    rejected = new_rejection_counts()
+    well_info = {} if opts.bam_output else None
+    wells    = filter_wells(read_wells(inf, stats, indexed_wells, pbi_file), rejected,
+                            well_info)
+    if IO_THREADS:
+        wells = prefetch_wells(wells, NUM_WORKERS * WELLS_IN_FLIGHT)
+    if SWEEP_CONFIGS:
+        fasta_names = ["{0}.{1}.{2}.fa".format(opts.output_file_prefix, scoring_func, traversal_algo)
+                       for scoring_func, traversal_algo in SWEEP_CONFIGS]
+    else:
+        fasta_names = [opts.output_file_prefix + '.fa']
+    fastafs  = None
+    bamfs    = None
+    seqs_used_for_ccs, wells_used_for_ccs = 0, 0
+    seqs_skipped, wells_with_skipped_seqs = 0, 0
+    for well_id, seqs, ccs_seq, num_passes, runtime in stonyccs_wells(wells, score_matrix_file):
+        if fastafs is None:
+            fastafs = [open(fasta_name, 'w') for fasta_name in fasta_names]
+            if opts.bam_output:
+                bamfs = [ConsensusBamWriter(fasta_name[:-len('.fa')] + '.bam', inf.header,
+                                            ' '.join(sys.argv))
+                         for fasta_name in fasta_names]
+        for fastaf, ccs in zip(fastafs, ccs_seq if SWEEP_CONFIGS else [ccs_seq]):
             fastaf.write('>' + str(well_id) + '/stonyccs\n')
-            fastaf.write(ccs_seqs[well_id] + '\n')
+            fastaf.write(ccs + '\n')
+            fastaf.flush()
+        if bamfs is not None:
+            info = well_info.pop(well_id)
+            for bamf, ccs in zip(bamfs, ccs_seq if SWEEP_CONFIGS else [ccs_seq]):
+                bamf.write(well_id, ccs, num_passes, runtime, info)
+        seqs_used_for_ccs  += num_passes
+        wells_used_for_ccs += 1
+        if num_passes < len(seqs):
+            seqs_skipped            += len(seqs) - num_passes
+            wells_with_skipped_seqs += 1
+    inf.close()
+    close_dag_cache()
+
+    total_seqs_read = stats['reads']
+    print("\nRead %s sequences, did ccs for %s wells\n" % (total_seqs_read, wells_used_for_ccs))
+
+    for fastaf in fastafs or []:
         fastaf.close()
         log_info("Generated consensus file - %s" % fastaf.name)
+    for bamf in bamfs or []:
+        bamf.close()
+        log_info("Generated consensus file - %s" % bamf.name)
 
     log_info("Read total {0} reads from input file, did ccs on total {1} reads "
              "({2} separate wells). Used {3:.2f} % of the input reads".format(
-                total_seqs_read, seqs_used_for_ccs, len(seq_data),
-                (seqs_used_for_ccs / float(total_seqs_read))*100.0))
+                total_seqs_read, seqs_used_for_ccs, wells_used_for_ccs,
+                (seqs_used_for_ccs / float(total_seqs_read))*100.0 if total_seqs_read else 0.0))
+    log_info("Rejected reads - {0}. Rejected {1} wells with too few reads".format(
+                ", ".join("{0}: {1}".format(read_filter, rejected[read_filter])
+                          for read_filter in READ_FILTERS), rejected["wells"]))
+    if MAX_PASSES or CONVERGENCE_PASSES:
+        message = ("Early termination skipped {0} filtered reads in {1} of the "
+                   "{2} wells".format(seqs_skipped, wells_with_skipped_seqs, wells_used_for_ccs))
+        print(message)
+        log_info(message)
 
     # Close the log file
     LOG_FH.close()
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+"""
+Script to merge the outputs of sharded stonyccs runs (see 'stonyccs.py --shard'
+and '--zmw_range') into a single consensus file and report, both in well order
+
+Do 'stonymerge.py --help' for detailed information
+"""
+from __future__ import print_function
+
+import argparse
+import heapq
+import os
+import re
+
+
+PROG_DESC = """
+Merges the consensus (.fa) files and the log files of stonyccs runs on different
+shards of the same input into one consensus file <output_file_prefix>.fa and one
+log file. The wells are written in well (hole number) order whatever the order
+of the shards, and the read/well totals of the shards are added up.
+"""
+
+WELL_LINE_RE    = re.compile(r' id (\d+)\b')
+TOTALS_LINE_RE  = re.compile(r'Read total (\d+) reads from input file, did ccs on total '
+                             r'(\d+) reads \((\d+) separate wells\)')
+REJECTED_LINE_RE = re.compile(r'Rejected reads - (.*)\. Rejected (\d+) wells with too few reads')
+SKIPPED_LINE_RE = re.compile(r'Early termination skipped (\d+) filtered reads in (\d+) of the '
+                             r'(\d+) wells')
+
+
+# ================================ FASTA files =================================
+
+def read_fasta_records(fasta_file):
+    """
+    Generator that yields a (well_id, record) tuple for each record of a
+    stonyccs consensus file, where record is the full text of the record
+    """
+    record = None
+    with open(fasta_file) as f:
+        for line in f:
+            if line.startswith('>'):
+                if record:
+                    yield int(record[1:].split('/')[0]), record
+                record = line
+            elif record is not None:
+                record += line
+    if record:
+        yield int(record[1:].split('/')[0]), record
+
+
+def merge_fasta_files(fasta_files, out_file):
+    """
+    Merge the (each already in well order) consensus files into out_file in
+    well order. Returns the no. of wells written
+    """
+    nwells, last_well_id = 0, None
+    with open(out_file, 'w') as outf:
+        for well_id, record in heapq.merge(*[read_fasta_records(f) for f in fasta_files]):
+            if well_id == last_well_id:
+                raise ValueError("Well %s is in more than one shard" % well_id)
+            outf.write(record)
+            last_well_id = well_id
+            nwells += 1
+    return nwells
+
+
+# ================================= Log files ==================================
+
+def read_log_file(log_file, shard_index):
+    """
+    Split a stonyccs log file into its header lines, its per-well lines (as
+    (well_id, shard_index, line_no, line) tuples) and the totals it reports
+    """
+    header, well_lines = [], []
+    totals = {'reads': 0, 'used': 0, 'wells': 0}
+    skipped, rejected = None, None
+    with open(log_file) as f:
+        for line_no, line in enumerate(f):
+            totals_match   = TOTALS_LINE_RE.search(line)
+            rejected_match = REJECTED_LINE_RE.search(line)
+            skipped_match  = SKIPPED_LINE_RE.search(line)
+            well_match     = WELL_LINE_RE.search(line)
+            if totals_match:
+                totals['reads'], totals['used'], totals['wells'] = map(int, totals_match.groups())
+            elif rejected_match:
+                rejected = [tuple(count.split(': ')) for count in rejected_match.group(1).split(', ')]
+                rejected = [(name, int(count)) for name, count in rejected]
+                rejected.append(('wells', int(rejected_match.group(2))))
+            elif skipped_match:
+                skipped = list(map(int, skipped_match.groups()))
+            elif well_match:
+                well_lines.append((int(well_match.group(1)), shard_index, line_no, line))
+            elif 'Generated consensus file' not in line:
+                header.append(line)
+    return header, well_lines, totals, rejected, skipped
+
+
+def merge_log_files(log_files, out_file, fasta_file):
+    """
+    Merge the log files of the shards into out_file: the header lines of each
+    shard, then all the per-well lines in well order, then the added up totals
+    """
+    headers, all_well_lines, totals, rejected, skipped = [], [], [], [], []
+    for i, log_file in enumerate(log_files):
+        header, well_lines, shard_totals, shard_rejected, shard_skipped = read_log_file(log_file, i)
+        headers.extend(header)
+        all_well_lines.append(well_lines)
+        totals.append(shard_totals)
+        if shard_rejected:
+            rejected.append(shard_rejected)
+        if shard_skipped:
+            skipped.append(shard_skipped)
+
+    reads = sum(t['reads'] for t in totals)
+    used  = sum(t['used'] for t in totals)
+    wells = sum(t['wells'] for t in totals)
+    with open(out_file, 'w') as outf:
+        outf.write("INFO: Merged %s shards - %s\n" % (len(log_files), ", ".join(log_files)))
+        outf.writelines(headers)
+        for well_line in heapq.merge(*all_well_lines):
+            outf.write(well_line[-1])
+        outf.write("INFO: Generated consensus file - %s\n" % fasta_file)
+        outf.write("INFO: Read total {0} reads from input file, did ccs on total {1} reads "
+                   "({2} separate wells). Used {3:.2f} % of the input reads\n".format(
+                        reads, used, wells, (used / float(reads))*100.0 if reads else 0.0))
+        if rejected:
+            counts = [(name, sum(r[i][1] for r in rejected)) for i, (name, _) in enumerate(rejected[0])]
+            outf.write("INFO: Rejected reads - {0}. Rejected {1} wells with too few reads\n".format(
+                            ", ".join("{0}: {1}".format(*count) for count in counts[:-1]),
+                            counts[-1][1]))
+        if skipped:
+            outf.write("INFO: Early termination skipped {0} filtered reads in {1} of the "
+                       "{2} wells\n".format(*[sum(s[i] for s in skipped) for i in range(3)]))
+
+
+# ==============================================================================
+
+def parse_opts():
+    parser = argparse.ArgumentParser(description=PROG_DESC)
+    parser.add_argument("output_file_prefix", help="Prefix of the merged consensus file")
+    parser.add_argument("--fasta_files", nargs='+', required=True,
+        help="Consensus (.fa) files of the shards")
+    parser.add_argument("--log_files", nargs='+',
+        help="Log files of the shards (optional)")
+    parser.add_argument("--log_file", type=str,
+        help="Merged log file. Defaults to stonyccs_report.txt in cwd")
+    opts = parser.parse_args()
+
+    if not opts.log_file:
+        opts.log_file = os.path.join(os.getcwd(), 'stonyccs_report.txt')
+    return opts
+
+
+def main():
+    opts = parse_opts()
+
+    fasta_file = opts.output_file_prefix + '.fa'
+    nwells = merge_fasta_files(opts.fasta_files, fasta_file)
+    print("Merged %s wells from %s shards into %s" % (nwells, len(opts.fasta_files), fasta_file))
+
+    if opts.log_files:
+        merge_log_files(opts.log_files, opts.log_file, fasta_file)
+        print("Merged logs into %s" % opts.log_file)
+
+if __name__ == '__main__':
+    main()